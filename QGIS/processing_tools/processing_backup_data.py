@@ -22,7 +22,10 @@ from qgis.PyQt.QtCore import QCoreApplication
 from qgis.core import (QgsProcessingAlgorithm,
                        QgsProcessingParameterFolderDestination,
                        QgsProject,
-                       QgsProcessingParameterFile)
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterNumber)
 
 from open_flightline_mini import flightline_project
 from open_flightline_mini import project_setup
@@ -41,8 +44,13 @@ class BackupGPKGData(QgsProcessingAlgorithm):
 
     PROJECT_FOLDER = 'PROJECT_FOLDER'
     PROJECT_GPKG = 'PROJECT_GPKG'
+    BACKUP_MODE = 'BACKUP_MODE'
+    COMPRESS = 'COMPRESS'
+    RETENTION = 'RETENTION'
     RESULT = 'RESULT'
 
+    BACKUP_MODES = ['Snapshot of the gpkg in the backups folder', 'Layer copies inside the gpkg']
+
     def tr(self, string):
         """
         Returns a translatable string with the self.tr() function.
@@ -92,7 +100,10 @@ class BackupGPKGData(QgsProcessingAlgorithm):
         should provide a basic description about what the algorithm does and the
         parameters and outputs associated with it..
         """
-        return self.tr("Backs up and creates a fresh set of working layers")
+        return self.tr("Backs up and creates a fresh set of working layers.\n"
+                       "A snapshot is a copy of the whole gpkg written to the backups folder in the project "
+                       "folder, the oldest snapshots past the number kept are removed. "
+                       "Layer copies are written into the gpkg as <layer>_<backup number>.")
 
     def initAlgorithm(self, config=None):
         """
@@ -123,6 +134,23 @@ class BackupGPKGData(QgsProcessingAlgorithm):
                                        defaultValue=project.project_gpkg
                                        ))
 
+        self.addParameter(
+            QgsProcessingParameterEnum(self.BACKUP_MODE,
+                                       "Backup Mode",
+                                       options=self.BACKUP_MODES,
+                                       defaultValue=0))
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(self.COMPRESS,
+                                          "Compress Snapshot",
+                                          defaultValue=False))
+
+        self.addParameter(
+            QgsProcessingParameterNumber(self.RETENTION,
+                                         "Snapshots Kept (0 keeps all)",
+                                         minValue=0,
+                                         defaultValue=project.snapshot_retention))
+
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
@@ -143,14 +171,28 @@ class BackupGPKGData(QgsProcessingAlgorithm):
             context
         )
 
+        backup_mode = self.parameterAsEnum(parameters, self.BACKUP_MODE, context)
+        compress = self.parameterAsBool(parameters, self.COMPRESS, context)
+        retention = self.parameterAsInt(parameters, self.RETENTION, context)
+
         project = flightline_project.FlightlineProject()
         project.__set_project_folder__(project_folder)
         project.read_from_json_config()
         project.__set_gpkg_path__(gpkg_location)
 
         setup = project_setup.GeopackageDataStore(project_folder, gpkg_location)
-        backup_number = setup.gpkg_backup_number
-        setup.gpkg_backup_layers()
+        if backup_mode == 0:
+            project.snapshot_retention = retention
+            project.write_to_config_json()
+            snapshot_path, removed = project.snapshot_backup(compress)
+            feedback.pushInfo(f"Created Snapshot: {snapshot_path}")
+            for snapshot in removed:
+                feedback.pushInfo(f"Removed Snapshot: {snapshot}")
+            result = f"Snapshot: {snapshot_path}"
+        else:
+            backup_number = setup.gpkg_backup_number
+            setup.gpkg_backup_layers()
+            result = f"Backup Number: {backup_number + 1}"
         setup.create_gpkg_layers(setup.working_layers_generation)
 
-        return {self.RESULT: f"Backup Number: {backup_number + 1}"}
+        return {self.RESULT: result}
@@ -41,6 +41,7 @@ class CleanupBackupData(QgsProcessingAlgorithm):
     PROJECT_FOLDER = 'PROJECT_FOLDER'
     PROJECT_GPKG = 'PROJECT_GPKG'
     LAYERS_REMOVED = 'LAYERS REMOVED'
+    BYTES_RECLAIMED = 'BYTES_RECLAIMED'
 
     def tr(self, string):
         """
@@ -133,6 +134,10 @@ class CleanupBackupData(QgsProcessingAlgorithm):
         project.__set_gpkg_path__(project_gpkg)
 
         setup = project_setup.GeopackageDataStore(project_folder, project_gpkg)
-        layers_removed, errors = setup.cleanup_gpkg_copies()
+        layers_removed, errors, bytes_reclaimed = setup.cleanup_gpkg_copies()
+        for error in errors:
+            feedback.reportError(f"{error}")
+        feedback.pushInfo(f"Removed {len(layers_removed)} layers, reclaimed {bytes_reclaimed / 1024 ** 2:.1f} MB")
 
-        return {self.LAYERS_REMOVED: f"{layers_removed}"}
+        return {self.LAYERS_REMOVED: f"{layers_removed}",
+                self.BYTES_RECLAIMED: bytes_reclaimed}
@@ -156,7 +156,7 @@ class CombineAndChangeLoadSize(QgsProcessingAlgorithm):
             parameters, self.PROJECT_GPKG, context)
 
         machine_code = self.parameterAsString(
-            parameters, self.MACHINE_CODE, context)
+            parameters, self.MACHINE_CODE, context).upper()
 
         load_numbers = parameters['LOAD_NUMBERS']
         load_numbers_list = [int(i) for i in load_numbers]
@@ -177,18 +177,14 @@ class CombineAndChangeLoadSize(QgsProcessingAlgorithm):
             \nSelected Load Numbers:\ {load_numbers_list}\nAvailable Load Numbers: {heli_load_numbers}')
             return {}
 
-        # Update the heli points dataset
-        fl_project.combine_loads_for_heli_points(machine_code, load_numbers_list, bucket_size)
-        fl_project.combine_loads_for_flight_path(machine_code, load_numbers_list)
-
-        # Delete data for the selected loads out of the other tables and recalculate
-        for load in load_numbers_list:
-            feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Removing data for Load: {load}")
-            for table in ['heli_bait_lines_detailed', 'heli_bait_lines', 'heli_bait_lines_buffered',
-                'load_summary', 'flight_path']:
-                feedback.pushInfo(
-                    f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Removing data from Table: {table}")
-                fl_project.delete_machine_load_data(machine_code, load, table)
+        # Update the heli points dataset and delete data for the selected loads out of the other tables
+        # in one transaction, then recalculate
+        feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Combining Loads: {load_numbers_list}")
+        records = fl_project.combine_machine_loads(machine_code, load_numbers_list, bucket_size,
+                                                   ['heli_bait_lines_detailed', 'heli_bait_lines',
+                                                    'heli_bait_lines_buffered', 'load_summary', 'flight_path'])
+        for table, record_count in records.items():
+            feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: {record_count} records in Table: {table}")
 
         load = load_numbers_list[0]
         feedback.pushInfo(f"Recalculating data from Heli points table for load: {load}")
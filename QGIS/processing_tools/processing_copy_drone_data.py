@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+import sys
+from pathlib import Path
+import os
+repo_path = os.path.join(Path.home(), 'Documents', 'Github', 'open-flightline-mini-public')
+sys.path.append(repo_path)
+
+from datetime import datetime
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessingParameterString,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterNumber,
+                       QgsProject,
+                       QgsProcessingParameterFile)
+
+from open_flightline_mini import flightline_project
+from open_flightline_mini import data_reader
+from open_flightline_mini import drone_log
+
+
+class CopyDroneData(QgsProcessingAlgorithm):
+    """
+    Copies the drone telemetry logs into the raw data folder and loads the
+    good GPS fixes into the drone_points table.
+    """
+
+    # Constants used to refer to parameters and outputs. They will be
+    # used when calling the algorithm from another algorithm, or when
+    # calling from the QGIS console.
+    PROJECT_FOLDER = 'PROJECT_FOLDER'
+    PROJECT_GPKG = 'PROJECT_GPKG'
+    DRONE_DATA_SOURCE = 'DRONE_DATA_SOURCE'
+    MACHINE_CODE = 'MACHINE_CODE'
+    DAY_NUMBER = 'DAY_NUMBER'
+    DOWNLOAD_TIME = 'DOWNLOAD_TIME'
+    MAX_HDOP = 'MAX_HDOP'
+    SWATH_WIDTH = 'SWATH_WIDTH'
+    RESULTS = 'RESULTS'
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Data Processing', string)
+
+    def createInstance(self):
+        return CopyDroneData()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'copy_drone_data'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr('4. Copy Drone Data')
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr('Open Flightline Mini')
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'open_flightline'
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it.
+        """
+        return self.tr("Copies drone telemetry logs (csv) and loads them into the drone points table")
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+        project = flightline_project.FlightlineProject()
+        project.__set_project_folder__(QgsProject.instance().absolutePath())
+        # QGIS runs when intializing before the QgsProject folder is set
+        if not QgsProject.instance().absolutePath():
+            return
+        project.read_from_json_config()
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.PROJECT_FOLDER,
+                "Project Folder",
+                QgsProcessingParameterFile.Behavior(1),
+                defaultValue=project.project_folder
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(self.PROJECT_GPKG,
+                                       "Project GPKG Location",
+                                       extension='gpkg',
+                                       defaultValue=project.project_gpkg
+                                       ))
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.DRONE_DATA_SOURCE,
+                "Drone Logs Folder",
+                QgsProcessingParameterFile.Behavior(1)
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterString(self.MACHINE_CODE,
+                                         "Machine Code"
+                                         )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(self.DAY_NUMBER,
+                                         'Day Number',
+                                         defaultValue=flightline_project.get_op_day(
+                                             QgsProject().instance().absolutePath())
+                                         )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterString(self.DOWNLOAD_TIME,
+                                         "Download Time",
+                                         defaultValue=data_reader.current_download_time()
+                                         )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(self.MAX_HDOP,
+                                         'Maximum HDOP',
+                                         type=QgsProcessingParameterNumber.Double,
+                                         defaultValue=drone_log.MAX_HDOP
+                                         )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(self.SWATH_WIDTH,
+                                         'Swath Width (when not in the logs)',
+                                         type=QgsProcessingParameterNumber.Double,
+                                         optional=True
+                                         )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+        if not QgsProject.instance().absolutePath():
+            return
+
+        project_folder = self.parameterAsString(parameters, self.PROJECT_FOLDER, context)
+        project_gpkg = self.parameterAsString(parameters, self.PROJECT_GPKG, context)
+        drone_data_source = self.parameterAsString(parameters, self.DRONE_DATA_SOURCE, context)
+        machine_code = self.parameterAsString(parameters, self.MACHINE_CODE, context).upper()
+        operation_day = self.parameterAsString(parameters, self.DAY_NUMBER, context)
+        download_time = self.parameterAsString(parameters, self.DOWNLOAD_TIME, context)
+        max_hdop = self.parameterAsDouble(parameters, self.MAX_HDOP, context)
+        swath_width = None
+        if parameters.get(self.SWATH_WIDTH) is not None:
+            swath_width = self.parameterAsDouble(parameters, self.SWATH_WIDTH, context)
+
+        fl_project = flightline_project.FlightlineProject()
+        fl_project.__set_project_folder__(project_folder)
+        fl_project.read_from_json_config()
+        fl_project.__set_gpkg_path__(project_gpkg)
+        fl_project.op_day = operation_day
+
+        valid_download_time = data_reader.data_destination_checks(fl_project.raw_data_folder,
+                                                                  machine_code,
+                                                                  fl_project.op_day,
+                                                                  download_time)
+        if valid_download_time != download_time:
+            feedback.pushWarning(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Folder for download time\
+             {download_time} already exits, using {valid_download_time}")
+        data_destination = os.path.join(fl_project.raw_data_folder,
+                                        machine_code,
+                                        f"{operation_day}_{valid_download_time}")
+        data_reader.copy_usb_data(drone_data_source, data_destination)
+        feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Save Destination: {data_destination}")
+
+        drone_logs = [i for i in drone_log.find_drone_logs(data_destination) if drone_log.is_drone_log(i)]
+        feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Drone Logs: {drone_logs}")
+        if not drone_logs:
+            feedback.pushWarning(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: No drone logs found")
+            return {self.RESULTS: 'No drone logs'}
+
+        batch_id = f"{machine_code}_{operation_day}_{valid_download_time}"
+        feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Batch ID: {batch_id}")
+        drone_data = data_reader.DroneDataBatch(src_paths=drone_logs,
+                                                data_source_srid=fl_project.data_source_srid,
+                                                data_store_srid=fl_project.data_store_srid,
+                                                machine_code=machine_code,
+                                                batch_id=batch_id,
+                                                max_hdop=max_hdop,
+                                                swath_width=swath_width)
+        result = fl_project.load_drone_batch_into_drone_points(drone_data)
+        feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: {drone_data.fixes_read} fixes read, "
+                          f"{drone_data.fixes_rejected} rejected (no position or HDOP over {max_hdop})")
+        if drone_data.fixes_without_time:
+            feedback.pushWarning(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: {drone_data.fixes_without_time} "
+                                 f"fixes dropped with a blank or unreadable time")
+        feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: {result['inserted']} drone points added, "
+                          f"{result['updated']} updated")
+
+        fl_project.write_to_config_json()
+        return {self.RESULTS: 'Finished'}
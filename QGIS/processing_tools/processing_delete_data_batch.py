@@ -25,7 +25,6 @@ from qgis.core import (QgsProcessingAlgorithm,
                        QgsProject)
 from qgis import processing
 from open_flightline_mini import flightline_project
-from open_flightline_mini import data_reader
 
 
 class DeleteDataBatches(QgsProcessingAlgorithm):
@@ -147,11 +146,10 @@ class DeleteDataBatches(QgsProcessingAlgorithm):
 
         for batch in data_batches:
             feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Deleting data for batch: {batch}")
-            for table in ['heli_bait_lines', 'heli_bait_lines_detailed', 'heli_bait_lines_buffered',
-                          'heli_points', 'load_summary', 'flight_path']:
-                feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Deleting data from: {table}")
-                records_deleted = fl_project.delete_batch_id_data(batch, table)
-                feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: {records_deleted} from table {table}")
-            feedback.pushInfo(data_reader.archive_data_batch(fl_project.raw_data_folder, batch))
+            # All the tables are deleted from in one transaction, the raw data is only archived after it commits
+            records_deleted, archive_message = fl_project.delete_data_batch(batch)
+            for table, records in records_deleted.items():
+                feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: {records} from table {table}")
+            feedback.pushInfo(archive_message)
 
         return results
\ No newline at end of file
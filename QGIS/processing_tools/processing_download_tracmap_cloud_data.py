@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+import sys
+from pathlib import Path
+import os
+repo_path = os.path.join(Path.home(), 'Documents', 'Github', 'open-flightline-mini-public')
+sys.path.append(repo_path)
+
+from datetime import datetime
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsApplication,
+                       QgsAuthMethodConfig,
+                       QgsProcessingException,
+                       QgsProcessingParameterAuthConfig,
+                       QgsProcessingParameterString,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterNumber,
+                       QgsProject,
+                       QgsProcessingParameterFile)
+
+from open_flightline_mini import flightline_project
+from open_flightline_mini import data_reader
+
+
+class DownloadTracmapCloudData(QgsProcessingAlgorithm):
+    """
+    Downloads the jobs that have been updated since the last sync from the
+    Tracmap cloud and loads them into the project.
+    """
+
+    # Constants used to refer to parameters and outputs. They will be
+    # used when calling the algorithm from another algorithm, or when
+    # calling from the QGIS console.
+    PROJECT_FOLDER = 'PROJECT_FOLDER'
+    PROJECT_GPKG = 'PROJECT_GPKG'
+    TRACMAP_CLOUD_URL = 'TRACMAP_CLOUD_URL'
+    TRACMAP_CLOUD_AUTHCFG = 'TRACMAP_CLOUD_AUTHCFG'
+    MACHINE_CODE = 'MACHINE_CODE'
+    DAY_NUMBER = 'DAY_NUMBER'
+    RESULTS = 'RESULTS'
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Data Processing', string)
+
+    def createInstance(self):
+        return DownloadTracmapCloudData()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'download_tracmap_cloud_data'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr('4. Download Tracmap Cloud Data')
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr('Open Flightline Mini')
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'open_flightline'
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it.
+        """
+        return self.tr("Downloads the jobs updated since the last sync from the Tracmap cloud")
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+        project = flightline_project.FlightlineProject()
+        project.__set_project_folder__(QgsProject.instance().absolutePath())
+        # QGIS runs when intializing before the QgsProject folder is set
+        if not QgsProject.instance().absolutePath():
+            return
+        project.read_from_json_config()
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.PROJECT_FOLDER,
+                "Project Folder",
+                QgsProcessingParameterFile.Behavior(1),
+                defaultValue=project.project_folder
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(self.PROJECT_GPKG,
+                                       "Project GPKG Location",
+                                       extension='gpkg',
+                                       defaultValue=project.project_gpkg
+                                       ))
+
+        self.addParameter(
+            QgsProcessingParameterString(self.TRACMAP_CLOUD_URL,
+                                         "Tracmap Cloud URL",
+                                         defaultValue=project.tracmap_cloud_url
+                                         )
+        )
+
+        # A Basic auth config in the QGIS auth manager with the api key as its password
+        self.addParameter(
+            QgsProcessingParameterAuthConfig(self.TRACMAP_CLOUD_AUTHCFG,
+                                             "Tracmap Cloud API Key (Authentication Config)",
+                                             defaultValue=project.tracmap_cloud_authcfg,
+                                             optional=True
+                                             )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(self.MACHINE_CODE,
+                                       'Machine Codes',
+                                       flightline_project.get_helicopter_list_from_project_folder(
+                                           QgsProject().instance().absolutePath()),
+                                       allowMultiple=True,
+                                       usesStaticStrings=True
+                                       )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(self.DAY_NUMBER,
+                                         'Day Number',
+                                         defaultValue=flightline_project.get_op_day(
+                                             QgsProject().instance().absolutePath())
+                                         )
+        )
+
+    def load_api_key(self, authcfg):
+        """
+        Reads the api key out of the QGIS auth manager, it is the password
+        of the auth config
+        :param authcfg: str: auth config id
+        :return: str or None
+        """
+        if not authcfg:
+            return None
+        auth_config = QgsAuthMethodConfig()
+        if not QgsApplication.authManager().loadAuthenticationConfig(authcfg, auth_config, True):
+            raise QgsProcessingException(f"Could not load the authentication config {authcfg}")
+        return auth_config.config('password')
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+        if not QgsProject.instance().absolutePath():
+            return
+
+        project_folder = self.parameterAsString(parameters, self.PROJECT_FOLDER, context)
+        project_gpkg = self.parameterAsString(parameters, self.PROJECT_GPKG, context)
+        cloud_url = self.parameterAsString(parameters, self.TRACMAP_CLOUD_URL, context)
+        cloud_authcfg = self.parameterAsString(parameters, self.TRACMAP_CLOUD_AUTHCFG, context)
+        cloud_api_key = self.load_api_key(cloud_authcfg)
+        machine_codes = [i.upper() for i in parameters['MACHINE_CODE']]
+        operation_day = self.parameterAsString(parameters, self.DAY_NUMBER, context)
+        download_time = data_reader.current_download_time()
+
+        fl_project = flightline_project.FlightlineProject()
+        fl_project.__set_project_folder__(project_folder)
+        fl_project.read_from_json_config()
+        fl_project.__set_gpkg_path__(project_gpkg)
+
+        fl_project.op_day = operation_day
+        fl_project.tracmap_cloud_url = cloud_url
+        fl_project.tracmap_cloud_authcfg = cloud_authcfg
+
+        for machine_code in machine_codes:
+            last_sync = fl_project.tracmap_cloud_last_sync.get(machine_code)
+            batch_id = f"{machine_code}_{operation_day}_{download_time}"
+            feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Machine Code: {machine_code}")
+            feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Last Sync: {last_sync}")
+            feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Batch ID: {batch_id}")
+
+            transfer_data = data_reader.TracmapDataBatch(src_paths=[cloud_url],
+                                                         src_type='tracmap_cloud',
+                                                         data_source_srid=fl_project.data_source_srid,
+                                                         data_store_srid=fl_project.data_store_srid,
+                                                         machine_code=machine_code,
+                                                         batch_id=batch_id,
+                                                         swath_translation=fl_project.get_machine_swath_translation(
+                                                             machine_code=machine_code),
+                                                         cloud_api_key=cloud_api_key,
+                                                         cloud_last_sync=last_sync)
+            # Pages are written as they arrive rather than held until the download ends
+            points_loaded = fl_project.load_data_batch_into_heli_points(transfer_data,
+                                                                        chunk_size=data_reader.POINT_CHUNK_SIZE)
+            feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: {points_loaded} new points transferred into gpkg")
+            # Only move the sync point on once every page is in the gpkg
+            fl_project.tracmap_cloud_last_sync[machine_code] = transfer_data.cloud_last_sync
+            fl_project.write_to_config_json()
+            if not points_loaded:
+                continue
+
+            load_numbers = fl_project.calculate_load_number_by_machine(machine_code)
+            feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: New Load Numbers: {load_numbers}")
+            for load in load_numbers:
+                feedback.pushInfo('\n')
+                result = fl_project.calculate_detailed_bait_lines_by_machine_and_load(machine_code, load)
+                fl_project.calculate_bait_lines_by_machine_and_load(machine_code, load)
+                fl_project.calculate_sq_buffer_bait_lines_by_machine_and_load(machine_code, load)
+                fl_project.calculate_flight_path(machine_code, load)
+                feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Coverage Rate Details for load {load}\n{result}")
+                summary = fl_project.calculate_summary_for_load_machine(machine_code, load)
+                feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Summary Details:{summary}")
+
+        fl_project.write_to_config_json()
+        return {self.RESULTS: 'Finished'}
@@ -16,12 +16,14 @@ import os
 repo_path = os.path.join(Path.home(), 'Documents', 'Github', 'open-flightline-mini-public')
 sys.path.append(repo_path)
 
+from contextlib import closing
 from datetime import datetime
 from qgis.PyQt.QtCore import QCoreApplication
 from qgis.core import (QgsProcessingParameterString,
                        QgsProcessingParameterEnum,
                        QgsProcessingAlgorithm,
                        QgsProcessingParameterNumber,
+                       QgsProcessingParameterBoolean,
                        QgsProject,
                        QgsProcessingParameterFile,
                        QgsCoordinateReferenceSystem,
@@ -50,6 +52,8 @@ class CopyTracmapDataUSB(QgsProcessingAlgorithm):
     MACHINE_CODE = 'MACHINE_CODE'
     DAY_NUMBER = 'DAY_NUMBER'
     DOWNLOAD_TIME = 'DOWNLOAD_TIME'
+    INCREMENTAL = 'INCREMENTAL'
+    PARALLEL_READ = 'PARALLEL_READ'
     RESULS = 'RESULTS'
 
     def tr(self, string):
@@ -166,6 +170,21 @@ class CopyTracmapDataUSB(QgsProcessingAlgorithm):
                                          )
         )
 
+        self.addParameter(
+            QgsProcessingParameterBoolean(self.INCREMENTAL,
+                                          "Only copy new or changed jobs",
+                                          defaultValue=True
+                                          )
+        )
+
+        # Off by default, the worker processes need a python install that can import the plugin
+        self.addParameter(
+            QgsProcessingParameterBoolean(self.PARALLEL_READ,
+                                          "Read job folders in parallel (needs a standalone python with the plugin)",
+                                          defaultValue=False
+                                          )
+        )
+
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
@@ -182,9 +201,11 @@ class CopyTracmapDataUSB(QgsProcessingAlgorithm):
         project_folder = self.parameterAsString(parameters, self.PROJECT_FOLDER, context)
         project_gpkg = self.parameterAsString(parameters, self.PROJECT_GPKG, context)
         tracmap_data_source = self.parameterAsString(parameters, self.TRACMAP_DATA_SOURCE, context)
-        machine_code = parameters['MACHINE_CODE']
+        machine_code = parameters['MACHINE_CODE'].upper()
         operation_day = self.parameterAsString(parameters, self.DAY_NUMBER,context)
         download_time = self.parameterAsString(parameters, self.DOWNLOAD_TIME, context)
+        incremental = self.parameterAsBool(parameters, self.INCREMENTAL, context)
+        processes = os.cpu_count() if self.parameterAsBool(parameters, self.PARALLEL_READ, context) else None
 
 
         feedback.pushInfo(f"Parameters:\n Machine Code: {machine_code}\n Operation Day: {operation_day}")
@@ -195,9 +216,12 @@ class CopyTracmapDataUSB(QgsProcessingAlgorithm):
         fl_project.__set_project_folder__(project_folder)
         fl_project.read_from_json_config()
         fl_project.__set_gpkg_path__(project_gpkg)
-        coordinate_transform = QgsCoordinateTransform(QgsCoordinateReferenceSystem(fl_project.data_source_srid),
-                                                      QgsCoordinateReferenceSystem(fl_project.data_store_srid),
-                                                      QgsProject().instance())
+        # Checked before anything is copied off the USB
+        upgrade_needed = fl_project.project_data_upgrade_needed()
+        if upgrade_needed:
+            feedback.pushWarning(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: {upgrade_needed}, "
+                                 f"run the 1. Upgrade Aerial Project Data tool first")
+            return {self.RESULS: 'Upgrade needed'}
 
         fl_project.op_day = operation_day
         fl_project.last_data_source_location = tracmap_data_source
@@ -213,7 +237,8 @@ class CopyTracmapDataUSB(QgsProcessingAlgorithm):
                                         machine_code,
                                         f"{operation_day}_{valid_download_time}")
 
-        data_reader.copy_usb_data(tracmap_data_source, data_destination)
+        # Scan the USB once, the copied folders are then looked up from the manifest
+        manifest = data_reader.get_data_source_manifest(tracmap_data_source, refresh=True)
 
         feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Tracmap Data Source: {tracmap_data_source}")
         feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Machine Code: {machine_code}")
@@ -221,32 +246,68 @@ class CopyTracmapDataUSB(QgsProcessingAlgorithm):
         feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Download Time: {download_time}")
         feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Save Destination: {data_destination}")
 
-        new_valid_folders = data_reader.list_valid_tracmap_folders(data_destination)
-        if not new_valid_folders:
-            feedback.pushWarning("{datetime.now()}: None of the copied folders have data")
-            return {self.RESULS: 'No Folders with data'}
-        data_sorce_type = data_reader.data_source_type(new_valid_folders[0])
         batch_id = f"{machine_code}_{operation_day}_{download_time}"
-
-        feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Data Source Type: {data_sorce_type}")
-        feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Valid Folders: {new_valid_folders}")
-        feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Machine Code: {machine_code}")
         feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Batch ID: {batch_id}")
-
         swath_translation = fl_project.get_machine_swath_translation(machine_code=machine_code)
 
-        transfer_data = data_reader.TracmapDataBatch(src_paths=new_valid_folders,
-                                                     src_type=data_sorce_type,
-                                                     coordinate_transform=coordinate_transform,
-                                                     machine_code=machine_code,
-                                                     batch_id=batch_id,
-                                                     swath_translation=swath_translation)
-
-        feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Data Source Read")
-        transfer_data.read_datasource()
-
-        fl_project.load_data_batch_into_heli_points(transfer_data)
+        if incremental:
+            transfer_data = data_reader.TracmapDataBatch(src_paths=[],
+                                                         src_type=None,
+                                                         data_source_srid=fl_project.data_source_srid,
+                                                         data_store_srid=fl_project.data_store_srid,
+                                                         machine_code=machine_code,
+                                                         batch_id=batch_id,
+                                                         swath_translation=swath_translation)
+            # Copy, parse and write as a pipeline, each job folder is parsed as soon as it is copied
+            parsed_folders = data_reader.UsbIngest(transfer_data,
+                                                   tracmap_data_source,
+                                                   data_destination,
+                                                   os.path.join(fl_project.raw_data_folder, machine_code),
+                                                   processes=processes)
+            # Closing the pipeline stops the USB copy if the gpkg write fails, only the
+            # job folders whose points were written are skipped by the next download
+            with closing(parsed_folders):
+                point_chunks = transfer_data.iter_point_chunks(data_reader.POINT_CHUNK_SIZE,
+                                                               folder_layers_source=parsed_folders,
+                                                               folder_written=parsed_folders.folder_written)
+                fl_project.load_data_batch_into_heli_points(transfer_data, point_chunks=point_chunks)
+            feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: New or changed jobs: {transfer_data.src_paths}")
+            if not transfer_data.src_paths:
+                feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: No new jobs with data on the USB")
+                fl_project.write_to_config_json()
+                return {self.RESULS: 'No new jobs'}
+            feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Data Source Type: {transfer_data.src_type}")
+        else:
+            data_reader.copy_usb_data(tracmap_data_source, data_destination)
+            new_valid_folders = manifest.valid_tracmap_folders(root=data_destination)
+            if not new_valid_folders:
+                feedback.pushWarning("{datetime.now()}: None of the copied folders have data")
+                return {self.RESULS: 'No Folders with data'}
+            data_sorce_type = manifest.folder_source_type(new_valid_folders[0], root=data_destination)
+
+            feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Data Source Type: {data_sorce_type}")
+            feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Valid Folders: {new_valid_folders}")
+
+            transfer_data = data_reader.TracmapDataBatch(src_paths=new_valid_folders,
+                                                         src_type=data_sorce_type,
+                                                         data_source_srid=fl_project.data_source_srid,
+                                                         data_store_srid=fl_project.data_store_srid,
+                                                         machine_code=machine_code,
+                                                         batch_id=batch_id,
+                                                         swath_translation=swath_translation)
+
+            feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Data Source Read")
+            # Stream the job folders into the gpkg, optionally spreading the reading across the cores of the laptop
+            fl_project.load_data_batch_into_heli_points(transfer_data,
+                                                        chunk_size=data_reader.POINT_CHUNK_SIZE,
+                                                        processes=processes)
+        if transfer_data.parallel_read_error:
+            feedback.pushWarning(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: {transfer_data.parallel_read_error}")
         feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Data Source transferred into gpkg")
+        summaries_loaded = fl_project.load_data_batch_into_tracmap_summary(transfer_data)
+        feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: {summaries_loaded} Tracmap summaries loaded")
+        for summary_warning in transfer_data.summary_warnings:
+            feedback.pushWarning(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: {summary_warning}")
         load_numbers = fl_project.calculate_load_number_by_machine(machine_code)
         feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: New Load Numbers: {load_numbers}")
         # Iterate over load numbers and update the coverage rates and bait line tables
@@ -262,6 +323,10 @@ class CopyTracmapDataUSB(QgsProcessingAlgorithm):
             feedback.pushInfo(
                 f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Summary Details:{summary}")
 
+        # Tracmap's own running totals against the calculated load summaries
+        feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Tracmap Summary Cross Check: "
+                          f"{fl_project.tracmap_summary_cross_check(machine_code)}")
+
         # Zoom the map canvas to the new data extent
         #extent = fl_project.zoom_to_flight_data_extent(machine_code=machine_code, load_numbers=load_numbers)
         #if extent:
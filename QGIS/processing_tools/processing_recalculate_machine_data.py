@@ -136,7 +136,7 @@ class RecalculateMachineData(QgsProcessingAlgorithm):
 
         project_folder = self.parameterAsString(parameters, self.PROJECT_FOLDER, context)
         project_gpkg = self.parameterAsString(parameters, self.PROJECT_GPKG, context)
-        machine_code = self.parameterAsString(parameters, self.MACHINE_CODE, context)
+        machine_code = self.parameterAsString(parameters, self.MACHINE_CODE, context).upper()
 
         fl_project = flightline_project.FlightlineProject()
         fl_project.__set_project_folder__(project_folder)
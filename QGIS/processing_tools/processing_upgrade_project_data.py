@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+import sys
+from pathlib import Path
+import os
+repo_path = os.path.join(Path.home(), 'Documents', 'Github', 'open-flightline-mini-public')
+sys.path.append(repo_path)
+
+from datetime import datetime
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessingAlgorithm,
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterFile,
+                       QgsProject)
+
+from open_flightline_mini import flightline_project
+
+
+class UpgradeProjectData(QgsProcessingAlgorithm):
+    """
+    One off upgrade of the data of a project created by an older version,
+    run before loading new data into it.
+    """
+
+    # Constants used to refer to parameters and outputs. They will be
+    # used when calling the algorithm from another algorithm, or when
+    # calling from the QGIS console.
+    PROJECT_FOLDER = 'PROJECT_FOLDER'
+    PROJECT_GPKG = 'PROJECT_GPKG'
+    SNAPSHOT = 'SNAPSHOT'
+    RESULTS = 'RESULTS'
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Project Management', string)
+
+    def createInstance(self):
+        return UpgradeProjectData()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'upgrade_aerial_project_data'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr('1. Upgrade Aerial Project Data')
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr('Open Flightline Mini')
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'open_flightline'
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it.
+        """
+        return self.tr("Upgrades the data of a project created by an older version.\n"
+                       "The heli_points src_ids are rewritten in the current format and GPS fixes that were loaded "
+                       "twice are deleted, every deleted row is listed in the log. Machine codes are upper cased "
+                       "in every layer. The unique index that stops points "
+                       "being loaded twice is then created. Loading data is blocked until this has been run.")
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+        project = flightline_project.FlightlineProject()
+        project.__set_project_folder__(QgsProject.instance().absolutePath())
+        # QGIS runs when intializing before the QgsProject folder is set
+        if not QgsProject.instance().absolutePath():
+            return
+        project.read_from_json_config()
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.PROJECT_FOLDER,
+                "Project Folder",
+                QgsProcessingParameterFile.Behavior(1),
+                defaultValue=project.project_folder
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(self.PROJECT_GPKG,
+                                       "Project GPKG Location",
+                                       extension='gpkg',
+                                       defaultValue=project.project_gpkg
+                                       ))
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(self.SNAPSHOT,
+                                          "Snapshot the gpkg before upgrading",
+                                          defaultValue=True))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+        project_folder = self.parameterAsString(parameters, self.PROJECT_FOLDER, context)
+        project_gpkg = self.parameterAsString(parameters, self.PROJECT_GPKG, context)
+        snapshot = self.parameterAsBool(parameters, self.SNAPSHOT, context)
+
+        fl_project = flightline_project.FlightlineProject()
+        fl_project.__set_project_folder__(project_folder)
+        fl_project.read_from_json_config()
+        fl_project.__set_gpkg_path__(project_gpkg)
+
+        upgrade_needed = fl_project.project_data_upgrade_needed()
+        if not upgrade_needed:
+            feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: The project data is up to date")
+            return {self.RESULTS: 'Up to date'}
+        feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: {upgrade_needed}")
+
+        if snapshot:
+            snapshot_path, removed_snapshots = fl_project.snapshot_backup()
+            feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Created Snapshot: {snapshot_path}")
+
+        result = fl_project.upgrade_project_data()
+        feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: {result['rewritten']} heli_points "
+                          f"rewritten")
+        feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: {len(result['removed'])} "
+                          f"heli_points removed that repeat an earlier GPS fix")
+        for fid, machine_code, batch_id, src_id in result['removed']:
+            feedback.pushInfo(f"Removed fid {fid}, machine {machine_code}, batch {batch_id}, src_id {src_id}")
+        for table_name, updated in result['upper_cased'].items():
+            feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: {updated} machine codes upper cased "
+                              f"in {table_name}")
+        for index_name in result['indexes']:
+            feedback.pushInfo(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Created index {index_name}")
+
+        machine_codes = sorted(set([i[1] for i in result['removed']]))
+        if machine_codes:
+            feedback.pushWarning(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Run 6. Recalculate Machine Data "
+                                 f"for {machine_codes}, their loads were calculated with the repeated points")
+        if result['remaining']:
+            feedback.pushWarning(f"{datetime.strftime(datetime.now(), '%H:%M:%S')}: Not upgraded: "
+                                 f"{result['remaining']}")
+            return {self.RESULTS: 'Not upgraded'}
+        return {self.RESULTS: 'Finished'}
@@ -2,16 +2,186 @@
 # Intially  to load data from a Tracmap USB export
 # Then to load data from Tracmap Online (Tabula) and Drone.
 
+import hashlib
+import json
+import multiprocessing
 import os
+import queue
+import re
 import shutil
-from datetime import datetime, timedelta
+import struct
+import threading
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from functools import partial
 
-from qgis.core import (QgsVectorLayer,
-                       QgsFeature,
-                       QgsGeometry,
-                       QgsPoint)
+import numpy as np
+from osgeo import osr
 
-from open_flightline_mini import project_setup
+from open_flightline_mini import drone_log, flight_points, shapefile_reader, timestamp_codec, tracmap_cloud
+from open_flightline_mini.flight_points import unique_points
+
+
+# Coordinate transformations are reused across batches, keyed by (source_srid, store_srid)
+coordinate_transformers = {}
+
+
+# Source types that are read a folder at a time
+FOLDER_SOURCE_TYPES = ['tracmap_shapefile_baiting_lines', 'tracmap_shapefile_baiting_points',
+                       'tabula_shapefile_baiting_points']
+
+# Number of points in each chunk of a streamed read
+POINT_CHUNK_SIZE = 50000
+
+# Scanned data sources, keyed by the data source path. Rescanned when the
+# volume at the path changes, see data_source_volume
+data_source_manifests = {}
+
+# tracmap_summary field: words that must all be in the summary.txt key
+TRACMAP_SUMMARY_FIELDS = {'tm_nominal_area': ['nominal', 'area'],
+                          'tm_real_area': ['real', 'area'],
+                          'tm_distance_travelled': ['distance', 'travel'],
+                          'tm_distance_spreading': ['distance', 'spread']}
+
+# Units converted to hectares and kilometres, a figure in any other unit is skipped
+SUMMARY_UNIT_SCALES = {'ha': 1.0, 'm2': 0.0001, 'm²': 0.0001, 'ac': 0.404686, 'km': 1.0, 'm': 0.001, 'mi': 1.609344,
+                       'nm': 1.852}
+
+# Checksums of the raw data already copied for a machine, kept in raw_data_folder/<machine>
+RAW_DATA_MANIFEST_FILE = 'raw_data_manifest.json'
+CHECKSUM_BLOCK_SIZE = 1024 * 1024
+COPY_THREADS = 4
+
+# Seconds to wait for the first folder reader process to start
+POOL_START_TIMEOUT = 60
+
+
+class DataSourceManifest:
+    """
+    Single pass scan of a data source (usually a Tracmap USB export).
+    Lists each candidate job folder with its shapefile set, file sizes,
+    modified times, feature counts and detected source type.
+    """
+
+    def __init__(self, data_source):
+        self.data_source = data_source
+        self.dir_paths = []
+        self.folders = {}
+        self.volume = None
+
+    def scan(self):
+        """
+        Walks the data source once and records the job folders
+        :return: self
+        """
+        self.dir_paths = []
+        self.folders = {}
+        self.volume = data_source_volume(self.data_source)
+        for dirpath, dirnames, filenames in os.walk(self.data_source):
+            self.dir_paths.append(dirpath)
+            file_names = {i.lower(): i for i in filenames}
+            # Assume if log.shp or secondary.shp in the folder then it is a tracmap job export
+            if 'log.shp' not in file_names and 'secondary.shp' not in file_names:
+                continue
+
+            files = {}
+            for lower_name, file_name in file_names.items():
+                file_stat = os.stat(os.path.join(dirpath, file_name))
+                files[lower_name] = {'name': file_name, 'size': file_stat.st_size, 'mtime': file_stat.st_mtime}
+
+            feature_counts = {}
+            for shp_name in ['log.shp', 'secondary.shp']:
+                if shp_name in files:
+                    feature_counts[shp_name] = get_shapefile_feature_count(
+                        os.path.join(dirpath, files[shp_name]['name']))
+                else:
+                    feature_counts[shp_name] = 0
+
+            relative_path = os.path.relpath(dirpath, self.data_source)
+            self.folders[relative_path] = {'path': dirpath,
+                                           'files': files,
+                                           'feature_counts': feature_counts,
+                                           'source_type': data_source_type(dirpath)}
+        return self
+
+    @property
+    def log_file_count(self):
+        return len([i for i in self.folders.values() if 'log.shp' in i['files']])
+
+    def valid_tracmap_folders(self, root=None, relative_paths=None):
+        """
+        Folders that have features in both the log and secondary shapefiles
+        :param root: str: the folder the data source was copied to, defaults
+            to the data source
+        :param relative_paths: list<str>: only check these folders, e.g. the
+            folders copied by copy_usb_data_incremental
+        :return: list<str>
+        """
+        if not root:
+            root = self.data_source
+        return [os.path.normpath(os.path.join(root, relative_path))
+                for relative_path, folder in self.folders.items()
+                if (relative_paths is None or relative_path in relative_paths)
+                and all([count > 0 for count in folder['feature_counts'].values()])]
+
+    def folder_source_type(self, folder_path, root=None):
+        """
+        Returns the detected source type of a folder listed by valid_tracmap_folders
+        :param folder_path: str
+        :param root: str: the root the folder path is under
+        :return: str
+        """
+        if not root:
+            root = self.data_source
+        folder = self.folders.get(os.path.relpath(folder_path, root))
+        if not folder:
+            return 'Unrecognised Data Source'
+        return folder['source_type']
+
+    def match_machine_code(self, heli_list):
+        """
+        Checks if any of the machine codes are within the folder names.
+        :param heli_list: list<str>: ['PBX', 'PBY'...]
+        :return: str<heli_rego> or 'UNK'
+        """
+        for dirpath in self.dir_paths:
+            for machine_code in heli_list:
+                if machine_code.upper() in dirpath:
+                    return machine_code.upper()
+        return 'UNK'
+
+
+def data_source_volume(data_source):
+    """
+    Identifies what is mounted at the data source path. A different USB
+    stick at the same drive letter or mount point has a different device
+    (the volume serial number on Windows) and the root folder's modified
+    time changes when a job folder is added or removed.
+    :param data_source: str
+    :return: tuple(device, inode, modified time) or None if the path does not exist
+    """
+    try:
+        root_stat = os.stat(data_source)
+    except OSError:
+        return None
+    return root_stat.st_dev, root_stat.st_ino, root_stat.st_mtime_ns
+
+
+def get_data_source_manifest(data_source, refresh=False):
+    """
+    Returns the manifest for a data source, only scanning the data source if it
+    has not already been scanned, the volume at the path has changed since
+    the scan, or when refresh is set.
+    :param data_source: str
+    :param refresh: bool: rescan, e.g. at the start of an import
+    :return: DataSourceManifest
+    """
+    manifest = data_source_manifests.get(data_source)
+    if refresh or manifest is None or manifest.volume != data_source_volume(data_source):
+        data_source_manifests[data_source] = DataSourceManifest(data_source).scan()
+    return data_source_manifests[data_source]
 
 
 def log_file_count(data_source):
@@ -20,18 +190,12 @@ def log_file_count(data_source):
     :param data_source:
     :return: int
     """
-    log_count = 0
-    for dirpath, dirnames, filenames in os.walk(data_source):
-        if 'log.shp' in filenames:
-            log_count += 1
-    return log_count
+    return get_data_source_manifest(data_source).log_file_count
 
 
 def get_shapefile_feature_count(full_path):
-    shp_lyr = QgsVectorLayer(full_path, "shp_lyr", "ogr")
-    if not shp_lyr.isValid():
-        return 0
-    return shp_lyr.featureCount()
+    # Read from the dbf header rather than starting an ogr provider
+    return shapefile_reader.shapefile_record_count(full_path)
 
 
 def list_valid_tracmap_folders(src_folder):
@@ -39,19 +203,7 @@ def list_valid_tracmap_folders(src_folder):
     Searches the src_folder for shapefiles that have data
     :return:
     """
-    valid_folders = []
-    for dirpath, dirnames, filenames in os.walk(src_folder):
-        # Assume if log.shp in the folder then it is a tracmap job export
-        if all(['log.shp' not in [i.lower() for i in filenames],
-                'secondary.shp' not in [i.lower() for i in filenames]]):
-            continue
-        log_lyr_path = os.path.join(dirpath, 'log.shp')
-        secondary_lyr_path = os.path.join(dirpath, 'secondary.shp')
-        log_lyr_cnt = get_shapefile_feature_count(log_lyr_path)
-        secondary_lyr_cnt = get_shapefile_feature_count(secondary_lyr_path)
-        if all([log_lyr_cnt > 0, secondary_lyr_cnt > 0]):
-            valid_folders.append(dirpath)
-    return valid_folders
+    return get_data_source_manifest(src_folder).valid_tracmap_folders()
 
 
 def match_heli_rego_from_folder_names(heli_list, data_source):
@@ -62,12 +214,76 @@ def match_heli_rego_from_folder_names(heli_list, data_source):
     :param data_source: str: 'E:/Tracmap'
     :return: str<heli_rego>
     """
+    return get_data_source_manifest(data_source).match_machine_code(heli_list)
 
-    for dirpath, dirnames, filenames in os.walk(data_source):
-        for machine_code in heli_list:
-            if machine_code.upper() in dirpath:
-                return machine_code.upper()
-    return 'UNK'
+
+def get_coordinate_transformer(source_srid, store_srid):
+    """
+    Returns the cached transformation between two srids, creating it the
+    first time the pair is used.
+    :param source_srid: str: 'EPSG:4326'
+    :param store_srid: str: 'EPSG:2193'
+    :return: osr.CoordinateTransformation
+    """
+    key = (source_srid, store_srid)
+    if key not in coordinate_transformers:
+        spatial_refs = []
+        for srid in key:
+            spatial_ref = osr.SpatialReference()
+            spatial_ref.SetFromUserInput(srid)
+            # Keep x as longitude/easting regardless of the crs axis order
+            spatial_ref.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            spatial_refs.append(spatial_ref)
+        coordinate_transformers[key] = osr.CoordinateTransformation(*spatial_refs)
+    return coordinate_transformers[key]
+
+
+def transform_coordinates(x, y, source_srid, store_srid):
+    """
+    Transforms whole coordinate arrays from the data source srid to the data
+    store srid in a single call. Missing (nan) coordinates stay nan, a point
+    missing only one of x or y is missing both once transformed.
+    :param x: np.array<float64>
+    :param y: np.array<float64>
+    :param source_srid: str
+    :param store_srid: str
+    :return: tuple(np.array<float64>, np.array<float64>)
+    """
+    x = np.array(x, dtype=np.float64)
+    y = np.array(y, dtype=np.float64)
+    valid = np.isfinite(x) & np.isfinite(y)
+    if source_srid == store_srid or not valid.any():
+        return x, y
+    transformer = get_coordinate_transformer(source_srid, store_srid)
+    transformed = np.array(transformer.TransformPoints(np.column_stack([x[valid], y[valid]])), dtype=np.float64)
+    x[valid] = transformed[:, 0]
+    y[valid] = transformed[:, 1]
+    x[~valid] = np.nan
+    y[~valid] = np.nan
+    return x, y
+
+
+def interpolate_line_points(vertices, part_starts, speed, start_epoch):
+    """
+    Turns the vertices of a baiting line into points and interpolates the
+    time of each vertex from the distance travelled at the logged speed.
+    The log is 1 Hz so the time resolution is seconds, vertices that do not
+    reach a new second are dropped. The time carries on across parts but the
+    jump between parts is not counted as distance.
+    :param vertices: np.array<float64> (n, 2): transformed x, y vertices
+    :param part_starts: np.array<int64>: index of the first vertex of each part
+    :param speed: float: knots
+    :param start_epoch: int: time of the first vertex, milliseconds
+    :return: tuple(np.array<bool> keep, np.array<int64> epoch milliseconds) for each vertex
+    """
+    segment_lengths = np.hypot(*np.diff(vertices, axis=0).T)
+    part_starts = part_starts[(part_starts > 0) & (part_starts < len(vertices))]
+    segment_lengths[part_starts - 1] = 0
+    distances = np.concatenate([[0.0], np.cumsum(segment_lengths)])
+    seconds = np.floor(distances / (speed / 1.94384)).astype(np.int64)  # knots to m/s conversion
+    keep = np.ones(len(vertices), dtype=bool)
+    keep[1:] = np.diff(seconds) != 0
+    return keep, start_epoch + seconds * 1000
 
 
 def current_download_time():
@@ -89,6 +305,339 @@ def copy_usb_data(data_source, data_destination):
 
     shutil.copytree(data_source, data_destination)
 
+
+def file_checksum(file_path):
+    """
+    :param file_path: str
+    :return: str: sha256 hex digest of the file contents
+    """
+    checksum = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(partial(f.read, CHECKSUM_BLOCK_SIZE), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def job_folder_fingerprint(file_checksums):
+    """
+    Combines the checksums of the files in a job folder. The same job has the
+    same fingerprint on the USB and wherever it has been copied to.
+    :param file_checksums: dict<file_name: sha256>
+    :return: str
+    """
+    checksum = hashlib.sha256()
+    for file_name, file_sha in sorted((k.lower(), v) for k, v in file_checksums.items()):
+        checksum.update(f"{file_name}:{file_sha}\n".encode())
+    return checksum.hexdigest()
+
+
+class RawDataManifest:
+    """
+    Content hash of every file already copied into raw_data_folder/<machine>.
+    Saved as raw_data_manifest.json in the machine folder. Files are only
+    re-hashed when their size or modified time changes. Archived (deleted_)
+    download folders are left out so a deleted batch can be downloaded again.
+    A copied job stays pending until its points are in the gpkg, so a job
+    whose parse or write failed is copied again by the next download.
+    """
+
+    def __init__(self, machine_folder):
+        self.machine_folder = machine_folder
+        self.manifest_path = os.path.join(machine_folder, RAW_DATA_MANIFEST_FILE)
+        # relative path: {'size', 'mtime', 'sha256'}
+        self.files = {}
+        # Checksums of the data source files, keyed by relative path, size and mtime
+        self.source_checksums = {}
+        # Jobs copied but not yet written to the gpkg, fingerprint: relative folder path
+        self.pending_jobs = {}
+        # The copier thread and the gpkg writer both update the manifest
+        self.lock = threading.Lock()
+
+    def load(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+            self.files = manifest.get('files', {})
+            self.source_checksums = manifest.get('source_checksums', {})
+            self.pending_jobs = manifest.get('pending_jobs', {})
+        return self
+
+    def save(self):
+        os.makedirs(self.machine_folder, exist_ok=True)
+        temp_path = f"{self.manifest_path}.tmp"
+        with self.lock:
+            with open(temp_path, 'w') as f:
+                json.dump({'files': self.files, 'source_checksums': self.source_checksums,
+                           'pending_jobs': self.pending_jobs}, f)
+            os.replace(temp_path, self.manifest_path)
+
+    def refresh(self):
+        """
+        Brings the manifest up to date with the machine folder, hashing any
+        files that are new or have changed since the last refresh.
+        :return: self
+        """
+        current = {}
+        to_hash = []
+        for dirpath, dirnames, filenames in os.walk(self.machine_folder):
+            dirnames[:] = [i for i in dirnames if not i.startswith('deleted_')]
+            for file_name in filenames:
+                file_path = os.path.join(dirpath, file_name)
+                relative_path = os.path.relpath(file_path, self.machine_folder)
+                if relative_path in (RAW_DATA_MANIFEST_FILE, f"{RAW_DATA_MANIFEST_FILE}.tmp"):
+                    continue
+                file_stat = os.stat(file_path)
+                entry = self.files.get(relative_path)
+                if entry and entry['size'] == file_stat.st_size and entry['mtime'] == file_stat.st_mtime:
+                    current[relative_path] = entry
+                else:
+                    current[relative_path] = {'size': file_stat.st_size, 'mtime': file_stat.st_mtime}
+                    to_hash.append(relative_path)
+        with ThreadPoolExecutor(COPY_THREADS) as executor:
+            checksums = executor.map(file_checksum, [os.path.join(self.machine_folder, i) for i in to_hash])
+            for relative_path, file_sha in zip(to_hash, checksums):
+                current[relative_path]['sha256'] = file_sha
+        self.files = current
+        # A pending job that has been archived or removed is no longer waiting to be written
+        folders = {os.path.dirname(i) for i in current}
+        self.pending_jobs = {k: v for k, v in self.pending_jobs.items() if v in folders}
+        return self
+
+    def job_fingerprints(self):
+        """
+        The jobs that have been copied and written to the gpkg
+        :return: dict<fingerprint: relative folder path>
+        """
+        folders = {}
+        for relative_path, entry in self.files.items():
+            folder, file_name = os.path.split(relative_path)
+            folders.setdefault(folder, {})[file_name] = entry['sha256']
+        fingerprints = {job_folder_fingerprint(file_checksums): folder for folder, file_checksums in folders.items()}
+        return {k: v for k, v in fingerprints.items() if k not in self.pending_jobs}
+
+    def add_file(self, relative_path, file_sha):
+        file_stat = os.stat(os.path.join(self.machine_folder, relative_path))
+        with self.lock:
+            self.files[relative_path] = {'size': file_stat.st_size, 'mtime': file_stat.st_mtime,
+                                         'sha256': file_sha}
+
+    def add_pending_job(self, fingerprint, relative_path):
+        """
+        Records a copied job that still has to be written to the gpkg
+        :param fingerprint: str: job_folder_fingerprint of the folder
+        :param relative_path: str: the copied folder, relative to the machine folder
+        """
+        with self.lock:
+            self.pending_jobs[fingerprint] = relative_path
+
+    def confirm_job(self, fingerprint):
+        """
+        Marks a pending job as written, the next download skips it
+        :param fingerprint: str
+        """
+        with self.lock:
+            self.pending_jobs.pop(fingerprint, None)
+
+    def source_checksum(self, relative_path, file_info, file_path):
+        """
+        Checksum of a data source file, reusing the last checksum if the file
+        has the same size and modified time.
+        """
+        key = f"{relative_path}|{file_info['size']}|{file_info['mtime']}"
+        if key not in self.source_checksums:
+            self.source_checksums[key] = file_checksum(file_path)
+        return self.source_checksums[key]
+
+
+def copy_verified_file(src_path, dest_path, src_sha, retries=1):
+    """
+    Copies a file and checks the copy has the same checksum as the source
+    :param src_path: str
+    :param dest_path: str
+    :param src_sha: str: sha256 of the source file
+    :param retries: int: number of times to retry a copy that does not match
+    :return: str: sha256 of the copy
+    """
+    for attempt in range(retries + 1):
+        shutil.copy2(src_path, dest_path)
+        dest_sha = file_checksum(dest_path)
+        if dest_sha == src_sha:
+            return dest_sha
+    raise IOError(f"Checksum of copied file {dest_path} does not match {src_path}")
+
+
+def copy_usb_data_incremental(data_source, data_destination, machine_folder, folder_copied=None, stop_event=None,
+                              raw_data_manifest=None):
+    """
+    Copies only the job folders from the data source that have not already
+    been copied into the machine folder and written to the gpkg, e.g. older
+    jobs still on the USB. Each copied file is checked against the source checksum.
+    With a folder_copied callback each copied job is left pending in the raw
+    data manifest until the caller confirms it has been written.
+    :param data_source: str: 'E:/Tracmap'
+    :param data_destination: str: raw_data_folder/<machine>/<day>_<time>
+    :param machine_folder: str: raw_data_folder/<machine>
+    :param folder_copied: function(relative_path, dest_folder, fingerprint): called as
+        soon as each job folder has been copied and verified
+    :param stop_event: threading.Event: when set the copy stops before the next job folder
+    :param raw_data_manifest: RawDataManifest: shared with the caller that confirms the jobs
+    :return: list<str>: the job folders copied, relative to the data source
+    """
+    if not os.path.exists(data_source):
+        raise FileNotFoundError(f"Data Source: {data_source} does not exist")
+    if os.path.exists(data_destination):
+        raise FileExistsError(f"Data Destination: {data_destination} already exists, change download time")
+
+    data_source_manifest = get_data_source_manifest(data_source)
+    if raw_data_manifest is None:
+        raw_data_manifest = RawDataManifest(machine_folder).load()
+    raw_data_manifest.refresh()
+    stored_jobs = raw_data_manifest.job_fingerprints()
+
+    def folder_checksums(relative_path):
+        folder = data_source_manifest.folders[relative_path]
+        return {i['name']: raw_data_manifest.source_checksum(os.path.join(relative_path, i['name']), i,
+                                                             os.path.join(folder['path'], i['name']))
+                for i in folder['files'].values()}
+
+    with ThreadPoolExecutor(COPY_THREADS) as executor:
+        relative_paths = list(data_source_manifest.folders.keys())
+        source_checksums = dict(zip(relative_paths, executor.map(folder_checksums, relative_paths)))
+    # Only keep the data source checksums for the files still on the USB
+    seen = {f"{os.path.join(relative_path, i['name'])}|{i['size']}|{i['mtime']}"
+            for relative_path in relative_paths for i in data_source_manifest.folders[relative_path]['files'].values()}
+    raw_data_manifest.source_checksums = {k: v for k, v in raw_data_manifest.source_checksums.items() if k in seen}
+
+    new_folders = [i for i in relative_paths if job_folder_fingerprint(source_checksums[i]) not in stored_jobs]
+    copied_folders = []
+    # One job folder at a time so each folder can be handed on as soon as it is copied
+    with ThreadPoolExecutor(COPY_THREADS) as executor:
+        try:
+            for relative_path in new_folders:
+                if stop_event is not None and stop_event.is_set():
+                    break
+                dest_folder = os.path.normpath(os.path.join(data_destination, relative_path))
+                os.makedirs(dest_folder, exist_ok=True)
+                copies = [(os.path.join(data_source_manifest.folders[relative_path]['path'], file_name),
+                           os.path.join(dest_folder, file_name),
+                           file_sha)
+                          for file_name, file_sha in source_checksums[relative_path].items()]
+                copied = executor.map(lambda i: copy_verified_file(*i), copies)
+                for (src_path, dest_path, src_sha), dest_sha in zip(copies, copied):
+                    raw_data_manifest.add_file(os.path.relpath(dest_path, machine_folder), dest_sha)
+                copied_folders.append(relative_path)
+                fingerprint = job_folder_fingerprint(source_checksums[relative_path])
+                if folder_copied:
+                    raw_data_manifest.add_pending_job(fingerprint, os.path.relpath(dest_folder, machine_folder))
+                    folder_copied(relative_path, dest_folder, fingerprint)
+        finally:
+            raw_data_manifest.save()
+    return copied_folders
+
+
+class UsbIngest:
+    """
+    Pipelined download: a copier thread copies the new job folders from the
+    USB and hands each one to a parser worker as soon as it is copied, the
+    parsed folders are iterated in copy order by the single gpkg writer.
+    The download takes about as long as the slowest of the copy, parse and
+    write rather than the sum of them. If the consumer fails or closes the
+    pipeline the copy stops after the current job folder.
+    A job folder is only marked as stored in the raw data manifest once
+    folder_written is called for it, so pass folder_written to
+    TracmapDataBatch.iter_point_chunks. A folder that fails to parse or write
+    is copied and imported again by the next download.
+    The valid copied folders are added to data_batch.src_paths and
+    data_batch.src_type is set from the first of them.
+    """
+
+    def __init__(self, data_batch, data_source, data_destination, machine_folder, processes=None):
+        """
+        :param data_batch: TracmapDataBatch: src_paths can start empty
+        :param data_source: str: 'E:/Tracmap'
+        :param data_destination: str: raw_data_folder/<machine>/<day>_<time>
+        :param machine_folder: str: raw_data_folder/<machine>
+        :param processes: int: parser worker processes, None parses in a single thread
+        """
+        self.raw_data_manifest = RawDataManifest(machine_folder).load()
+        # Fingerprints of the folders handed to the consumer, in order
+        self.folder_fingerprints = []
+        self.folders = self.__iter_folders__(data_batch, data_source, data_destination, machine_folder, processes)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.folders)
+
+    def close(self):
+        self.folders.close()
+
+    def folder_written(self, folder_number):
+        """
+        Marks a folder as stored once its points are in the gpkg
+        :param folder_number: int: position of the folder in the iteration
+        """
+        self.raw_data_manifest.confirm_job(self.folder_fingerprints[folder_number])
+        self.raw_data_manifest.save()
+
+    def __iter_folders__(self, data_batch, data_source, data_destination, machine_folder, processes):
+        """
+        :return: yields dict: the layers of each folder, for TracmapDataBatch.iter_point_chunks
+        """
+        data_source_manifest = get_data_source_manifest(data_source)
+        parsed_folders = queue.Queue()
+
+        executor = None
+        if processes and processes > 1:
+            executor, data_batch.parallel_read_error = start_folder_process_pool(processes)
+        if executor is None:
+            executor = ThreadPoolExecutor(1)
+
+        def folder_copied(relative_path, dest_folder, fingerprint):
+            folder = data_source_manifest.folders[relative_path]
+            # Nothing to write for a folder without features
+            if not all([count > 0 for count in folder['feature_counts'].values()]):
+                self.raw_data_manifest.confirm_job(fingerprint)
+                return
+            if not data_batch.src_type:
+                data_batch.src_type = folder['source_type']
+            data_batch.src_paths.append(dest_folder)
+            parsed_folders.put((executor.submit(read_datasource_folder, folder['source_type'],
+                                                data_batch.data_source_srid, data_batch.data_store_srid,
+                                                data_batch.machine_code, data_batch.batch_id,
+                                                data_batch.swath_translation, dest_folder),
+                                fingerprint))
+
+        def copier():
+            try:
+                copy_usb_data_incremental(data_source, data_destination, machine_folder, folder_copied, stop_event,
+                                          self.raw_data_manifest)
+            except Exception as e:
+                parsed_folders.put(e)
+            finally:
+                parsed_folders.put(None)
+
+        stop_event = threading.Event()
+        copier_thread = threading.Thread(target=copier, name='usb_copier', daemon=True)
+        copier_thread.start()
+        try:
+            while True:
+                parsed_folder = parsed_folders.get()
+                if parsed_folder is None:
+                    break
+                if isinstance(parsed_folder, Exception):
+                    raise parsed_folder
+                future, fingerprint = parsed_folder
+                folder_layers = future.result()
+                self.folder_fingerprints.append(fingerprint)
+                yield folder_layers
+        finally:
+            stop_event.set()
+            copier_thread.join()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
 def archive_data_batch(raw_data_folder, batch_id):
     """
     :param raw_data_folder: <str>
@@ -138,36 +687,147 @@ def data_source_type(src_folder):
     """
     Checks what type of data source type the data is
     :param src_folder: str
-    :return:
+    :return: str: 'Unrecognised Data Source' if the secondary.dbf is missing or unreadable
     """
     # Checking the secondary.shp for Tracmap Versions/1 Second Recording
     secondary_shp_path = os.path.join(src_folder, 'secondary.shp')
     if os.path.exists(secondary_shp_path):
-        check_lyr = QgsVectorLayer(os.path.join(src_folder, 'secondary.shp'))
-        check_lyr_fields = [i.name().lower() for i in check_lyr.fields()]
+        try:
+            field_names = shapefile_reader.shapefile_field_names(secondary_shp_path)
+        except (OSError, struct.error, ValueError):
+            # A partly written job on the USB, the rest of the scan carries on
+            return 'Unrecognised Data Source'
+        check_lyr_fields = [i.lower() for i in field_names]
         if all([i in check_lyr_fields for i in ['date', 'time', 'lat', 'lon', 'speed', 'heading', 'gps alt',
                                                   'boomstate', 'targetrate', 'actualrate', 'width']]):
             return 'tabula_shapefile_baiting_points'
-        elif all([i in check_lyr_fields for i in ['time', 'speed', 'heading', 'gps alt']]):
-            return 'tracmap_shapefile_baiting_lines'
+        # The points export has the same fields as the lines export plus date and boom state, so check it first
         elif all([i in check_lyr_fields for i in ['date', 'time', 'speed', 'heading', 'gps alt', 'boom state']]):
             return 'tracmap_shapefile_baiting_points'
+        elif all([i in check_lyr_fields for i in ['time', 'speed', 'heading', 'gps alt']]):
+            return 'tracmap_shapefile_baiting_lines'
 
 
     return 'Unrecognised Data Source'
 
 
+def parse_tracmap_summary(summary, warnings=None):
+    """
+    Picks the area and distance figures out of a summary.txt, converted to
+    hectares and kilometres.
+    :param summary: dict<str: str>: from TracmapDataBatch.__read_tracmap_summary_file__
+    :param warnings: list<str>: a message is added for each figure skipped
+        because its unit is not in SUMMARY_UNIT_SCALES
+    :return: dict<tracmap_summary field: float>, only the figures that were found
+    """
+    figures = {}
+    for key, value in summary.items():
+        key_words = key.lower()
+        for field_name, words in TRACMAP_SUMMARY_FIELDS.items():
+            if field_name in figures or not all([i in key_words for i in words]):
+                continue
+            match = re.match(r'\s*(-?[\d,]*\.?\d+)\s*([^\s]*)', value)
+            if not match:
+                continue
+            unit = match.group(2).lower().rstrip('.')
+            if unit not in SUMMARY_UNIT_SCALES:
+                if warnings is not None:
+                    warnings.append(f"Unrecognised unit '{match.group(2)}' in the summary figure {key}: {value}, "
+                                    f"figure skipped")
+                continue
+            figures[field_name] = float(match.group(1).replace(',', '')) * SUMMARY_UNIT_SCALES[unit]
+    return figures
+
+
+def boom_state_values(boom_states):
+    """
+    Converts a boom state column to 0 (off) / 1 (on). Numeric and logical
+    fields are on when greater than 0, text fields when 'on', 'true', 'y' or '1'.
+    :param boom_states: np.array
+    :return: np.array<int8>
+    """
+    if boom_states.dtype.kind in ('i', 'u', 'f'):
+        return (boom_states > 0).astype(np.int8)
+    return np.isin(np.char.upper(np.char.strip(boom_states)), [b'ON', b'TRUE', b'T', b'Y', b'1']).astype(np.int8)
+
+
+def folder_process_pool(processes):
+    """
+    Creates a process pool for reading source folders.
+    Inside QGIS sys.executable is the QGIS application rather than python,
+    so the workers are pointed at the bundled python interpreter.
+    :param processes: int
+    :return: ProcessPoolExecutor
+    """
+    if not os.path.basename(sys.executable).lower().startswith('python'):
+        if os.name == 'nt':
+            multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'python.exe'))
+        else:
+            multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'bin', 'python3'))
+    return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+
+
+def worker_ready():
+    """Run in a new pool worker, only returns if the worker could import this module"""
+    return True
+
+
+def start_folder_process_pool(processes):
+    """
+    Starts a folder process pool and checks a worker can import this module.
+    The python found next to QGIS is not always usable, or does not have the
+    plugin on its path, so the caller falls back to a serial read.
+    :param processes: int
+    :return: tuple(ProcessPoolExecutor or None, str: why the pool could not be used)
+    """
+    executor = None
+    try:
+        executor = folder_process_pool(processes)
+        executor.submit(worker_ready).result(timeout=POOL_START_TIMEOUT)
+        return executor, None
+    except (OSError, ImportError, BrokenProcessPool, FutureTimeoutError) as e:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return None, f"Unable to start the worker processes, reading serially: {e!r}"
+
+
+def read_datasource_folder(src_type, data_source_srid, data_store_srid, machine_code, batch_id, swath_translation,
+                           dir_path):
+    """
+    Reads a single source folder, used by the process pool workers
+    :return: dict: TracmapDataBatch.layers for the folder
+    """
+    data_batch = TracmapDataBatch([dir_path], src_type, data_source_srid, data_store_srid, machine_code, batch_id,
+                                  swath_translation)
+    data_batch.__read_features__()
+    return data_batch.layers
+
+
 class TracmapDataBatch:
 
-    def __init__(self, src_paths, src_type, coordinate_transform, machine_code, batch_id,
-                 swath_translation=None):
+    def __init__(self, src_paths, src_type, data_source_srid, data_store_srid, machine_code, batch_id,
+                 swath_translation=None, cloud_api_key=None, cloud_last_sync=None):
+        """
+        :param src_paths: list<str>: source folders, or the Tracmap cloud url for a tracmap_cloud batch
+        :param cloud_api_key: str: Tracmap cloud api key
+        :param cloud_last_sync: str: last sync timestamp of the machine, updated after a tracmap_cloud read
+        """
         self.src_paths = src_paths
         self.src_type = src_type
-        self.coordinate_transform = coordinate_transform
-        self.machine_code = machine_code
+        self.data_source_srid = data_source_srid
+        self.data_store_srid = data_store_srid
+        # Machine codes are stored upper case
+        self.machine_code = machine_code.upper() if machine_code else machine_code
         self.batch_id = batch_id
         self.layers = {}
+        self.points = flight_points.empty_points()
         self.swath_translation = swath_translation
+        self.cloud_api_key = cloud_api_key
+        self.cloud_last_sync = cloud_last_sync
+        # Set when a parallel read fell back to reading the folders serially
+        self.parallel_read_error = None
+        # Summary figures that could not be loaded into tracmap_summary
+        self.summary_warnings = []
 
     def translate_swath(self, swath_width):
         """
@@ -184,8 +844,133 @@ class TracmapDataBatch:
         else:
             return swath_width
 
-    def read_datasource(self):
-        self.__read_features__()
+    def translate_swath_widths(self, swath_widths):
+        """
+        Translates a whole column of swath widths, only looking up each
+        distinct width once.
+        :param swath_widths: np.array
+        :return: np.array<float64>
+        """
+        widths, inverse = np.unique(swath_widths, return_inverse=True)
+        translated = np.array([self.translate_swath(i.item()) for i in widths], dtype=np.float64)
+        return translated[inverse]
+
+    def transform_coordinates(self, x, y):
+        """
+        Transforms coordinate arrays from the data source to the data store crs
+        :param x: np.array<float64>
+        :param y: np.array<float64>
+        :return: tuple(np.array<float64>, np.array<float64>)
+        """
+        return transform_coordinates(x, y, self.data_source_srid, self.data_store_srid)
+
+    @property
+    def secondary_layers(self):
+        """Returns the converted point arrays, one for each source folder"""
+        return {k: v for k, v in self.layers.items() if k.endswith('secondary')}
+
+    @property
+    def summary_layers(self):
+        """Returns the summary.txt of each source folder, in the order the folders were read"""
+        return {k: v for k, v in self.layers.items() if k.endswith('_summary')}
+
+    def read_datasource(self, processes=None):
+        """
+        Reads the source folders then merges the points of all the folders
+        in timestamp order.
+        With more than one process the folders are spread across a process
+        pool. The per folder results are collected in src_paths order so the
+        result is the same as a serial read.
+        :param processes: int: worker processes, None reads the folders serially
+        :return:
+        """
+        if self.src_type in FOLDER_SOURCE_TYPES:
+            for folder_layers in self.read_folders(processes):
+                self.layers.update(folder_layers)
+        else:
+            self.__read_features__()
+        self.merge_points()
+
+    def read_folders(self, processes=None):
+        """
+        Generator that reads the source folders one at a time, in src_paths order.
+        :param processes: int: worker processes, None reads the folders serially
+        :return: yields dict: the layers of each folder
+        """
+        read_folder = partial(read_datasource_folder, self.src_type, self.data_source_srid,
+                              self.data_store_srid, self.machine_code, self.batch_id, self.swath_translation)
+        executor = None
+        if processes and processes > 1 and len(self.src_paths) > 1:
+            executor, self.parallel_read_error = start_folder_process_pool(min(processes, len(self.src_paths)))
+        if executor is not None:
+            with executor:
+                yield from executor.map(read_folder, self.src_paths)
+        else:
+            for dir_path in self.src_paths:
+                yield read_folder(dir_path)
+
+    def iter_point_chunks(self, chunk_size=POINT_CHUNK_SIZE, processes=None, folder_layers_source=None,
+                          folder_written=None):
+        """
+        Streaming read, yields the converted points in chunks of chunk_size
+        as the folders are read. Only the folder summaries are kept in
+        self.layers so memory does not grow with the size of the export.
+        Points are ordered by time within each folder, duplicates across
+        folders are left to the writer.
+        :param chunk_size: int
+        :param processes: int: worker processes, None reads the folders serially
+        :param folder_layers_source: iterable of folder layers, e.g. UsbIngest,
+            defaults to reading self.src_paths
+        :param folder_written: function(folder_number): called when the consumer
+            asks for the chunk after the last point of a folder, i.e. once the
+            writer has committed every point of the folder
+        :return: yields np.array<flight_points.STAGING_POINT_DTYPE>
+        """
+        if folder_layers_source is None and self.src_type == 'tracmap_cloud':
+            folder_layers_source = self.iter_cloud_pages()
+        elif folder_layers_source is None:
+            folder_layers_source = self.read_folders(processes)
+        pending = flight_points.empty_points()
+        # (folder_number, points read up to the end of the folder), for folder_written
+        folder_ends = []
+        points_read = 0
+        points_written = 0
+
+        def confirm_written_folders():
+            while folder_ends and folder_ends[0][1] <= points_written:
+                folder_number = folder_ends.pop(0)[0]
+                if folder_written:
+                    folder_written(folder_number)
+
+        for folder_number, folder_layers in enumerate(folder_layers_source):
+            for layer_name, layer in folder_layers.items():
+                if not layer_name.endswith('secondary'):
+                    self.layers[layer_name] = layer
+                    continue
+                pending = np.concatenate([pending, layer])
+                points_read += len(layer)
+                while len(pending) >= chunk_size:
+                    yield pending[:chunk_size]
+                    points_written += chunk_size
+                    pending = pending[chunk_size:]
+                    confirm_written_folders()
+            folder_ends.append((folder_number, points_read))
+            confirm_written_folders()
+        if len(pending):
+            yield pending
+            points_written += len(pending)
+        confirm_written_folders()
+
+    def merge_points(self):
+        """
+        Combines the points of every folder into self.points, ordered by time
+        with duplicate src_ids removed.
+        """
+        secondary_layers = list(self.secondary_layers.values())
+        if not secondary_layers:
+            self.points = flight_points.empty_points()
+            return
+        self.points = unique_points(np.concatenate(secondary_layers))
 
     def __read_features__(self):
         if self.src_type == 'tracmap_shapefile_baiting_lines':
@@ -204,10 +989,109 @@ class TracmapDataBatch:
             self.__read_from_tracmap_cloud__()
 
     def __read_from_tracmap_cloud__(self):
-        raise NotImplementedError("Not yet built")
+        """
+        Downloads the jobs updated since cloud_last_sync for the machine.
+        :return:
+        """
+        pages = [i[f"{self.machine_code}_cloud_secondary"] for i in self.iter_cloud_pages()]
+        self.layers[f"{self.machine_code}_cloud_secondary"] = unique_points(flight_points.concatenate_points(pages))
+        return
+
+    def iter_cloud_pages(self):
+        """
+        Streams the jobs updated since cloud_last_sync for the machine, a
+        page at a time as each page arrives. The cloud returns lon/lat so the
+        points go through the same batch transform and swath translation as
+        the USB exports. cloud_last_sync is moved on once every page has been read.
+        :return: yields dict: the layers of each page, for iter_point_chunks
+        """
+        for cloud_url in self.src_paths:
+            client = tracmap_cloud.TracmapCloudClient(cloud_url, self.cloud_api_key)
+            for points in client.iter_machine_points(self.machine_code, self.cloud_last_sync):
+                points['x'], points['y'] = self.transform_coordinates(points['lon'], points['lat'])
+                points['width'] = self.translate_swath_widths(points['width'])
+                yield {f"{self.machine_code}_cloud_secondary": unique_points(points)}
+            self.cloud_last_sync = client.last_sync
 
     def __read_tracmap_shapefile_set_points__(self, dir_path):
-        raise NotImplementedError("Not yet built")
+        """
+        Reads the points export of the newer Tracmap firmware. Every GPS fix
+        (up to 10 Hz) is a point in the secondary shapefile with its boom state,
+        so unlike the lines export nothing is interpolated from the log.shp.
+        :param dir_path: str<path to the directory>
+        :return:
+        """
+        parent_folder = os.path.split(dir_path)[1]
+        secondary_lyr_path = os.path.join(dir_path, "secondary.shp")
+
+        columns = shapefile_reader.read_dbf_columns(secondary_lyr_path, ['date', 'time', 'speed', 'heading',
+                                                                         'gps alt', 'width', 'boom state'])
+        x, y = shapefile_reader.read_shp_points(secondary_lyr_path)
+        points = flight_points.empty_points(len(x))
+        points['lon'], points['lat'] = x, y
+        points['x'], points['y'] = self.transform_coordinates(x, y)
+        points['epoch'] = timestamp_codec.parse_timestamps(
+            timestamp_codec.combine_date_time(columns['date'], columns['time']), unit='ms')
+        points['speed'] = columns['speed']
+        # Firmware versions differ in the optional columns they export
+        points['heading'] = columns['heading'] if 'heading' in columns else np.nan
+        points['altitude'] = columns['gps alt'] if 'gps alt' in columns else np.nan
+        if 'width' in columns:
+            points['width'] = self.translate_swath_widths(columns['width'])
+        else:
+            points['width'] = np.nan
+        if 'boom state' in columns:
+            points['bucket_state'] = boom_state_values(columns['boom state'])
+        else:
+            points['bucket_state'] = 0
+
+        self.layers[f"{parent_folder}_secondary"] = unique_points(points)
+        return
+
+    def __read_tracmap_log_lines__(self, log_lyr_path):
+        """
+        Turns the baiting line features of the log.shp into points and
+        interpolates the time for each vertex
+        :param log_lyr_path: str
+        :return: np.array<flight_points.STAGING_POINT_DTYPE>
+        """
+        columns = shapefile_reader.read_dbf_columns(log_lyr_path, ['time', 'speed', 'gps alt', 'width'])
+        lines = shapefile_reader.read_shp_polylines(log_lyr_path)
+        if not lines:
+            return flight_points.empty_points()
+
+        # Transform all the vertices of the file at once
+        source_vertices = np.concatenate([i[0] for i in lines])
+        x, y = self.transform_coordinates(source_vertices[:, 0], source_vertices[:, 1])
+        vertices = np.column_stack([x, y])
+        line_ends = np.cumsum([len(i[0]) for i in lines])
+        swath_widths = self.translate_swath_widths(columns['width'])
+        start_epochs = timestamp_codec.parse_timestamps(columns['time'], unit='ms')
+
+        line_points = []
+        for i, (line, part_starts) in enumerate(lines):
+            speed = columns['speed'][i]
+            if not speed > 0 or not len(line):
+                continue
+            line_vertices = vertices[line_ends[i] - len(line):line_ends[i]]
+            source_vertices = line[:, :2]
+            keep, epochs = interpolate_line_points(line_vertices, part_starts, speed, start_epochs[i])
+
+            points = flight_points.empty_points(keep.sum())
+            points['x'] = line_vertices[keep, 0]
+            points['y'] = line_vertices[keep, 1]
+            points['lon'] = source_vertices[keep, 0]
+            points['lat'] = source_vertices[keep, 1]
+            points['epoch'] = epochs[keep]
+            points['speed'] = speed
+            points['heading'] = np.nan
+            points['altitude'] = columns['gps alt'][i]
+            points['width'] = swath_widths[i]
+            points['bucket_state'] = 1
+            line_points.append(points)
+        if not line_points:
+            return flight_points.empty_points()
+        return np.concatenate(line_points)
 
     def __read_tracmap_shapefile_set_lines__(self, dir_path):
         print(dir_path)
@@ -215,79 +1099,24 @@ class TracmapDataBatch:
         log_lyr_path = os.path.join(dir_path, "log.shp")
         secondary_lyr_path = os.path.join(dir_path, "secondary.shp")
 
-        # log_lyr
-        log_lyr = QgsVectorLayer(log_lyr_path, f"{parent_folder}_log", "ogr")
-        secondary_lyr = QgsVectorLayer(secondary_lyr_path, f"{parent_folder}_secondary", "ogr")
-        self.layers[secondary_lyr.name()] = {}
-        template_layer = project_setup.generate_table_staging_heli_points()
-        coordinate_transform = self.coordinate_transform
-        for feat in log_lyr.getFeatures():
-            swath_width = self.translate_swath(feat['width'])
-            if feat['speed'] < 0 or feat['speed'] is None:
-                continue
+        log_points = self.__read_tracmap_log_lines__(log_lyr_path)
 
-            point_time_tracker = datetime.strptime(feat['time'], '%Y-%m-%dT%H:%M:%S%z')
-            # Turn line features to points
-            feat_geom = feat.geometry()
-            feat_geom.transform(coordinate_transform)
-
-            # Turn baiting line feature into points and interpolate the time for each vertex
-            for vert_set in feat_geom.asMultiPolyline():
-                vertex_a = vert_set[0]
-                for i in range(len(vert_set)):
-                    new_feat = QgsFeature(template_layer.fields())
-                    new_feat['speed'] = feat['Speed']
-                    new_feat['width'] = swath_width
-                    new_feat['altitude'] = feat['GPS Alt']
-                    new_feat['machine_code'] = self.machine_code
-                    new_feat['batch_id'] = self.batch_id
-                    new_feat['bucket_state'] = 1
-                    new_feat.setGeometry(QgsGeometry(QgsPoint(vertex_a)))
-                    if i == 0:
-                        new_feat['date_time'] = point_time_tracker
-                    else:
-                        distance = vertex_a.distance(vert_set[i])
-                        seconds = distance / (feat['speed'] / 1.94384)
-                        # The time resolution is seconds, so if the time between vertices is less than one second, then skip it
-                        if not round(seconds, 0):
-                            continue
-                        time_delta = timedelta(seconds=seconds)
-                        point_time_tracker += time_delta
-                        new_feat['date_time'] = point_time_tracker
-                        new_feat['src_id'] = f"{new_feat['date_time']}|{new_feat['speed']}"
-                        vertex_a = vert_set[i]
-                    self.layers[secondary_lyr.name()][new_feat['src_id']] = new_feat
-                    # Last record to add in
-                    if i + 1 == len(vert_set):
-                        distance = vertex_a.distance(vert_set[i])
-                        seconds = distance / (feat['speed'] / 1.94384)
-                        time_delta = timedelta(seconds=seconds)
-                        point_time_tracker += time_delta
-                        new_feat['date_time'] = point_time_tracker
-                        new_feat['src_id'] = f"{new_feat['date_time']}|{new_feat['speed']}"
-                        new_feat.setGeometry(QgsGeometry(QgsPoint(vertex_a)))
-                        self.layers[secondary_lyr.name()][new_feat['src_id']] = new_feat
-
-        #TODO: Combine the log points and secondary points into the same set ordered by datetime.
         # secondary_lyr
-        #self.layers[secondary_lyr.name()] = {}
-        for feat in secondary_lyr.getFeatures():
-            swath_width = self.translate_swath(feat['width'])
-            new_geometry = feat.geometry()
-            new_geometry.transform(coordinate_transform)
-            new_feat = QgsFeature(template_layer.fields())
-            new_feat['speed'] = feat['speed']
-            new_feat['width'] = swath_width
-            new_feat['heading'] = feat['heading']
-            new_feat['altitude'] = feat['GPS Alt']
-            new_feat['machine_code'] = self.machine_code
-            new_feat['batch_id'] = self.batch_id
-            new_feat['bucket_state'] = 0
-            new_feat['date_time'] = datetime.strptime(feat['time'], '%Y-%m-%dT%H:%M:%S%z')
-            new_feat['src_id'] = f"{new_feat['date_time']}_{new_feat['speed']}"
-            new_feat.setGeometry(new_geometry)
-            self.layers[secondary_lyr.name()][new_feat['src_id']] = new_feat
+        columns = shapefile_reader.read_dbf_columns(secondary_lyr_path, ['time', 'speed', 'heading', 'gps alt',
+                                                                         'width'])
+        x, y = shapefile_reader.read_shp_points(secondary_lyr_path)
+        secondary_points = flight_points.empty_points(len(x))
+        secondary_points['lon'], secondary_points['lat'] = x, y
+        secondary_points['x'], secondary_points['y'] = self.transform_coordinates(x, y)
+        secondary_points['epoch'] = timestamp_codec.parse_timestamps(columns['time'], unit='ms')
+        secondary_points['speed'] = columns['speed']
+        secondary_points['heading'] = columns['heading']
+        secondary_points['altitude'] = columns['gps alt']
+        secondary_points['width'] = self.translate_swath_widths(columns['width'])
+        secondary_points['bucket_state'] = 0
 
+        # Combine the log points and secondary points into the same set ordered by datetime.
+        self.layers[f"{parent_folder}_secondary"] = unique_points(np.concatenate([log_points, secondary_points]))
         return
 
     def __read_tracmap_summary_file__(self, dir_path):
@@ -298,6 +1127,8 @@ class TracmapDataBatch:
         """
         summary_txt = os.path.join(dir_path, "summary.txt")
         parent_folder = os.path.split(dir_path)[1]
+        if not os.path.exists(summary_txt):
+            return
         self.layers[f"{parent_folder}_summary"] = {}
         with open(summary_txt, 'r') as txt_file:
             results = {}
@@ -318,35 +1149,71 @@ class TracmapDataBatch:
         print(dir_path)
         parent_folder = os.path.split(dir_path)[1]
         secondary_lyr_path = os.path.join(dir_path, "secondary.shp")
-        summary_txt = os.path.join(dir_path, "summary.txt")
 
-        # Read Secondary layer features
-        secondary_lyr = QgsVectorLayer(secondary_lyr_path, f"{parent_folder}_secondary", "ogr")
-        self.layers[secondary_lyr.name()] = {}
-        template_layer = project_setup.generate_table_heli_points()
-        coordinate_transform = self.coordinate_transform
-        for feat in secondary_lyr.getFeatures():
-            swath_width = self.translate_swath(feat['width'])
-            new_feat = QgsFeature(template_layer.fields())
-            new_feat['date_time'] = datetime.strptime(f"{feat['Date']}T{feat['Time']}", '%Y-%m-%dT%H:%M:%S')
-            new_feat['speed'] = feat['Speed']
-            new_feat['heading'] = feat['Heading']
-            new_feat['altitude'] = feat['GPS Alt']
-            new_feat['width'] = swath_width
-            new_feat['bucket_state'] = feat['BoomState']
-            new_feat['machine_code'] = self.machine_code
-            new_feat['batch_id'] = self.batch_id
-            new_feat['src_id'] = f"{new_feat['date_time']}|{new_feat['speed']}"
-            trans_geom = feat.geometry()
-            trans_geom.transform(coordinate_transform)
-            new_feat.setGeometry(trans_geom)
-
-            self.layers[secondary_lyr.name()][new_feat['src_id']] = new_feat
+        # Read Secondary layer columns
+        columns = shapefile_reader.read_dbf_columns(secondary_lyr_path, ['date', 'time', 'speed', 'heading',
+                                                                         'gps alt', 'width', 'boomstate'])
+        x, y = shapefile_reader.read_shp_points(secondary_lyr_path)
+        points = flight_points.empty_points(len(x))
+        points['lon'], points['lat'] = x, y
+        points['x'], points['y'] = self.transform_coordinates(x, y)
+        points['epoch'] = timestamp_codec.parse_timestamps(
+            timestamp_codec.combine_date_time(columns['date'], columns['time']), unit='ms')
+        points['speed'] = columns['speed']
+        points['heading'] = columns['heading']
+        points['altitude'] = columns['gps alt']
+        points['width'] = self.translate_swath_widths(columns['width'])
+        points['bucket_state'] = columns['boomstate']
 
+        self.layers[f"{parent_folder}_secondary"] = unique_points(points)
         return
 
 
+class DroneDataBatch:
+    """
+    Drone telemetry logs for a machine, read and converted a chunk at a time
+    so a whole day of 5-10 Hz logs is never held in memory.
+    """
 
+    def __init__(self, src_paths, data_source_srid, data_store_srid, machine_code, batch_id,
+                 max_hdop=drone_log.MAX_HDOP, swath_width=None):
+        """
+        :param src_paths: list<str>: csv drone logs
+        :param max_hdop: float: fixes with a worse hdop are dropped
+        :param swath_width: float: used when the log does not record the swath width
+        """
+        self.src_paths = src_paths
+        self.data_source_srid = data_source_srid
+        self.data_store_srid = data_store_srid
+        # Machine codes are stored upper case
+        self.machine_code = machine_code.upper() if machine_code else machine_code
+        self.batch_id = batch_id
+        self.max_hdop = max_hdop
+        self.swath_width = swath_width
+        self.fixes_read = 0
+        self.fixes_rejected = 0
+        # Fixes dropped because the log time was blank or could not be read
+        self.fixes_without_time = 0
 
-
-
+    def iter_point_chunks(self, chunk_size=None):
+        """
+        Generator of the good fixes of every log, transformed to the data store crs
+        :param chunk_size: int: log rows read at a time, defaults to drone_log.DRONE_LOG_CHUNK_SIZE
+        :return: yields np.array<flight_points.STAGING_DRONE_POINT_DTYPE>
+        """
+        for log_path in self.src_paths:
+            for points in drone_log.iter_drone_log_chunks(log_path, chunk_size or drone_log.DRONE_LOG_CHUNK_SIZE):
+                self.fixes_read += len(points)
+                timed = drone_log.timed_fixes(points)
+                self.fixes_without_time += int((~timed).sum())
+                points = points[timed]
+                keep = drone_log.good_fixes(points, self.max_hdop)
+                self.fixes_rejected += int((~keep).sum())
+                points = points[keep]
+                if not len(points):
+                    continue
+                points['x'], points['y'] = transform_coordinates(points['lon'], points['lat'],
+                                                                 self.data_source_srid, self.data_store_srid)
+                if self.swath_width is not None:
+                    points['width'] = np.where(np.isnan(points['width']), self.swath_width, points['width'])
+                yield points
@@ -0,0 +1,201 @@
+# Open Flightline Mini
+
+# Description:
+# Reads drone telemetry logs exported as csv (one row per GPS fix at 5-10 Hz)
+# a chunk of rows at a time into staged drone point arrays.
+# The column names vary between flight controllers and ground stations so
+# each field is matched against a list of common names.
+# Does not import qgis so it can be used from worker processes.
+
+import csv
+import os
+from itertools import islice
+
+import numpy as np
+
+from open_flightline_mini import flight_points, timestamp_codec
+
+
+# Number of log rows in each chunk
+DRONE_LOG_CHUNK_SIZE = 50000
+
+# Staged drone point field: lower case csv column names it can be read from
+DRONE_LOG_COLUMNS = {'time': ['time', 'timestamp', 'date_time', 'datetime', 'gps_time', 'time_utc', 'utc'],
+                     'lon': ['lon', 'lng', 'long', 'longitude'],
+                     'lat': ['lat', 'latitude'],
+                     'altitude': ['altitude', 'alt', 'gps_alt', 'gps alt', 'altitude_m'],
+                     'speed': ['speed', 'groundspeed', 'ground_speed', 'gnd_spd', 'spd'],
+                     'heading': ['heading', 'hdg', 'course', 'cog', 'yaw'],
+                     'width': ['width', 'swath', 'swath_width'],
+                     'hdop': ['hdop'],
+                     'eph': ['eph'],
+                     'vbat': ['vbat', 'battery_voltage', 'voltage', 'volt', 'batt_v'],
+                     'bucket_state': ['bucket_state', 'spreader', 'spreader_on', 'boom_state', 'boomstate'],
+                     'bucket_shutoff': ['bucket_shutoff', 'shutoff', 'spreader_shutoff']}
+
+# Fixes with a worse hdop are dropped
+MAX_HDOP = 2.0
+
+# Numeric times above this are milliseconds rather than seconds since 1970
+EPOCH_MS_THRESHOLD = 1e11
+
+# Epoch of a log time that is blank or could not be read, the int64 value of np.datetime64('NaT')
+NAT = np.iinfo(np.int64).min
+
+
+def find_drone_logs(src_folder):
+    """
+    :param src_folder: str
+    :return: list<str>: csv logs under the folder, in name order
+    """
+    logs = []
+    for dirpath, dirnames, filenames in os.walk(src_folder):
+        logs.extend(os.path.join(dirpath, i) for i in filenames if i.lower().endswith('.csv'))
+    return sorted(logs)
+
+
+def match_log_columns(header):
+    """
+    :param header: list<str>: csv header row
+    :return: dict<field: column index>
+    """
+    header = [i.strip().lower() for i in header]
+    columns = {}
+    for field_name, names in DRONE_LOG_COLUMNS.items():
+        for name in names:
+            if name in header:
+                columns[field_name] = header.index(name)
+                break
+    return columns
+
+
+def is_drone_log(log_path):
+    """
+    :param log_path: str
+    :return: bool: the csv has time and position columns
+    """
+    with open(log_path, 'r', newline='', encoding='utf-8-sig') as log_file:
+        header = next(csv.reader(log_file), [])
+    return all([i in match_log_columns(header) for i in ['time', 'lon', 'lat']])
+
+
+def _number_column(values):
+    """Converts text values to float64, blanks and bad values become nan"""
+    values = np.char.strip(np.asarray(values, dtype=np.bytes_))
+    try:
+        return np.where(values == b'', b'nan', values).astype(np.float64)
+    except ValueError:
+        numbers = np.full(len(values), np.nan)
+        for i, value in enumerate(values):
+            try:
+                numbers[i] = float(value)
+            except ValueError:
+                pass
+        return numbers
+
+
+def _parse_log_time(value):
+    """Slow path for one log time, NAT when it can not be read"""
+    text = value.decode('latin-1')
+    try:
+        return timestamp_codec.parse_timestamp(text, unit='ms')
+    except ValueError:
+        pass
+    try:
+        number = float(text)
+    except ValueError:
+        return NAT
+    if not np.isfinite(number):
+        return NAT
+    return round(number * 1000 if number < EPOCH_MS_THRESHOLD else number)
+
+
+def parse_log_times(values):
+    """
+    Log times are either ISO timestamps or numbers of seconds (or milliseconds)
+    since 1970. Blank and unreadable times become NAT.
+    :param values: list<str>
+    :return: np.array<int64>: epoch milliseconds
+    """
+    values = np.char.strip(np.asarray(values, dtype=np.bytes_))
+    epochs = np.full(len(values), NAT, dtype=np.int64)
+    present = values != b''
+    if not present.any():
+        return epochs
+    text = values[present]
+    try:
+        numbers = text.astype(np.float64)
+    except ValueError:
+        try:
+            epochs[present] = timestamp_codec.parse_timestamps(text, unit='ms')
+        except ValueError:
+            epochs[present] = [_parse_log_time(i) for i in text]
+        return epochs
+    finite = np.isfinite(numbers)
+    if finite.any() and np.median(numbers[finite]) < EPOCH_MS_THRESHOLD:
+        numbers = numbers * 1000
+    epochs[present] = np.where(finite, np.round(np.nan_to_num(numbers)), NAT)
+    return epochs
+
+
+def iter_drone_log_chunks(log_path, chunk_size=DRONE_LOG_CHUNK_SIZE):
+    """
+    Generator that reads a drone log a chunk of rows at a time.
+    x and y are left for the data batch to transform. Rows without a
+    readable time have an epoch of NAT, see timed_fixes.
+    :param log_path: str
+    :param chunk_size: int
+    :return: yields np.array<flight_points.STAGING_DRONE_POINT_DTYPE>
+    """
+    with open(log_path, 'r', newline='', encoding='utf-8-sig') as log_file:
+        reader = csv.reader(log_file)
+        columns = match_log_columns(next(reader, []))
+        if not all([i in columns for i in ['time', 'lon', 'lat']]):
+            raise ValueError(f"{log_path} does not have time, lon and lat columns")
+        width = max(columns.values()) + 1
+        record_number = 0
+        while True:
+            rows = [i for i in islice(reader, chunk_size) if i]
+            if not rows:
+                break
+            rows = [i + [''] * (width - len(i)) if len(i) < width else i for i in rows]
+            # Transpose once then convert each column in bulk
+            raw_columns = list(zip(*rows))
+
+            points = flight_points.empty_drone_points(len(rows))
+            points['src_id'] = np.arange(record_number + 1, record_number + len(rows) + 1)
+            record_number += len(rows)
+            points['epoch'] = parse_log_times(raw_columns[columns['time']])
+            for field_name in ['lon', 'lat', 'altitude', 'speed', 'heading', 'width', 'hdop', 'vbat']:
+                if field_name in columns:
+                    points[field_name] = _number_column(raw_columns[columns[field_name]])
+                else:
+                    points[field_name] = np.nan
+            if 'hdop' not in columns and 'eph' in columns:
+                # eph is the hdop x 100 (MAVLink GPS_RAW_INT)
+                points['hdop'] = _number_column(raw_columns[columns['eph']]) / 100
+            for field_name in ['bucket_state', 'bucket_shutoff']:
+                if field_name in columns:
+                    points[field_name] = np.nan_to_num(_number_column(raw_columns[columns[field_name]])) > 0
+            yield points
+
+
+def timed_fixes(points):
+    """
+    :param points: np.array<flight_points.STAGING_DRONE_POINT_DTYPE>
+    :return: np.array<bool>: the fixes with a readable time
+    """
+    return points['epoch'] != NAT
+
+
+def good_fixes(points, max_hdop):
+    """
+    GPS fixes with a position and an hdop no worse than max_hdop. Fixes
+    without an hdop are kept.
+    :param points: np.array<flight_points.STAGING_DRONE_POINT_DTYPE>
+    :param max_hdop: float
+    :return: np.array<bool>
+    """
+    has_position = np.isfinite(points['lon']) & np.isfinite(points['lat']) & \
+        ~((points['lon'] == 0) & (points['lat'] == 0))
+    return has_position & ~(points['hdop'] > max_hdop)
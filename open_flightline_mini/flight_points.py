@@ -0,0 +1,256 @@
+# Open Flightline Mini
+
+# Description:
+# Compact in memory store for staged flight points.
+# A staged GPS fix is one row of a numpy structured array covering the
+# staging_heli_points schema. machine_code and batch_id are the same for the
+# whole data batch so they are held once by the data batch rather than per
+# point. The point is only turned into gpkg attributes when it is written.
+# Does not import qgis so it can be used from worker processes.
+
+import numpy as np
+
+from open_flightline_mini import gpkg_sqlite, timestamp_codec
+
+
+# One row per GPS fix.
+# x, y: data store crs. lon, lat: data source crs.
+# epoch is the wall clock milliseconds since 1970-01-01, any utc offset is
+# dropped to match the date_time text stored in the gpkg. The points exports
+# and the cloud are up to 10 Hz so every fix keeps its own time.
+STAGING_POINT_DTYPE = np.dtype([('x', 'f8'),
+                                ('y', 'f8'),
+                                ('lon', 'f8'),
+                                ('lat', 'f8'),
+                                ('epoch', 'i8'),
+                                ('speed', 'f8'),
+                                ('heading', 'f8'),
+                                ('altitude', 'f8'),
+                                ('width', 'f8'),
+                                ('bucket_state', 'i1')])
+
+# One row per drone GPS fix, covering the staging_drone_points schema.
+# Drone logs are 5-10 Hz so epoch is in milliseconds. src_id is the row
+# number of the fix in its log.
+STAGING_DRONE_POINT_DTYPE = np.dtype([('x', 'f8'),
+                                      ('y', 'f8'),
+                                      ('lon', 'f8'),
+                                      ('lat', 'f8'),
+                                      ('src_id', 'i8'),
+                                      ('epoch', 'i8'),
+                                      ('speed', 'f8'),
+                                      ('heading', 'f8'),
+                                      ('altitude', 'f8'),
+                                      ('width', 'f8'),
+                                      ('hdop', 'f8'),
+                                      ('vbat', 'f8'),
+                                      ('bucket_state', 'i1'),
+                                      ('bucket_shutoff', 'i1')])
+
+# sqlite GLOBs matching the src_ids made by src_ids(), 'YYYY-MM-DD HH:MM:SS|speed'
+# and 'YYYY-MM-DD HH:MM:SS.sss|speed' for a fix between whole seconds
+SRC_ID_GLOB = '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]|*'
+SRC_ID_MS_GLOB = '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9].[0-9][0-9][0-9]|*'
+
+# Rows deleted per statement by migrate_src_ids, below the sqlite variable limit
+MIGRATE_DELETE_CHUNK = 500
+
+# Columns written to heli_points by heli_points_rows, after the geometry
+HELI_POINTS_COLUMNS = ['src_id', 'date_time', 'speed', 'heading', 'altitude', 'width', 'machine_code', 'bucket_size',
+                       'batch_id', 'bucket_state']
+
+# Columns written to staging_drone_points by drone_points_rows, after the geometry
+DRONE_POINTS_COLUMNS = ['src_id', 'date_time', 'speed', 'heading', 'altitude', 'width', 'machine', 'batch_id',
+                        'bucket_state', 'bucket_shutoff', 'hdop', 'vbat']
+
+
+def empty_points(count=0):
+    """
+    :param count: int
+    :return: np.array<STAGING_POINT_DTYPE>
+    """
+    return np.zeros(count, dtype=STAGING_POINT_DTYPE)
+
+
+def empty_drone_points(count=0):
+    """
+    :param count: int
+    :return: np.array<STAGING_DRONE_POINT_DTYPE>
+    """
+    return np.zeros(count, dtype=STAGING_DRONE_POINT_DTYPE)
+
+
+def concatenate_points(point_arrays):
+    """
+    :param point_arrays: list<np.array<STAGING_POINT_DTYPE>>
+    :return: np.array<STAGING_POINT_DTYPE>
+    """
+    if not point_arrays:
+        return empty_points()
+    return np.concatenate(point_arrays)
+
+
+def date_time_text(epochs, separator='T'):
+    """
+    Formats point times to the second, with milliseconds only for a fix
+    between whole seconds, so 1 Hz data keeps the text older versions stored.
+    :param epochs: np.array<int64>: milliseconds
+    :param separator: str: between the date and the time
+    :return: list<str>
+    """
+    epochs = np.asarray(epochs, dtype=np.int64)
+    text = timestamp_codec.format_timestamps(epochs, separator, unit='ms')
+    return [i[:19] if whole else i for i, whole in zip(text, (epochs % 1000 == 0).tolist())]
+
+
+def src_ids(epochs, speeds):
+    """
+    Creates the src_ids used to check if a point has already been loaded,
+    'YYYY-MM-DD HH:MM:SS|speed' for every source type, or
+    'YYYY-MM-DD HH:MM:SS.sss|speed' for a fix between whole seconds
+    :param epochs: np.array<int64>: milliseconds
+    :param speeds: np.array<float64>
+    :return: list<str>
+    """
+    date_times = date_time_text(epochs, separator=' ')
+    return [f"{date_time}|{speed}" for date_time, speed in zip(date_times, np.asarray(speeds, dtype=float).tolist())]
+
+
+def point_src_ids(points):
+    """
+    :param points: np.array<STAGING_POINT_DTYPE>
+    :return: list<str>
+    """
+    return src_ids(points['epoch'], points['speed'])
+
+
+def has_old_src_ids(connection, table_name='heli_points'):
+    """
+    :param connection: sqlite3.Connection
+    :param table_name: str
+    :return: bool: some rows still have a src_id from before migrate_src_ids
+    """
+    return connection.execute(f'SELECT 1 FROM "{table_name}" WHERE date_time IS NOT NULL AND '
+                              f'src_id NOT GLOB ? AND src_id NOT GLOB ? LIMIT 1',
+                              (SRC_ID_GLOB, SRC_ID_MS_GLOB)).fetchone() is not None
+
+
+def migrate_src_ids(connection, table_name='heli_points'):
+    """
+    Rewrites the src_ids of rows loaded before src_ids had one format,
+    '{date_time}_{speed}' for Tracmap secondary points and
+    '{QDateTime}|{speed}' for log and Tabula points, from the date_time and
+    speed columns, and upper cases the machine codes. A row that then repeats
+    the machine_code, src_id of an earlier row is the same GPS fix loaded
+    twice and is deleted, keeping the first. Run inside gpkg_sqlite.transaction().
+    :param connection: sqlite3.Connection
+    :param table_name: str
+    :return: tuple(int: rows rewritten, list<tuple(fid, machine_code, batch_id, old src_id)>: rows deleted)
+    """
+    fid = gpkg_sqlite.primary_key(connection, table_name)
+    rows = connection.execute(f'SELECT "{fid}", machine_code, batch_id, src_id, date_time, speed '
+                              f'FROM "{table_name}" WHERE date_time IS NOT NULL ORDER BY "{fid}"').fetchall()
+    if not rows:
+        return 0, []
+    fids, machine_codes, batch_ids, old_src_ids, date_times, speeds = zip(*rows)
+    epochs = timestamp_codec.parse_timestamps(date_times, unit='ms')
+    new_src_ids = src_ids(epochs, [np.nan if i is None else i for i in speeds])
+
+    loaded = set()
+    updates = []
+    removed = []
+    for row_fid, machine_code, batch_id, old_src_id, new_src_id in zip(fids, machine_codes, batch_ids,
+                                                                         old_src_ids, new_src_ids):
+        new_machine_code = machine_code.upper() if machine_code else machine_code
+        if (new_machine_code, new_src_id) in loaded:
+            removed.append((row_fid, machine_code, batch_id, old_src_id))
+            continue
+        loaded.add((new_machine_code, new_src_id))
+        if new_src_id != old_src_id or new_machine_code != machine_code:
+            updates.append((new_src_id, new_machine_code, row_fid))
+
+    # Duplicates are removed first so a rewritten src_id never collides with a unique index
+    for i in range(0, len(removed), MIGRATE_DELETE_CHUNK):
+        chunk = [row[0] for row in removed[i:i + MIGRATE_DELETE_CHUNK]]
+        gpkg_sqlite.delete_rows(connection, table_name, f'"{fid}" IN ({", ".join(["?"] * len(chunk))})', chunk)
+    connection.executemany(f'UPDATE "{table_name}" SET src_id = ?, machine_code = ? WHERE "{fid}" = ?', updates)
+    return len(updates), removed
+
+
+def unique_points(points):
+    """
+    Removes points that would have the same src_id, keeping the first one,
+    and orders the points by time. Fixes are to the millisecond so only a
+    fix repeated with the same time and speed is removed.
+    :param points: np.array<STAGING_POINT_DTYPE>
+    :return: np.array<STAGING_POINT_DTYPE>
+    """
+    order = np.lexsort((np.arange(len(points)), points['speed'], points['epoch']))
+    points = points[order]
+    first = np.ones(len(points), dtype=bool)
+    first[1:] = (np.diff(points['epoch']) != 0) | (np.diff(points['speed']) != 0)
+    return points[first]
+
+
+def _nullable_column(values):
+    """Converts a float column to a list with nan as None"""
+    column = values.astype(object)
+    column[np.isnan(values)] = None
+    return column.tolist()
+
+
+def heli_points_rows(points, machine_code, batch_id, bucket_size, srs_id):
+    """
+    Converts staged points into rows for an executemany insert into
+    heli_points: (geometry blob, *HELI_POINTS_COLUMNS).
+    :param points: np.array<STAGING_POINT_DTYPE>
+    :param machine_code: str
+    :param batch_id: str
+    :param bucket_size: int: default bucket size of the machine
+    :param srs_id: int: srs of the geometry column
+    :return: list<tuple>
+    """
+    count = len(points)
+    columns = [gpkg_sqlite.point_blobs(points['x'], points['y'], srs_id),
+               point_src_ids(points),
+               date_time_text(points['epoch']),
+               _nullable_column(points['speed']),
+               _nullable_column(points['heading']),
+               _nullable_column(points['altitude']),
+               _nullable_column(points['width']),
+               [machine_code] * count,
+               [bucket_size] * count,
+               [batch_id] * count,
+               points['bucket_state'].tolist()]
+    return list(zip(*columns))
+
+
+def drone_points_rows(points, machine_code, batch_id, srs_id):
+    """
+    Converts staged drone points into rows for an executemany insert into
+    staging_drone_points: (geometry blob, *DRONE_POINTS_COLUMNS).
+    The hdop field is an integer so it is stored as hdop x 100 (eph).
+    :param points: np.array<STAGING_DRONE_POINT_DTYPE>
+    :param machine_code: str
+    :param batch_id: str
+    :param srs_id: int: srs of the geometry column
+    :return: list<tuple>
+    """
+    count = len(points)
+    hdop = points['hdop'] * 100
+    eph = np.round(np.nan_to_num(hdop)).astype(np.int64).astype(object)
+    eph[np.isnan(hdop)] = None
+    columns = [gpkg_sqlite.point_blobs(points['x'], points['y'], srs_id),
+               points['src_id'].tolist(),
+               timestamp_codec.format_timestamps(points['epoch'], unit='ms'),
+               _nullable_column(points['speed']),
+               _nullable_column(points['heading']),
+               _nullable_column(points['altitude']),
+               _nullable_column(points['width']),
+               [machine_code] * count,
+               [batch_id] * count,
+               points['bucket_state'].tolist(),
+               points['bucket_shutoff'].tolist(),
+               eph.tolist(),
+               _nullable_column(points['vbat'])]
+    return list(zip(*columns))
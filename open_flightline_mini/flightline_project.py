@@ -8,6 +8,7 @@
 
 import os.path
 import json
+from contextlib import closing
 from statistics import mean
 
 from qgis import processing
@@ -22,6 +23,23 @@ from qgis.core import (QgsVectorLayer,
 from datetime import datetime
 from pathlib import Path
 
+from open_flightline_mini import data_reader, flight_points, gpkg_snapshot, gpkg_sqlite
+
+
+# Tables holding rows of a data batch, heli_points and the tables calculated from it
+DATA_BATCH_TABLES = ['heli_bait_lines', 'heli_bait_lines_detailed', 'heli_bait_lines_buffered',
+                     'heli_points', 'load_summary', 'flight_path', 'tracmap_summary']
+
+# tracmap_summary figures, each has a cumulative_<field> running total by machine
+TRACMAP_SUMMARY_FIELDS = ['tm_nominal_area', 'tm_real_area', 'tm_distance_travelled', 'tm_distance_spreading']
+
+# Columns holding a machine code, stored upper case. The drone tables name it machine
+MACHINE_CODE_COLUMNS = ['machine_code', 'machine']
+
+# Settings older versions wrote to project_config.json that are no longer kept,
+# the Tracmap cloud api key now lives in the QGIS auth manager
+SCRUBBED_CONFIG_SETTINGS = ['tracmap_cloud_api_key']
+
 
 def get_project_config_json(project_path=None):
     if not project_path:
@@ -63,6 +81,18 @@ class FlightlineProject:
         self.data_source_srid = None
         self.data_store_srid = None
         self.load_site_ceiling = 50
+        self.tracmap_cloud_url = None
+        # Id of the QGIS auth manager config holding the Tracmap cloud api key,
+        # the key itself is never written to the project config
+        self.tracmap_cloud_authcfg = None
+        # Timestamp of the last job downloaded from the Tracmap cloud, by machine code
+        self.tracmap_cloud_last_sync = {}
+        # Number of gpkg snapshots kept in the backups folder, 0 keeps them all
+        self.snapshot_retention = gpkg_snapshot.DEFAULT_SNAPSHOT_RETENTION
+        # Open layers and the sqlite connection, reused until the gpkg schema changes
+        self._gpkg_layers = {}
+        self._gpkg_connection = None
+        self._gpkg_schema_version = None
 
     @property
     def operation_day(self):
@@ -92,15 +122,33 @@ class FlightlineProject:
     def gpkg_name(self):
         return os.path.basename(self.project_gpkg)
 
+    @property
+    def backup_folder(self):
+        return os.path.join(self.project_folder, gpkg_snapshot.BACKUP_FOLDER)
+
+    @property
+    def snapshot_list(self):
+        """Returns the gpkg snapshots in the backups folder, newest first"""
+        return gpkg_snapshot.list_snapshots(self.project_gpkg, self.backup_folder)
+
     @property
     def project_config_json_exists(self):
         return os.path.exists(self.project_config_json)
 
     @property
     def machine_code_list(self):
-        """Returns the machine code list from the heli_info table"""
-        gpkg_layer = QgsVectorLayer(self.gpkg_layer_path('heli_info'))
-        return sorted([i['machine_code'] for i in gpkg_layer.getFeatures()])
+        """
+        Returns the machine code list from the heli_info table, upper case.
+        Used by the tool dialogs, so the gpkg is only read: an empty list is
+        returned when there is no gpkg yet rather than creating one.
+        """
+        if not self.project_gpkg or not os.path.exists(self.project_gpkg):
+            return []
+        with closing(gpkg_sqlite.connect(self.project_gpkg, read_only=True)) as connection:
+            if not gpkg_sqlite.table_columns(connection, 'heli_info'):
+                return []
+            machine_codes = [i[0] for i in connection.execute("SELECT machine_code FROM heli_info")]
+        return sorted(set([i.upper() for i in machine_codes if i]))
 
     @property
     def all_load_numbers_list(self):
@@ -117,18 +165,103 @@ class FlightlineProject:
 
         heli_info_lyr = self.gpkg_layer('heli_info')
         features = [i['swath_translation'] for i in heli_info_lyr.getFeatures()
-                    if all([i['machine_code'] == machine_code, i['machine_active'] == 1])]
+                    if all([str(i['machine_code']).upper() == machine_code.upper(), i['machine_active'] == 1])]
         if len(features) == 0:
             return {}
         return features[0]
 
+    @property
+    def gpkg_connection(self):
+        """
+        sqlite connection to the project gpkg, opened on first use and kept
+        open. Layers and the connection are dropped when the gpkg path or the
+        schema changes, e.g. after a backup or cleanup of the layers.
+        Opening the gpkg does not write to it, missing attribute indexes are
+        added by the data loads and upgrade_project_data.
+        :return: sqlite3.Connection
+        """
+        if self._gpkg_connection is None:
+            if not self.project_gpkg or not os.path.exists(self.project_gpkg):
+                raise FileNotFoundError(f"Project gpkg: {self.project_gpkg} does not exist")
+            self._gpkg_connection = gpkg_sqlite.connect(self.project_gpkg)
+            self._gpkg_schema_version = self.gpkg_schema_version()
+        elif self.gpkg_schema_version() != self._gpkg_schema_version:
+            self.close_gpkg()
+            return self.gpkg_connection
+        return self._gpkg_connection
+
+    def gpkg_schema_version(self):
+        return self._gpkg_connection.execute("PRAGMA schema_version").fetchone()[0]
+
+    def close_gpkg(self):
+        """Closes the cached sqlite connection and layers"""
+        if self._gpkg_connection is not None:
+            self._gpkg_connection.close()
+        self._gpkg_connection = None
+        self._gpkg_schema_version = None
+        self._gpkg_layers = {}
+
+    def snapshot_backup(self, compress=False):
+        """
+        Writes a snapshot of the gpkg to the backups folder and removes the
+        oldest snapshots past snapshot_retention
+        :param compress: bool
+        :return: tuple(str: snapshot path, list<str>: snapshots removed)
+        """
+        snapshot_path = gpkg_snapshot.snapshot_gpkg(self.project_gpkg, self.backup_folder, compress)
+        removed = gpkg_snapshot.rotate_snapshots(self.project_gpkg, self.backup_folder, self.snapshot_retention)
+        return snapshot_path, removed
+
+    def restore_snapshot_backup(self, snapshot_path):
+        """
+        Restores the gpkg from a snapshot. The current gpkg is snapshotted
+        first so a restore can be undone, then the oldest snapshots past
+        snapshot_retention are removed, other than the one restored.
+        :param snapshot_path: str
+        :return: str: snapshot of the gpkg taken before the restore
+        """
+        self.close_gpkg()
+        pre_restore_path = gpkg_snapshot.snapshot_gpkg(self.project_gpkg, self.backup_folder, label='pre_restore')
+        gpkg_snapshot.restore_snapshot(snapshot_path, self.project_gpkg)
+        gpkg_snapshot.rotate_snapshots(self.project_gpkg, self.backup_folder, self.snapshot_retention,
+                                       keep=[snapshot_path, pre_restore_path])
+        return pre_restore_path
+
     def gpkg_layer(self, layer_name):
-        return QgsVectorLayer(self.gpkg_layer_path(layer_name), layer_name, 'ogr')
+        """
+        Returns the cached layer for a gpkg table, the layer is opened once and
+        reused until the schema changes.
+        :param layer_name: str
+        :return: QgsVectorLayer
+        """
+        self.gpkg_connection  # Drops the cached layers if the schema has changed
+        layer = self._gpkg_layers.get(layer_name)
+        if layer is None or not layer.isValid():
+            layer = QgsVectorLayer(self.gpkg_layer_path(layer_name), layer_name, 'ogr')
+            self._gpkg_layers[layer_name] = layer
+        return layer
+
+    def reload_gpkg_layers(self, table_names):
+        """
+        Reloads the cached layers of tables written through the sqlite
+        connection, the layers do not see those writes on their own. When
+        the write changed the schema, e.g. the triggers dropped and put back
+        by a bulk load, the cached layers are dropped instead.
+        :param table_names: list<str>
+        """
+        self.gpkg_connection  # Drops the cached layers if the schema has changed
+        for table_name in table_names:
+            layer = self._gpkg_layers.get(table_name)
+            if layer is not None and layer.isValid():
+                layer.dataProvider().reloadData()
+                layer.updateExtents()
 
     def gpkg_layer_path(self, layer_name):
         return f"{self.project_gpkg}|layername={layer_name}"
 
     def __set_gpkg_path__(self, gpkg_location):
+        if gpkg_location != self.project_gpkg:
+            self.close_gpkg()
         self.project_gpkg = gpkg_location
 
     def __set_project_folder__(self, project_folder):
@@ -148,7 +281,9 @@ class FlightlineProject:
         which should exist in the project folder
         :return:
         """
-        json_string = json.dumps(self.__dict__, indent=4)
+        # The cached gpkg connection and layers are not settings
+        settings = {k: v for k, v in self.__dict__.items() if not k.startswith('_')}
+        json_string = json.dumps(settings, indent=4)
         with open(self.project_config_json, "w") as openfile:
             openfile.write(json_string)
         print('Successfully wrote json config')
@@ -162,6 +297,12 @@ class FlightlineProject:
             json_object = json.load(openfile)
 
         for k, v in json_object.items():
+            if k == 'project_gpkg':
+                self.__set_gpkg_path__(v)
+                continue
+            if k in SCRUBBED_CONFIG_SETTINGS:
+                # Dropped from the file on the next write
+                continue
             self.__setattr__(k, v)
         print('Successfully read json config')
         return True
@@ -185,7 +326,7 @@ class FlightlineProject:
         """
 
         heli_pnts_lyr = self.gpkg_layer('heli_points')
-        expression = QgsExpression(f"machine_code ILIKE '{machine_code}'")
+        expression = QgsExpression(f"\"machine_code\" = '{machine_code}'")
         request = QgsFeatureRequest(expression)
         load_numbers = [i['load_number'] for i in heli_pnts_lyr.getFeatures(request)]
         if len(load_numbers) == 0:
@@ -195,7 +336,7 @@ class FlightlineProject:
     def heli_load_list(self, machine_code):
         """Returns the machine code list from the heli_info table"""
         heli_pnts_lyr = self.gpkg_layer('heli_points')
-        expression = QgsExpression(f"machine_code ILIKE '{machine_code}'")
+        expression = QgsExpression(f"\"machine_code\" = '{machine_code}'")
         request = QgsFeatureRequest(expression)
         load_numbers = [i['load_number'] for i in heli_pnts_lyr.getFeatures(request)]
         return list(set(load_numbers))
@@ -244,41 +385,41 @@ class FlightlineProject:
             heli_points_src_ids.append(feat['src_id'])
         return heli_points_src_ids
 
+    def combine_loads(self, table_name, machine_code, load_numbers, bucket_size=0):
+        """
+        Moves the loads into the first load number from the provided list with
+        a single UPDATE. The batch id of the first record of the first load is
+        used for all of them.
+        :param table_name: str: heli_points or flight_path
+        :param machine_code: str
+        :param load_numbers: list<int>
+        :param bucket_size: int: also sets the bucket size when above 0
+        :return: int: rows updated
+        """
+        bucket_size_sql = ', bucket_size = :bucket_size' if bucket_size > 0 else ''
+        parameters = {'machine_code': machine_code, 'new_load_number': min(load_numbers),
+                      'bucket_size': bucket_size}
+        parameters.update({f'load_{i}': v for i, v in enumerate(load_numbers)})
+        load_list = ', '.join([f':load_{i}' for i in range(len(load_numbers))])
+        return self.gpkg_connection.execute(
+            f"""UPDATE "{table_name}" SET load_number = :new_load_number{bucket_size_sql},
+                    batch_id = (SELECT batch_id FROM "{table_name}"
+                                WHERE machine_code = :machine_code AND load_number IN ({load_list})
+                                ORDER BY load_number, fid LIMIT 1)
+                WHERE machine_code = :machine_code AND load_number IN ({load_list})""", parameters).rowcount
+
     def combine_loads_for_heli_points(self, machine_code, load_numbers, bucket_size):
         """
         Updates the load numbers in the heli_points table using the first load
         number from the provided list
         :param machine_code: str
         :param load_numbers: list<int>
-        :return:
+        :return: int: rows updated
         """
-
-        new_load_number = min(load_numbers)
-        heli_points_lyr = self.gpkg_layer('heli_points')
-        if len(load_numbers) > 1:
-            expression = QgsExpression(
-                f"\"machine_code\" ILIKE '{machine_code}' and \"load_number\" in {tuple(load_numbers)}")
-        else:
-            expression = QgsExpression(
-                f"\"machine_code\" ILIKE '{machine_code}' and \"load_number\" like {load_numbers[0]}")
-        request = QgsFeatureRequest(expression)
-        clause = QgsFeatureRequest.OrderByClause('load_number', ascending=True)
-        orderby = QgsFeatureRequest.OrderBy([clause])
-        request.setOrderBy(orderby)
-
-        heli_points_lyr.startEditing()
-        batch_id = None
-        for feat in heli_points_lyr.getFeatures(request):
-            # Set the batch id to the first record
-            if not batch_id: batch_id = feat['batch_id']
-            feat.setAttribute('load_number', new_load_number)
-            feat.setAttribute('batch_id', batch_id)
-            if bucket_size > 0:
-                feat.setAttribute('bucket_size', bucket_size)
-            heli_points_lyr.updateFeature(feat)
-
-        heli_points_lyr.commitChanges()
-        return
+        with gpkg_sqlite.transaction(self.gpkg_connection):
+            updated = self.combine_loads('heli_points', machine_code, load_numbers, bucket_size)
+        self.reload_gpkg_layers(['heli_points'])
+        return updated
 
     def combine_loads_for_flight_path(self, machine_code, load_numbers):
         """
@@ -286,60 +427,282 @@ class FlightlineProject:
         number from the provided list
         :param machine_code: str
         :param load_numbers: list<int>
-        :return:
+        :return: int: rows updated
         """
+        with gpkg_sqlite.transaction(self.gpkg_connection):
+            updated = self.combine_loads('flight_path', machine_code, load_numbers)
+        self.reload_gpkg_layers(['flight_path'])
+        return updated
 
-        new_load_number = min(load_numbers)
-        flight_path_lyr = self.gpkg_layer('flight_path')
-        expression = QgsExpression(
-            f"\"machine_code\" ILIKE '{machine_code}' and \"load_number\" in {tuple(load_numbers)}")
-        request = QgsFeatureRequest(expression)
-        clause = QgsFeatureRequest.OrderByClause('load_number', ascending=True)
-        orderby = QgsFeatureRequest.OrderBy([clause])
-        request.setOrderBy(orderby)
-
-        flight_path_lyr.startEditing()
-        batch_id = None
-        for feat in flight_path_lyr.getFeatures(request):
-            # Set the batch id to the first record
-            if not batch_id: batch_id = feat['batch_id']
-            feat.setAttribute('load_number', new_load_number)
-            feat.setAttribute('batch_id', batch_id)
-            flight_path_lyr.updateFeature(feat)
-
-        flight_path_lyr.commitChanges()
-        return
-
-    def load_data_batch_into_heli_points(self, data_batch):
+    def combine_machine_loads(self, machine_code, load_numbers, bucket_size=0, clear_tables=()):
+        """
+        Combines loads in heli_points and flight_path and removes the
+        calculated data of the loads from clear_tables, in one transaction.
+        :param machine_code: str
+        :param load_numbers: list<int>
+        :param bucket_size: int: new bucket size for the combined load, 0 keeps the bucket sizes
+        :param clear_tables: list<str>: tables to delete the loads from once combined
+        :return: dict<table_name: rows updated or deleted>
+        """
+        connection = self.gpkg_connection
+        load_list = ', '.join(['?'] * len(load_numbers))
+        counts = {}
+        with gpkg_sqlite.transaction(connection):
+            counts['heli_points'] = self.combine_loads('heli_points', machine_code, load_numbers, bucket_size)
+            counts['flight_path'] = self.combine_loads('flight_path', machine_code, load_numbers)
+            for table_name in clear_tables:
+                counts[table_name] = gpkg_sqlite.delete_rows(connection, table_name,
+                                                             f'"machine_code" = ? AND "load_number" IN ({load_list})',
+                                                             (machine_code, *load_numbers))
+        self.reload_gpkg_layers(counts)
+        return counts
+
+    def project_data_upgrade_needed(self):
+        """
+        Checks for heli_points loaded by an older version, these have to be
+        upgraded with upgrade_project_data before new points are loaded.
+        :return: str: what needs upgrading, empty when nothing does
+        """
+        connection = self.gpkg_connection
+        if not gpkg_sqlite.table_columns(connection, 'heli_points'):
+            return ''
+        if flight_points.has_old_src_ids(connection):
+            return 'heli_points has src_ids in the format of an older version'
+        if connection.execute("SELECT 1 FROM heli_points WHERE machine_code <> upper(machine_code) LIMIT 1").fetchone():
+            return 'heli_points has lower case machine codes'
+        # Without duplicates the index is created by the next load
+        if (not gpkg_sqlite.index_exists(connection, gpkg_sqlite.HELI_POINTS_SRC_ID_INDEX)
+                and gpkg_sqlite.duplicate_rows(connection, 'heli_points', ['machine_code', 'src_id'])):
+            return 'heli_points has duplicate machine_code, src_id rows'
+        return ''
+
+    def upgrade_project_data(self):
+        """
+        One off upgrade of the data of an older project. The heli_points
+        src_ids are rewritten in the current format and the GPS fixes that
+        were loaded twice are deleted (flight_points.migrate_src_ids), the
+        machine codes of every layer are upper cased, then the unique
+        machine_code, src_id index is created. Rows are only ever removed
+        here, never when the gpkg is opened.
+        :return: dict: {'rewritten': int: heli_points rewritten,
+                        'removed': list<tuple(fid, machine_code, batch_id, old src_id)>: rows deleted,
+                        'upper_cased': dict<table_name: rows updated>,
+                        'indexes': list<str>: indexes created,
+                        'remaining': str: anything still needing an upgrade, see project_data_upgrade_needed}
+        """
+        connection = self.gpkg_connection
+        upper_cased = {}
+        with gpkg_sqlite.transaction(connection):
+            rewritten, removed = flight_points.migrate_src_ids(connection)
+            for table_name in [i[0] for i in connection.execute("SELECT table_name FROM gpkg_contents")]:
+                columns = gpkg_sqlite.table_columns(connection, table_name)
+                for column in [i for i in MACHINE_CODE_COLUMNS if i in columns]:
+                    # A heli_points row without a date_time that would repeat an upper case row is left as is
+                    updated = connection.execute(f'UPDATE OR IGNORE "{table_name}" SET "{column}" = upper("{column}") '
+                                                 f'WHERE "{column}" <> upper("{column}")').rowcount
+                    if updated:
+                        upper_cased[table_name] = updated
+        indexes = gpkg_sqlite.create_gpkg_indexes(connection)
+        self.reload_gpkg_layers(['heli_points', *upper_cased])
+        return {'rewritten': rewritten, 'removed': removed, 'upper_cased': upper_cased, 'indexes': indexes,
+                'remaining': self.project_data_upgrade_needed()}
+
+    def load_data_batch_into_heli_points(self, data_batch, chunk_size=None, processes=None, point_chunks=None):
         """
         Loads the secondary points from the data batch into the heli_points table
+        The rows are built a chunk at a time straight from the point arrays
+        and inserted with executemany, each chunk is one transaction with the
+        spatial index filled once at the end of it (gpkg_sqlite.bulk_load).
+        The gpkg is only locked while a chunk is written, not while the next
+        chunk is read or copied from the USB. Chunks written before an error
+        are kept, a re-run skips them with the unique machine_code, src_id index.
+        With a chunk_size the data batch is streamed so memory use stays flat.
         :param data_batch: data_reader.TracmapDataBatch()
-        :return:
+        :param chunk_size: int: stream the data batch in chunks of this many points,
+            None uses the points already read by data_batch.read_datasource()
+        :param processes: int: worker processes for a streamed read
+        :param point_chunks: iterable of point arrays to write instead of reading
+            the data batch, e.g. the chunks of a pipelined USB download
+        :return: int: points written
         """
+        upgrade_needed = self.project_data_upgrade_needed()
+        if upgrade_needed:
+            raise RuntimeError(f"{upgrade_needed}, run the 1. Upgrade Aerial Project Data tool before loading data")
+        # Projects from before the indexes get them on their first load
+        gpkg_sqlite.create_gpkg_indexes(self.gpkg_connection)
 
         default_bucket_size = self.get_default_machine_bucket_size(data_batch.machine_code)
-
+        if point_chunks is None and chunk_size:
+            point_chunks = data_batch.iter_point_chunks(chunk_size, processes)
+        elif point_chunks is None:
+            point_chunks = [data_batch.points]
+
+        connection = self.gpkg_connection
+        geometry, srs_id = gpkg_sqlite.geometry_column(connection, 'heli_points')
+        # Points already loaded are skipped by the unique machine_code, src_id index
+        insert_sql = (f'INSERT OR IGNORE INTO heli_points ("{geometry}", {", ".join(flight_points.HELI_POINTS_COLUMNS)}) '
+                      f'VALUES ({", ".join(["?"] * (len(flight_points.HELI_POINTS_COLUMNS) + 1))})')
         counter = 0
-        for batch_lyr in data_batch.layers.keys():
-            if batch_lyr.endswith('secondary'):
-                heli_points_lyr = self.gpkg_layer('heli_points')
-                heli_points_lyr.startEditing()
-                heli_points_field_names = [i.name() for i in heli_points_lyr.fields()]
-                heli_points_src_ids = self.get_heli_points_ids(data_batch.machine_code)
-                for id, feat in data_batch.layers[batch_lyr].items():
-                    if id in heli_points_src_ids:
-                        continue  # Already have the data, do not need to reload.
-                    batch_field_names = [i.name() for i in feat.fields()]
-                    new_feat = QgsFeature(heli_points_lyr.fields())
-                    [new_feat.setAttribute(i, feat[i]) for i in heli_points_field_names if i in batch_field_names]
-                    new_feat.setAttribute('date_time', datetime.strftime(new_feat['date_time'], '%Y-%m-%dT%H:%M:%S'))
-                    new_feat.setAttribute('bucket_size', default_bucket_size)
-                    new_feat.setGeometry(feat.geometry())
-                    heli_points_lyr.dataProvider().addFeature(new_feat)
-                    counter += 1
-                heli_points_lyr.commitChanges()
+        for points in point_chunks:
+            rows = flight_points.heli_points_rows(points, data_batch.machine_code, data_batch.batch_id,
+                                                  default_bucket_size, srs_id)
+            with gpkg_sqlite.bulk_load(connection, 'heli_points'):
+                counter += connection.executemany(insert_sql, rows).rowcount
+        self.reload_gpkg_layers(['heli_points'])
         return counter
 
+    def load_drone_batch_into_drone_points(self, drone_batch, chunk_size=None):
+        """
+        Streams the drone logs into staging_drone_points with a bulk insert
+        for each chunk, then merges the staged batch into drone_points in a
+        single set based upsert keyed on machine and date_time. Both inserts
+        fill the spatial index once at the end (gpkg_sqlite.bulk_load)
+        rather than through the per row triggers.
+        :param drone_batch: data_reader.DroneDataBatch()
+        :param chunk_size: int: log rows read and inserted at a time
+        :return: dict: {'staged', 'inserted', 'updated'}
+        """
+        staging_columns = ', '.join(flight_points.DRONE_POINTS_COLUMNS)
+        update_columns = [i for i in flight_points.DRONE_POINTS_COLUMNS if i not in ['machine', 'date_time']]
+        connection = self.gpkg_connection
+        # The upsert looks up drone_points by machine and date_time
+        gpkg_sqlite.create_gpkg_indexes(connection)
+        staging_geom, srs_id = gpkg_sqlite.geometry_column(connection, 'staging_drone_points')
+        drone_geom = gpkg_sqlite.geometry_column(connection, 'drone_points')[0]
+        with connection:
+            connection.execute("DELETE FROM staging_drone_points WHERE batch_id = ?", (drone_batch.batch_id,))
+
+        staged = 0
+        insert_sql = (f'INSERT INTO staging_drone_points ("{staging_geom}", {staging_columns}) '
+                      f'VALUES ({", ".join(["?"] * (len(flight_points.DRONE_POINTS_COLUMNS) + 1))})')
+        for points in drone_batch.iter_point_chunks(chunk_size):
+            with gpkg_sqlite.bulk_load(connection, 'staging_drone_points'):
+                connection.executemany(insert_sql, flight_points.drone_points_rows(points,
+                                                                                   drone_batch.machine_code,
+                                                                                   drone_batch.batch_id,
+                                                                                   srs_id))
+            staged += len(points)
+
+        with gpkg_sqlite.bulk_load(connection, 'drone_points'):
+            connection.execute("""UPDATE staging_drone_points SET action = CASE WHEN EXISTS (
+                                      SELECT 1 FROM drone_points d
+                                      WHERE d.machine = staging_drone_points.machine
+                                      AND d.date_time = staging_drone_points.date_time)
+                                  THEN 'update' ELSE 'insert' END
+                                  WHERE batch_id = ?""", (drone_batch.batch_id,))
+            updated = connection.execute(
+                f"""UPDATE drone_points SET "{drone_geom}" = s."{staging_geom}",
+                        {', '.join(f'{i} = s.{i}' for i in update_columns)}
+                    FROM staging_drone_points s
+                    WHERE s.batch_id = ? AND s.action = 'update'
+                    AND drone_points.machine = s.machine AND drone_points.date_time = s.date_time""",
+                (drone_batch.batch_id,)).rowcount
+            # A fix logged twice in the batch is only inserted once
+            inserted = connection.execute(
+                f"""INSERT INTO drone_points ("{drone_geom}", {staging_columns})
+                    SELECT "{staging_geom}", {staging_columns} FROM staging_drone_points
+                    WHERE fid IN (SELECT min(fid) FROM staging_drone_points
+                                  WHERE batch_id = ? AND action = 'insert'
+                                  GROUP BY machine, date_time)""",
+                (drone_batch.batch_id,)).rowcount
+            connection.execute("DELETE FROM staging_drone_points WHERE batch_id = ?", (drone_batch.batch_id,))
+        self.reload_gpkg_layers(['staging_drone_points', 'drone_points'])
+        return {'staged': staged, 'inserted': inserted, 'updated': updated}
+
+    def load_data_batch_into_tracmap_summary(self, data_batch):
+        """
+        Adds a tracmap_summary row for each summary.txt in the data batch.
+        The cumulative columns carry on from the machine's previous row so
+        the table is never recomputed from scratch. A job already loaded for
+        the machine is skipped, jobs are identified by their job folder name.
+        Figures in a unit that is not recognised are left out and reported in
+        data_batch.summary_warnings.
+        :param data_batch: data_reader.TracmapDataBatch()
+        :return: int: rows added
+        """
+        tm_fields = TRACMAP_SUMMARY_FIELDS
+        connection = self.gpkg_connection
+        columns = gpkg_sqlite.table_columns(connection, 'tracmap_summary')
+        # The batch id column was created as bacth_id in older projects
+        batch_column = 'batch_id' if 'batch_id' in columns else 'bacth_id'
+        if 'job_name' not in columns:
+            # Projects from before the job name was kept
+            with connection:
+                connection.execute("ALTER TABLE tracmap_summary ADD COLUMN job_name TEXT")
+        previous = connection.execute(
+            f"SELECT {', '.join(f'cumulative_{i}' for i in tm_fields)} FROM tracmap_summary "
+            f"WHERE machine_code = ? ORDER BY fid DESC LIMIT 1", (data_batch.machine_code,)).fetchone()
+        cumulative = dict(zip(tm_fields, [i or 0.0 for i in previous] if previous else [0.0] * len(tm_fields)))
+        loaded_jobs = {i[0] for i in connection.execute("SELECT job_name FROM tracmap_summary "
+                                                        "WHERE machine_code = ? AND job_name IS NOT NULL",
+                                                        (data_batch.machine_code,))}
+        # Rows loaded before the job name was kept can only be matched on their figures
+        loaded_figures = set(connection.execute(f"SELECT {', '.join(tm_fields)} FROM tracmap_summary "
+                                                f"WHERE machine_code = ? AND job_name IS NULL",
+                                                (data_batch.machine_code,)).fetchall())
+
+        rows = []
+        for layer_name, summary in data_batch.summary_layers.items():
+            job_name = layer_name[:-len('_summary')]
+            if job_name in loaded_jobs:
+                continue
+            figures = data_reader.parse_tracmap_summary(summary, data_batch.summary_warnings)
+            if not figures:
+                continue
+            values = tuple(figures.get(i) for i in tm_fields)
+            if values in loaded_figures:
+                continue
+            loaded_jobs.add(job_name)
+            for field_name in tm_fields:
+                cumulative[field_name] += figures.get(field_name) or 0.0
+            rows.append((data_batch.machine_code, *values, *[cumulative[i] for i in tm_fields],
+                         data_batch.batch_id, job_name))
+
+        insert_columns = ['machine_code', *tm_fields, *[f'cumulative_{i}' for i in tm_fields], batch_column,
+                          'job_name']
+        with connection:
+            connection.executemany(f"INSERT INTO tracmap_summary ({', '.join(insert_columns)}) "
+                                   f"VALUES ({', '.join(['?'] * len(insert_columns))})", rows)
+        self.reload_gpkg_layers(['tracmap_summary'])
+        return len(rows)
+
+    def recalculate_tracmap_summary_cumulative(self, machine_code, connection=None):
+        """
+        Rebuilds the cumulative columns of a machine's tracmap_summary rows
+        from the row figures, e.g. after rows were deleted. Run it inside the
+        transaction of the change so the totals are never left stale.
+        :param machine_code: str
+        :param connection: sqlite3.Connection: the connection holding the transaction,
+            defaults to gpkg_connection
+        :return: int: rows updated
+        """
+        connection = connection or self.gpkg_connection
+        running_totals = ', '.join(f"sum(coalesce({i}, 0)) OVER (ORDER BY fid)" for i in TRACMAP_SUMMARY_FIELDS)
+        rows = connection.execute(f"SELECT {running_totals}, fid FROM tracmap_summary WHERE machine_code = ? "
+                                  f"ORDER BY fid", (machine_code,)).fetchall()
+        connection.executemany(f"UPDATE tracmap_summary SET "
+                               f"{', '.join(f'cumulative_{i} = ?' for i in TRACMAP_SUMMARY_FIELDS)} WHERE fid = ?",
+                               rows)
+        return len(rows)
+
+    def tracmap_summary_cross_check(self, machine_code):
+        """
+        Compares Tracmap's own running totals for a machine with the totals
+        of the calculated load_summary.
+        :param machine_code: str
+        :return: dict
+        """
+        connection = self.gpkg_connection
+        tracmap = connection.execute("SELECT cumulative_tm_real_area, cumulative_tm_distance_spreading "
+                                     "FROM tracmap_summary WHERE machine_code = ? ORDER BY fid DESC LIMIT 1",
+                                     (machine_code,)).fetchone() or (None, None)
+        calculated = connection.execute("SELECT sum(sum_hectares_square), sum(distance_spreading) "
+                                        "FROM load_summary WHERE machine_code = ?", (machine_code,)).fetchone()
+        return {'tracmap_real_area_ha': tracmap[0],
+                'calculated_area_ha': calculated[0],
+                'tracmap_distance_spreading_km': tracmap[1],
+                'calculated_distance_spreading_km': calculated[1] / 1000 if calculated[1] is not None else None}
+
     def join_heli_points_to_load_site_by_machine(self, machine_code):
         """
         Spatial Joins load site features to heli points for a given machine
@@ -353,7 +716,7 @@ class FlightlineProject:
 
         heli_points_output = processing.run("native:extractbyexpression", {
             'INPUT': heli_points_lyr_path,
-            'EXPRESSION': f'"machine_code" ILIKE \'{machine_code}\'',
+            'EXPRESSION': f'"machine_code" = \'{machine_code}\'',
             'OUTPUT': 'TEMPORARY_OUTPUT'})
 
         load_site_output = processing.run("native:extractbyexpression", {
@@ -376,87 +739,89 @@ class FlightlineProject:
 
         return heli_load_site_sj_output['OUTPUT']
 
+    def delete_rows(self, table_name, where, parameters=()):
+        """
+        Runs a single DELETE on a gpkg table, see gpkg_sqlite.delete_rows
+        :param table_name: str
+        :param where: str: sql condition with ? placeholders
+        :param parameters: tuple
+        :return: int: rows deleted
+        """
+        deleted = gpkg_sqlite.delete_rows(self.gpkg_connection, table_name, where, parameters)
+        self.reload_gpkg_layers([table_name])
+        return deleted
+
     def delete_batch_id_data(self, batch_id, table_name):
         """ Deletes data batches from the gpkg
         :param batch_id: <str>
         :param table_name: <str>
+        :return: int: rows deleted
         """
+        return self.delete_rows(table_name, '"batch_id" = ?', (batch_id,))
 
-        gpkg_lyr = self.gpkg_layer(table_name)
-        expression = QgsExpression(f"\"batch_id\" ILIKE '{batch_id}'")
-        request = QgsFeatureRequest(expression)
-
-        counter = 0
-        gpkg_lyr.startEditing()
-        for f in gpkg_lyr.getFeatures(request=request):
-            gpkg_lyr.deleteFeature(f.id())
-            counter += 1
-
-        gpkg_lyr.commitChanges()
-        return counter
+    def delete_data_batch(self, batch_id, tables=None):
+        """
+        Removes a data batch from heli_points and the derived tables in one
+        transaction, then archives the raw data folder once the delete has
+        been committed. If any delete fails nothing is removed and the
+        folder is left in place.
+        :param batch_id: str
+        :param tables: list<str>: defaults to DATA_BATCH_TABLES
+        :return: tuple(dict<table_name: rows deleted>, str: archive message)
+        """
+        connection = self.gpkg_connection
+        deleted = {}
+        summary_machines = []
+        with gpkg_sqlite.transaction(connection):
+            for table_name in tables or DATA_BATCH_TABLES:
+                columns = gpkg_sqlite.table_columns(connection, table_name)
+                # The batch id column was created as bacth_id in the tracmap_summary table
+                batch_columns = [i for i in ['batch_id', 'bacth_id'] if i in columns]
+                if not batch_columns:
+                    deleted[table_name] = 0
+                    continue
+                if table_name == 'tracmap_summary':
+                    summary_machines = [i[0] for i in connection.execute(
+                        f'SELECT DISTINCT machine_code FROM tracmap_summary WHERE "{batch_columns[0]}" = ?',
+                        (batch_id,))]
+                deleted[table_name] = gpkg_sqlite.delete_rows(connection, table_name, f'"{batch_columns[0]}" = ?',
+                                                              (batch_id,))
+            # The running totals of the later rows included the deleted summaries
+            for machine_code in summary_machines:
+                self.recalculate_tracmap_summary_cumulative(machine_code, connection)
+        self.reload_gpkg_layers(deleted)
+        return deleted, data_reader.archive_data_batch(self.raw_data_folder, batch_id)
 
     def delete_machine_load_data(self, machine_code, load_number, table_name):
         """
-        Sets an expression on the provided table and deletes the records
+        Deletes the records of a machine's load from the provided table
         :param machine_code:
         :param load_number:
         :param table_name:
-        :return:
+        :return: int: rows deleted
         """
-
-        gpkg_lyr = self.gpkg_layer(table_name)
-        expression = QgsExpression(f"\"machine_code\" ILIKE '{machine_code}' and \"load_number\" = '{load_number}' ")
-        request = QgsFeatureRequest(expression)
-
-        counter = 0
-        gpkg_lyr.startEditing()
-        for f in gpkg_lyr.getFeatures(request=request):
-            gpkg_lyr.deleteFeature(f.id())
-            counter += 1
-
-        gpkg_lyr.commitChanges()
-        return counter
+        return self.delete_rows(table_name, '"machine_code" = ? AND "load_number" = ?', (machine_code, load_number))
 
     def delete_machine_data(self, machine_code, table_name):
         """
         Deletes data for the given machine out of a table
         :param machine_code:
         :param table_name:
-        :return:
+        :return: int: rows deleted
         """
-        gpkg_lyr = self.gpkg_layer(table_name)
-        expression = QgsExpression(f"\"machine_code\" ILIKE '{machine_code}'")
-        request = QgsFeatureRequest(expression)
-
-        counter = 0
-        gpkg_lyr.startEditing()
-        for f in gpkg_lyr.getFeatures(request=request):
-            gpkg_lyr.deleteFeature(f.id())
-            counter += 1
-        gpkg_lyr.commitChanges()
-        return counter
+        return self.delete_rows(table_name, '"machine_code" = ?', (machine_code,))
 
     def clear_machine_load_numbers(self, machine_code):
         """
         For a given machine, resets the load number to Null
         :param machine_code:
-        :return:
+        :return: int: rows updated
         """
-
-        heli_points_lyr = self.gpkg_layer('heli_points')
-        expression = QgsExpression(f"\"machine_code\" ILIKE '{machine_code}'")
-        request = QgsFeatureRequest(expression)
-        request.setFlags(QgsFeatureRequest.NoGeometry)
-
-        counter = 0
-        heli_points_lyr.startEditing()
-        load_number_i = heli_points_lyr.fields().names().index('load_number')
-        for feat in heli_points_lyr.getFeatures(request=request):
-            heli_points_lyr.changeAttributeValue(feat.id(), load_number_i, None)
-            counter += 1
-        heli_points_lyr.commitChanges()
-
-        return counter
+        with gpkg_sqlite.transaction(self.gpkg_connection) as connection:
+            updated = connection.execute("UPDATE heli_points SET load_number = NULL WHERE machine_code = ?",
+                                         (machine_code,)).rowcount
+        self.reload_gpkg_layers(['heli_points'])
+        return updated
 
     def calculate_load_number_by_machine(self, machine_code):
         """
@@ -524,19 +889,11 @@ class FlightlineProject:
             feature_store[current_feat['src_id']] = load_counter
             lag_in_load_site = in_load_site
 
-        # Update the load number
-        heli_points_lyr = self.gpkg_layer('heli_points')
-        expression = QgsExpression(f"machine_code ILIKE '{machine_code}'")
-        request = QgsFeatureRequest(expression)
-        request.setFlags(QgsFeatureRequest.NoGeometry)
-        request.setSubsetOfAttributes(['src_id', 'load_number'], heli_points_lyr.fields())
-
-        load_number_i = heli_points_lyr.fields().names().index('load_number')
-        heli_points_lyr.startEditing()
-        for feat in heli_points_lyr.getFeatures():
-            if feature_store.get(feat['src_id']) is not None:
-                heli_points_lyr.changeAttributeValue(feat.id(), load_number_i, feature_store.get(feat['src_id']))
-        heli_points_lyr.commitChanges()
+        # Update the load numbers in one transaction, the rows are found by the machine_code, src_id index
+        with gpkg_sqlite.transaction(self.gpkg_connection) as connection:
+            connection.executemany("UPDATE heli_points SET load_number = ? WHERE machine_code = ? AND src_id = ?",
+                                   [(v, machine_code, k) for k, v in feature_store.items() if v is not None])
+        self.reload_gpkg_layers(['heli_points'])
 
         return list(set([i for i in feature_store.values()]))
 
@@ -564,7 +921,7 @@ class FlightlineProject:
         heli_points_lyr = self.gpkg_layer('heli_points')
         clause = QgsFeatureRequest.OrderByClause('date_time', ascending=True)
         orderby = QgsFeatureRequest.OrderBy([clause])
-        expression = QgsExpression(f"\"machine_code\" ILIKE '{machine_code}' AND \"load_number\" LIKE '{load_number}'")
+        expression = QgsExpression(f"\"machine_code\" = '{machine_code}' AND \"load_number\" = {load_number}")
         request = QgsFeatureRequest(expression)
         request.setOrderBy(orderby)
 
@@ -661,7 +1018,7 @@ class FlightlineProject:
         # Update the bait_lines table
         clause = QgsFeatureRequest.OrderByClause('date_time', ascending=True)
         orderby = QgsFeatureRequest.OrderBy([clause])
-        expression = QgsExpression(f"\"machine_code\" ILIKE '{machine_code}' AND \"load_number\" LIKE '{load_number}'")
+        expression = QgsExpression(f"\"machine_code\" = '{machine_code}' AND \"load_number\" = {load_number}")
         request = QgsFeatureRequest(expression)
         request.setOrderBy(orderby)
 
@@ -800,7 +1157,7 @@ class FlightlineProject:
         # Update the bait_lines table
         clause = QgsFeatureRequest.OrderByClause('date_time', ascending=True)
         orderby = QgsFeatureRequest.OrderBy([clause])
-        expression = QgsExpression(f"\"machine_code\" ILIKE '{machine_code}' AND \"load_number\" LIKE '{load_number}'")
+        expression = QgsExpression(f"\"machine_code\" = '{machine_code}' AND \"load_number\" = {load_number}")
         request = QgsFeatureRequest(expression)
         request.setOrderBy(orderby)
 
@@ -850,7 +1207,7 @@ class FlightlineProject:
         heli_points_lyr = self.gpkg_layer('heli_points')
         clause = QgsFeatureRequest.OrderByClause('date_time', ascending=True)
         orderby = QgsFeatureRequest.OrderBy([clause])
-        expression = QgsExpression(f"\"machine_code\" ILIKE '{machine_code}' AND \"load_number\" LIKE '{load_number}'")
+        expression = QgsExpression(f"\"machine_code\" = '{machine_code}' AND \"load_number\" = {load_number}")
         request = QgsFeatureRequest(expression)
         request.setOrderBy(orderby)
 
@@ -945,7 +1302,7 @@ class FlightlineProject:
 
         clause = QgsFeatureRequest.OrderByClause('date_time', ascending=True)
         orderby = QgsFeatureRequest.OrderBy([clause])
-        expression = QgsExpression(f"\"machine_code\" ILIKE '{machine_code}' AND \"load_number\" LIKE '{load_number}'")
+        expression = QgsExpression(f"\"machine_code\" = '{machine_code}' AND \"load_number\" = {load_number}")
         request = QgsFeatureRequest(expression)
         request.setOrderBy(orderby)
 
@@ -996,7 +1353,7 @@ class FlightlineProject:
         """
 
         heli_points_lyr = self.gpkg_layer('heli_points')
-        expression = QgsExpression(f"\"machine_code\" ILIKE '{machine_code}' and \"load_number\" in {tuple(load_numbers)}")
+        expression = QgsExpression(f"\"machine_code\" = '{machine_code}' and \"load_number\" in {tuple(load_numbers)}")
         request = QgsFeatureRequest(expression)
 
         counter = 0
@@ -0,0 +1,166 @@
+# Open Flightline Mini
+
+# Description:
+# Snapshot backups of the project gpkg. A snapshot is a consistent copy of
+# the whole gpkg written with the sqlite online backup API into a backups
+# folder next to the project, optionally gzip compressed. The working
+# layers are not copied into the gpkg itself so it does not grow with each
+# backup. Snapshots are named <gpkg name>_<YYYYMMDD_HHMMSS>[_<n>][_<label>].gpkg(.gz),
+# n numbers the snapshots taken within the same second. The oldest are
+# removed past the retention count, labelled snapshots such as the
+# pre_restore ones count towards it like any other.
+# Does not import qgis so it can be used from worker processes.
+
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+from open_flightline_mini import gpkg_sqlite
+
+
+# Folder under the project folder the snapshots are written to
+BACKUP_FOLDER = 'backups'
+
+# Number of snapshots kept, 0 keeps them all
+DEFAULT_SNAPSHOT_RETENTION = 10
+
+SNAPSHOT_TIME_FORMAT = '%Y%m%d_%H%M%S'
+SNAPSHOT_COMPRESS_LEVEL = 6
+
+
+def snapshot_pattern(gpkg_path):
+    """
+    :param gpkg_path: str
+    :return: re.Pattern: matches the snapshot file names of the gpkg, group 1 is the
+        time and group 2 the number of a snapshot taken within the same second
+    """
+    stem = os.path.splitext(os.path.basename(gpkg_path))[0]
+    return re.compile(rf"^{re.escape(stem)}_(\d{{8}}_\d{{6}})(?:_(\d+))?(_[a-z_]+)?\.gpkg(\.gz)?$")
+
+
+def list_snapshots(gpkg_path, backup_folder):
+    """
+    :param gpkg_path: str
+    :param backup_folder: str
+    :return: list<str>: snapshot paths, newest first
+    """
+    if not os.path.isdir(backup_folder):
+        return []
+    pattern = snapshot_pattern(gpkg_path)
+    matches = [pattern.match(i) for i in os.listdir(backup_folder)]
+    snapshots = [(i.group(1), int(i.group(2) or 1), i.group(0)) for i in matches if i]
+    return [os.path.join(backup_folder, i[2]) for i in sorted(snapshots, reverse=True)]
+
+
+def reserve_snapshot_path(gpkg_path, backup_folder, label=None):
+    """
+    Picks the next snapshot name for the current second and creates its
+    temporary file, so two snapshots taken within the same second do not
+    overwrite each other and still list in the order they were taken.
+    :param gpkg_path: str
+    :param backup_folder: str
+    :param label: str
+    :return: str: snapshot path without the .gz, its .tmp file has been created
+    """
+    stem = os.path.splitext(os.path.basename(gpkg_path))[0]
+    pattern = snapshot_pattern(gpkg_path)
+    snapshot_time = datetime.now().strftime(SNAPSHOT_TIME_FORMAT)
+    while True:
+        # Snapshots still being written count, their .tmp file has the snapshot name
+        matches = [pattern.match(re.sub(r'\.tmp(\.gz)?$', '', i)) for i in os.listdir(backup_folder)]
+        number = max([int(i.group(2) or 1) for i in matches if i and i.group(1) == snapshot_time], default=0) + 1
+        name = f"{stem}_{snapshot_time}{f'_{number}' if number > 1 else ''}{f'_{label}' if label else ''}.gpkg"
+        snapshot_path = os.path.join(backup_folder, name)
+        try:
+            open(f"{snapshot_path}.tmp", 'x').close()
+            return snapshot_path
+        except FileExistsError:
+            continue
+
+
+def snapshot_gpkg(gpkg_path, backup_folder, compress=False, label=None):
+    """
+    Writes a consistent copy of the gpkg to the backup folder. The copy is
+    written to a temporary file first so a failed snapshot never leaves a
+    partial file with a snapshot name.
+    :param gpkg_path: str
+    :param backup_folder: str
+    :param compress: bool: gzip the snapshot
+    :param label: str: added to the name, e.g. 'pre_restore'
+    :return: str: snapshot path
+    """
+    os.makedirs(backup_folder, exist_ok=True)
+    snapshot_path = reserve_snapshot_path(gpkg_path, backup_folder, label)
+    temp_path = f"{snapshot_path}.tmp"
+
+    try:
+        with closing(sqlite3.connect(gpkg_path, timeout=gpkg_sqlite.GPKG_TIMEOUT)) as source, \
+                closing(sqlite3.connect(temp_path)) as destination:
+            # All pages in one step so the copy is of a single point in time
+            source.backup(destination)
+
+        if compress:
+            snapshot_path = f"{snapshot_path}.gz"
+            with open(temp_path, 'rb') as raw_file, \
+                    gzip.open(f"{temp_path}.gz", 'wb', compresslevel=SNAPSHOT_COMPRESS_LEVEL) as compressed_file:
+                shutil.copyfileobj(raw_file, compressed_file)
+            os.remove(temp_path)
+            temp_path = f"{temp_path}.gz"
+        os.replace(temp_path, snapshot_path)
+    except BaseException:
+        for path in [temp_path, f"{temp_path}.gz"]:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    return snapshot_path
+
+
+def rotate_snapshots(gpkg_path, backup_folder, retention=DEFAULT_SNAPSHOT_RETENTION, keep=()):
+    """
+    Removes the oldest snapshots past the retention count, labelled
+    snapshots included
+    :param gpkg_path: str
+    :param backup_folder: str
+    :param retention: int: snapshots kept, 0 keeps them all
+    :param keep: list<str>: snapshot paths that are never removed, e.g. the one just restored
+    :return: list<str>: snapshots removed
+    """
+    if not retention or retention <= 0:
+        return []
+    keep = [os.path.normcase(os.path.abspath(i)) for i in keep]
+    removed = [i for i in list_snapshots(gpkg_path, backup_folder)[retention:]
+               if os.path.normcase(os.path.abspath(i)) not in keep]
+    for snapshot_path in removed:
+        os.remove(snapshot_path)
+    return removed
+
+
+def restore_snapshot(snapshot_path, gpkg_path):
+    """
+    Copies a snapshot back over the project gpkg with the online backup API,
+    so connections QGIS already has open see the restored data. The snapshot
+    is checked before anything in the gpkg is changed.
+    :param snapshot_path: str: .gpkg or .gpkg.gz
+    :param gpkg_path: str
+    :return: str: snapshot_path
+    """
+    source_path = snapshot_path
+    if snapshot_path.endswith('.gz'):
+        source_path = f"{snapshot_path[:-3]}.restore.tmp"
+        with gzip.open(snapshot_path, 'rb') as compressed_file, open(source_path, 'wb') as raw_file:
+            shutil.copyfileobj(compressed_file, raw_file)
+    try:
+        with closing(sqlite3.connect(source_path)) as source:
+            check = source.execute("PRAGMA quick_check").fetchone()[0]
+            if check != 'ok':
+                raise ValueError(f"{snapshot_path} is not a valid gpkg: {check}")
+            with closing(sqlite3.connect(gpkg_path, timeout=gpkg_sqlite.GPKG_TIMEOUT)) as destination:
+                source.backup(destination)
+    finally:
+        if source_path != snapshot_path:
+            os.remove(source_path)
+    return snapshot_path
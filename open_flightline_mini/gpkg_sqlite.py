@@ -0,0 +1,489 @@
+# Open Flightline Mini
+
+# Description:
+# Direct sqlite access to the project geopackage for bulk reads and writes
+# where going through a QgsVectorLayer a feature at a time is too slow.
+# The rtree triggers that GDAL creates on each layer call the spatialite
+# ST_ functions, these are registered as python functions on the connection
+# so rows can be written without loading spatialite.
+# Does not import qgis so it can be used from worker processes.
+
+import sqlite3
+import struct
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+
+# Seconds to wait for QGIS to release a lock on the gpkg
+GPKG_TIMEOUT = 30
+
+# Unique index that skips heli_points already loaded
+HELI_POINTS_SRC_ID_INDEX = 'idx_heli_points_machine_code_src_id'
+
+# Attribute indexes on the working layers, table: list<(index name, unique, columns)>
+# The processing queries filter on machine_code and load_number (or batch_id)
+# and order by date_time. A unique index is not created on a table that
+# already has duplicate rows, those are removed by the upgrade tool.
+GPKG_INDEXES = {
+    'heli_points': [(HELI_POINTS_SRC_ID_INDEX, True, ['machine_code', 'src_id']),
+                    ('idx_heli_points_machine_code_load_number', False, ['machine_code', 'load_number', 'date_time']),
+                    ('idx_heli_points_batch_id', False, ['batch_id'])],
+    'heli_bait_lines_detailed': [('idx_heli_bait_lines_detailed_machine_code_load_number', False,
+                                  ['machine_code', 'load_number', 'date_time']),
+                                 ('idx_heli_bait_lines_detailed_batch_id', False, ['batch_id'])],
+    'heli_bait_lines': [('idx_heli_bait_lines_machine_code_load_number', False,
+                         ['machine_code', 'load_number', 'date_time']),
+                        ('idx_heli_bait_lines_batch_id', False, ['batch_id'])],
+    'heli_bait_lines_buffered': [('idx_heli_bait_lines_buffered_machine_code_load_number', False,
+                                  ['machine_code', 'load_number', 'date_time']),
+                                 ('idx_heli_bait_lines_buffered_batch_id', False, ['batch_id'])],
+    'flight_path': [('idx_flight_path_machine_code_load_number', False, ['machine_code', 'load_number']),
+                    ('idx_flight_path_batch_id', False, ['batch_id'])],
+    'load_summary': [('idx_load_summary_machine_code_load_number', False, ['machine_code', 'load_number']),
+                     ('idx_load_summary_batch_id', False, ['batch_id'])],
+    'tracmap_summary': [('idx_tracmap_summary_machine_code', False, ['machine_code'])],
+    'drone_points': [('idx_drone_points_machine_date_time', False, ['machine', 'date_time']),
+                     ('idx_drone_points_batch_id', False, ['batch_id'])],
+    'staging_drone_points': [('idx_staging_drone_points_batch_id', False, ['batch_id'])],
+    'staging_heli_points': [('idx_staging_heli_points_batch_id', False, ['batch_id'])]}
+
+# Pragmas set for the length of a bulk load, restored afterwards
+BULK_LOAD_PRAGMAS = {'synchronous': 'NORMAL',
+                     'cache_size': -256000,  # KiB
+                     'temp_store': 'MEMORY'}
+
+# WKB geometry type (without Z/M) to the number of nested levels of coordinates
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_POLYGON = 3
+
+# GPKG geometry blob header of a little endian point without an envelope
+GPKG_POINT_DTYPE = np.dtype([('magic', 'S2'),
+                             ('version', 'u1'),
+                             ('flags', 'u1'),
+                             ('srs_id', '<i4'),
+                             ('byte_order', 'u1'),
+                             ('wkb_type', '<u4'),
+                             ('x', '<f8'),
+                             ('y', '<f8')])
+
+GPKG_ENVELOPE_SIZES = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+
+
+def _gpkg_header(blob):
+    """
+    :param blob: bytes: gpkg geometry blob
+    :return: tuple(empty, envelope_size, byte_order, wkb_offset)
+    """
+    flags = blob[3]
+    envelope_size = GPKG_ENVELOPE_SIZES.get((flags >> 1) & 0x07, 0)
+    return bool(flags & 0x10), envelope_size, '<' if flags & 0x01 else '>', 8 + envelope_size
+
+
+def _wkb_coordinates(wkb, offset, coordinates):
+    """
+    Appends the x, y of every vertex of a WKB geometry to coordinates
+    :param wkb: bytes
+    :param offset: int: start of the geometry
+    :param coordinates: list<tuple(x, y)>
+    :return: int: offset of the end of the geometry
+    """
+    byte_order = '<' if wkb[offset] == 1 else '>'
+    wkb_type = struct.unpack_from(f"{byte_order}I", wkb, offset + 1)[0]
+    offset += 5
+    dimensions = 2
+    if wkb_type & 0x80000000:
+        dimensions += 1
+    if wkb_type & 0x40000000:
+        dimensions += 1
+    wkb_type &= 0x0FFFFFFF
+    iso_dimensions, base_type = divmod(wkb_type, 1000)
+    dimensions += {0: 0, 1: 1, 2: 1, 3: 2}[iso_dimensions]
+    point_size = 8 * dimensions
+
+    if base_type == WKB_POINT:
+        x, y = struct.unpack_from(f"{byte_order}dd", wkb, offset)
+        coordinates.append((x, y))
+        return offset + point_size
+    if base_type == WKB_LINESTRING:
+        point_count = struct.unpack_from(f"{byte_order}I", wkb, offset)[0]
+        offset += 4
+        for i in range(point_count):
+            coordinates.append(struct.unpack_from(f"{byte_order}dd", wkb, offset + i * point_size))
+        return offset + point_count * point_size
+    if base_type == WKB_POLYGON:
+        ring_count = struct.unpack_from(f"{byte_order}I", wkb, offset)[0]
+        offset += 4
+        for ring in range(ring_count):
+            point_count = struct.unpack_from(f"{byte_order}I", wkb, offset)[0]
+            offset += 4
+            for i in range(point_count):
+                coordinates.append(struct.unpack_from(f"{byte_order}dd", wkb, offset + i * point_size))
+            offset += point_count * point_size
+        return offset
+    # Multi geometries and geometry collections
+    part_count = struct.unpack_from(f"{byte_order}I", wkb, offset)[0]
+    offset += 4
+    for part in range(part_count):
+        offset = _wkb_coordinates(wkb, offset, coordinates)
+    return offset
+
+
+def gpkg_envelope(blob):
+    """
+    :param blob: bytes: gpkg geometry blob
+    :return: tuple(min_x, max_x, min_y, max_y) or None for an empty geometry
+    """
+    if blob is None:
+        return None
+    empty, envelope_size, byte_order, wkb_offset = _gpkg_header(blob)
+    if empty:
+        return None
+    if envelope_size:
+        return struct.unpack_from(f"{byte_order}dddd", blob, 8)
+    coordinates = []
+    _wkb_coordinates(blob, wkb_offset, coordinates)
+    coordinates = [i for i in coordinates if i[0] == i[0] and i[1] == i[1]]
+    if not coordinates:
+        return None
+    x, y = zip(*coordinates)
+    return min(x), max(x), min(y), max(y)
+
+
+def st_is_empty(blob):
+    if blob is None:
+        return None
+    return int(gpkg_envelope(blob) is None)
+
+
+def _envelope_function(index):
+    def envelope_value(blob):
+        envelope = gpkg_envelope(blob)
+        if envelope is None:
+            return None
+        return envelope[index]
+    return envelope_value
+
+
+def connect(gpkg_path, read_only=False):
+    """
+    Opens the gpkg with the functions the gpkg triggers need
+    :param gpkg_path: str
+    :param read_only: bool: open an existing gpkg without write access, a
+        missing gpkg raises sqlite3.OperationalError instead of being created
+    :return: sqlite3.Connection
+    """
+    if read_only:
+        connection = sqlite3.connect(f"{Path(gpkg_path).resolve().as_uri()}?mode=ro", uri=True, timeout=GPKG_TIMEOUT)
+    else:
+        connection = sqlite3.connect(gpkg_path, timeout=GPKG_TIMEOUT)
+    connection.create_function('ST_IsEmpty', 1, st_is_empty, deterministic=True)
+    for index, function_name in enumerate(['ST_MinX', 'ST_MaxX', 'ST_MinY', 'ST_MaxY']):
+        connection.create_function(function_name, 1, _envelope_function(index), deterministic=True)
+    return connection
+
+
+def geometry_column(connection, table_name):
+    """
+    :param connection: sqlite3.Connection
+    :param table_name: str
+    :return: tuple(column_name, srs_id) or None for a table without geometry
+    """
+    return connection.execute("SELECT column_name, srs_id FROM gpkg_geometry_columns "
+                              "WHERE lower(table_name) = lower(?)", (table_name,)).fetchone()
+
+
+def table_columns(connection, table_name):
+    """
+    :param connection: sqlite3.Connection
+    :param table_name: str
+    :return: list<str>: column names, empty if the table does not exist
+    """
+    return [i[1] for i in connection.execute(f'PRAGMA table_info("{table_name}")')]
+
+
+def duplicate_rows(connection, table_name, columns):
+    """
+    Finds the rows that repeat the values of the columns of an earlier row.
+    Rows with a null in any of the columns are not duplicates.
+    :param connection: sqlite3.Connection
+    :param table_name: str
+    :param columns: list<str>
+    :return: list<int>: fids of the repeats, the first row of each is not included
+    """
+    fid = primary_key(connection, table_name)
+    column_list = ', '.join(f'"{i}"' for i in columns)
+    not_null = ' AND '.join(f'"{i}" IS NOT NULL' for i in columns)
+    return [i[0] for i in connection.execute(
+        f'SELECT "{fid}" FROM "{table_name}" WHERE {not_null} AND "{fid}" NOT IN ('
+        f'SELECT min("{fid}") FROM "{table_name}" WHERE {not_null} GROUP BY {column_list}) ORDER BY "{fid}"')]
+
+
+def index_exists(connection, index_name):
+    """
+    :param connection: sqlite3.Connection
+    :param index_name: str
+    :return: bool
+    """
+    return connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND lower(name) = lower(?)",
+                              (index_name,)).fetchone() is not None
+
+
+def create_gpkg_indexes(connection, indexes=None):
+    """
+    Creates any of the GPKG_INDEXES that are missing, so new layers and
+    layers from older projects get the same indexes. Indexes on columns a
+    table does not have are skipped, as are unique indexes on a table with
+    duplicate rows. No rows are changed.
+    :param connection: sqlite3.Connection
+    :param indexes: dict: defaults to GPKG_INDEXES
+    :return: list<str>: indexes created
+    """
+    existing = {i[0].lower() for i in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    created = []
+    for table_name, table_indexes in (indexes or GPKG_INDEXES).items():
+        columns_in_table = table_columns(connection, table_name)
+        for index_name, unique, columns in table_indexes:
+            if index_name.lower() in existing or not all([i in columns_in_table for i in columns]):
+                continue
+            if unique and duplicate_rows(connection, table_name, columns):
+                continue
+            column_list = ', '.join(f'"{i}"' for i in columns)
+            with connection:
+                connection.execute(f'CREATE {"UNIQUE " if unique else ""}INDEX "{index_name}" '
+                                   f'ON "{table_name}" ({column_list})')
+            created.append(index_name)
+    if created:
+        # Gives the query planner statistics for the new indexes
+        connection.execute("PRAGMA optimize")
+    return created
+
+
+def gpkg_size(connection):
+    """
+    :param connection: sqlite3.Connection
+    :return: int: bytes used by the database pages
+    """
+    return connection.execute("PRAGMA page_count").fetchone()[0] * connection.execute("PRAGMA page_size").fetchone()[0]
+
+
+def drop_tables(connection, table_names):
+    """
+    Drops gpkg tables along with their rtree index and their rows in the
+    gpkg metadata tables, all in one transaction.
+    :param connection: sqlite3.Connection
+    :param table_names: list<str>
+    :return: list<str>: tables dropped
+    """
+    metadata_tables = [i for i in ['gpkg_contents', 'gpkg_geometry_columns', 'gpkg_ogr_contents', 'gpkg_extensions',
+                                   'gpkg_data_columns', 'gpkg_metadata_reference'] if table_columns(connection, i)]
+    dropped = []
+    with transaction(connection):
+        for table_name in table_names:
+            if not table_columns(connection, table_name):
+                continue
+            geometry = geometry_column(connection, table_name)
+            if geometry:
+                connection.execute(f'DROP TABLE IF EXISTS "rtree_{table_name}_{geometry[0]}"')
+            # The table's triggers are dropped with it
+            connection.execute(f'DROP TABLE "{table_name}"')
+            for metadata_table in metadata_tables:
+                connection.execute(f"DELETE FROM {metadata_table} WHERE lower(table_name) = lower(?)", (table_name,))
+            dropped.append(table_name)
+    return dropped
+
+
+def reclaim_space(connection):
+    """
+    Returns the free pages left by dropped tables to the file system.
+    Uses an incremental vacuum when the gpkg has incremental auto vacuum,
+    otherwise a full VACUUM is run once and the gpkg is switched to
+    incremental auto vacuum so later cleanups are quicker.
+    :param connection: sqlite3.Connection
+    :return: int: bytes reclaimed
+    """
+    size_before = gpkg_size(connection)
+    if connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        # Frees one page each time the statement is stepped, execute() only
+        # steps once where executescript() runs it to completion
+        connection.executescript("PRAGMA incremental_vacuum")
+    else:
+        connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        connection.execute("VACUUM")
+    return size_before - gpkg_size(connection)
+
+
+def point_blobs(x, y, srs_id):
+    """
+    Encodes arrays of coordinates as gpkg point geometry blobs in bulk
+    :param x: np.array<float64>
+    :param y: np.array<float64>
+    :param srs_id: int
+    :return: list<bytes>, None where a coordinate is nan
+    """
+    points = np.zeros(len(x), dtype=GPKG_POINT_DTYPE)
+    points['magic'] = b'GP'
+    points['flags'] = 0x01
+    points['srs_id'] = srs_id
+    points['byte_order'] = 1
+    points['wkb_type'] = WKB_POINT
+    points['x'] = x
+    points['y'] = y
+    # numpy strips trailing null bytes from S fields so slice the raw buffer
+    data = points.tobytes()
+    size = GPKG_POINT_DTYPE.itemsize
+    valid = ~(np.isnan(points['x']) | np.isnan(points['y']))
+    return [data[i * size:(i + 1) * size] if is_valid else None for i, is_valid in enumerate(valid.tolist())]
+
+
+def point_blob_coordinates(blob):
+    """
+    :param blob: bytes: gpkg point blob
+    :return: tuple(x, y) or None
+    """
+    if blob is None:
+        return None
+    empty, envelope_size, byte_order, wkb_offset = _gpkg_header(blob)
+    if empty:
+        return None
+    coordinates = []
+    _wkb_coordinates(blob, wkb_offset, coordinates)
+    return coordinates[0]
+
+
+def primary_key(connection, table_name):
+    """
+    :param connection: sqlite3.Connection
+    :param table_name: str
+    :return: str: integer primary key column, fid for tables created by GDAL
+    """
+    for column in connection.execute(f'PRAGMA table_info("{table_name}")'):
+        if column[5]:
+            return column[1]
+    return 'rowid'
+
+
+def _drop_triggers(connection, trigger_names):
+    """
+    :param connection: sqlite3.Connection
+    :param trigger_names: list<str>: triggers that do not exist are ignored
+    :return: dict<trigger name: create sql> of the triggers dropped
+    """
+    triggers = dict(connection.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name IN ({', '.join(['?'] * len(trigger_names))})",
+        trigger_names).fetchall())
+    for trigger_name in triggers:
+        connection.execute(f'DROP TRIGGER "{trigger_name}"')
+    return triggers
+
+
+@contextmanager
+def bulk_load(connection, table_name):
+    """
+    Runs the rows inserted into a table inside the block as a single
+    transaction. The per row insert triggers GDAL puts on the table, the
+    rtree index and the gpkg_ogr_contents feature count, are dropped for the
+    length of the load and brought up to date for the new rows with one
+    statement each at the end, then the triggers are put back. Any error
+    rolls the whole load back, including the trigger changes.
+    :param connection: sqlite3.Connection
+    :param table_name: str
+    """
+    geometry = geometry_column(connection, table_name)
+    pragmas = {i: connection.execute(f"PRAGMA {i}").fetchone()[0] for i in BULK_LOAD_PRAGMAS}
+    for pragma, value in BULK_LOAD_PRAGMAS.items():
+        connection.execute(f"PRAGMA {pragma} = {value}")
+    try:
+        with transaction(connection):
+            fid = primary_key(connection, table_name)
+            max_fid = connection.execute(f'SELECT coalesce(max("{fid}"), 0) FROM "{table_name}"').fetchone()[0]
+            rtree_name = f"rtree_{table_name}_{geometry[0]}" if geometry else None
+            triggers = _drop_triggers(connection, [f"{rtree_name}_insert", f"trigger_insert_feature_count_{table_name}"])
+
+            yield
+
+            if f"{rtree_name}_insert" in triggers:
+                geom = geometry[0]
+                connection.execute(
+                    f'INSERT OR REPLACE INTO "{rtree_name}" '
+                    f'SELECT "{fid}", ST_MinX("{geom}"), ST_MaxX("{geom}"), ST_MinY("{geom}"), ST_MaxY("{geom}") '
+                    f'FROM "{table_name}" WHERE "{fid}" > ? AND "{geom}" NOT NULL AND NOT ST_IsEmpty("{geom}")',
+                    (max_fid,))
+                _update_contents_extent(connection, table_name, rtree_name, max_fid)
+            if f"trigger_insert_feature_count_{table_name}" in triggers:
+                connection.execute(f"""UPDATE gpkg_ogr_contents SET feature_count = feature_count + (
+                                           SELECT count(*) FROM "{table_name}" WHERE "{fid}" > ?)
+                                       WHERE lower(table_name) = lower(?)""", (max_fid, table_name))
+            for trigger_sql in triggers.values():
+                connection.execute(trigger_sql)
+    finally:
+        for pragma, value in pragmas.items():
+            connection.execute(f"PRAGMA {pragma} = {value}")
+
+
+@contextmanager
+def transaction(connection):
+    """
+    Runs the statements inside the block as one write transaction, rolled
+    back on any error. Trigger drops and creates are included, unlike the
+    implicit transactions of the sqlite3 module.
+    :param connection: sqlite3.Connection
+    """
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield connection
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+
+
+def delete_rows(connection, table_name, where, parameters=()):
+    """
+    Deletes the rows matching a where clause with one DELETE statement.
+    The per row delete triggers of the rtree index and feature count are
+    replaced by one statement each. Run inside transaction() when deleting
+    from several tables, otherwise it is a transaction of its own.
+    :param connection: sqlite3.Connection
+    :param table_name: str
+    :param where: str: sql condition, e.g. 'machine_code = ? AND load_number = ?'
+    :param parameters: tuple: values for the condition
+    :return: int: rows deleted
+    """
+    if not connection.in_transaction:
+        with transaction(connection):
+            return delete_rows(connection, table_name, where, parameters)
+    if not table_columns(connection, table_name):
+        return 0
+    geometry = geometry_column(connection, table_name)
+    fid = primary_key(connection, table_name)
+    rtree_name = f"rtree_{table_name}_{geometry[0]}" if geometry else None
+    triggers = _drop_triggers(connection, [f"{rtree_name}_delete", f"trigger_delete_feature_count_{table_name}"])
+    if f"{rtree_name}_delete" in triggers:
+        connection.execute(f'DELETE FROM "{rtree_name}" WHERE id IN '
+                           f'(SELECT "{fid}" FROM "{table_name}" WHERE {where})', parameters)
+    deleted = connection.execute(f'DELETE FROM "{table_name}" WHERE {where}', parameters).rowcount
+    if f"trigger_delete_feature_count_{table_name}" in triggers:
+        connection.execute("UPDATE gpkg_ogr_contents SET feature_count = feature_count - ? "
+                           "WHERE lower(table_name) = lower(?)", (deleted, table_name))
+    for trigger_sql in triggers.values():
+        connection.execute(trigger_sql)
+    return deleted
+
+
+def _update_contents_extent(connection, table_name, rtree_name, max_fid):
+    """Grows the gpkg_contents extent to cover the rows added after max_fid"""
+    extent = connection.execute(f'SELECT min(minx), max(maxx), min(miny), max(maxy) FROM "{rtree_name}" '
+                                f'WHERE id > ?', (max_fid,)).fetchone()
+    if extent[0] is None:
+        return
+    connection.execute("""UPDATE gpkg_contents SET
+                              min_x = min(coalesce(min_x, ?1), ?1), max_x = max(coalesce(max_x, ?2), ?2),
+                              min_y = min(coalesce(min_y, ?3), ?3), max_y = max(coalesce(max_y, ?4), ?4),
+                              last_change = ?5
+                          WHERE lower(table_name) = lower(?6)""",
+                       (*extent, datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+                        table_name))
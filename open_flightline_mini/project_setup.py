@@ -7,10 +7,10 @@
 # Manages the setup of the Flightline project geopackage
 
 import os
+from contextlib import closing
 
 from osgeo import ogr
 import re
-from qgis import processing
 from PyQt5.QtCore import QVariant
 from qgis.core import (
     QgsVectorLayer,
@@ -20,6 +20,8 @@ from qgis.core import (
     QgsCoordinateReferenceSystem,
     QgsCoordinateTransformContext)
 
+from open_flightline_mini import gpkg_sqlite
+
 
 # Generate in memory Tables/Layers
 def generate_table_batch_load():
@@ -324,7 +326,7 @@ def generate_table_staging_drone_points():
                             QgsField("hdop", QVariant.Int),
                             QgsField("vbat", QVariant.Double),
                             QgsField('action', QVariant.String)])
-    generate_table_drone_points().updateFields()
+    drone_point_lyr.updateFields()
     return drone_point_lyr
 
 
@@ -372,7 +374,8 @@ def generate_table_tracmap_summary():
                             QgsField("tm_real_area", QVariant.Double),
                             QgsField("tm_distance_travelled", QVariant.Double),
                             QgsField("tm_distance_spreading", QVariant.Double),
-                            QgsField("bacth_id", QVariant.String)])
+                            QgsField("bacth_id", QVariant.String),
+                            QgsField("job_name", QVariant.String)])
     tracmap_summary_lyr.updateFields()
     return tracmap_summary_lyr
 
@@ -535,24 +538,27 @@ class GeopackageDataStore:
                                                 options)
             print(f'Created Layer: {lyr.name()}')
         del writer
+        with closing(gpkg_sqlite.connect(self.gpkg_path)) as connection:
+            gpkg_sqlite.create_gpkg_indexes(connection)
         return True
 
     def cleanup_gpkg_copies(self):
         """
         Removes any of the working layers that have a number at the end.
-        :return:
+        The tables and their gpkg metadata are dropped in one transaction,
+        then the free space is reclaimed.
+        :return: tuple(list<str>: layers removed, list<Exception>: errors, int: bytes reclaimed)
         """
-        # The processing module runs within QGIS but not outside
-        # Exclude from any out of QGIS testing
         layers_removed = []
         errors = []
-
-        for gpkg_lyr_name in self.gpkg_backup_list:
-            inputs = {"DATABASE": self.gpkg_path,
-                      "SQL": f"DROP TABLE {gpkg_lyr_name}"}
-            try:
-                processing.run("native:spatialiteexecutesql", inputs)
-                layers_removed.append(gpkg_lyr_name)
-            except Exception as e:
-                errors.append(e)
-        return layers_removed, errors
+        bytes_reclaimed = 0
+
+        backup_layers = [i for i in self.gpkg_backup_list
+                         if i.lower() not in self.working_layers_list + self.static_layers_list]
+        try:
+            with closing(gpkg_sqlite.connect(self.gpkg_path)) as connection:
+                layers_removed = gpkg_sqlite.drop_tables(connection, backup_layers)
+                bytes_reclaimed = gpkg_sqlite.reclaim_space(connection)
+        except Exception as e:
+            errors.append(e)
+        return layers_removed, errors, bytes_reclaimed
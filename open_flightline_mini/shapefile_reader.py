@@ -0,0 +1,208 @@
+# Open Flightline Mini
+
+# Description:
+# Reads the .shp/.shx/.dbf files of an ESRI shapefile set straight into
+# numpy arrays. Used for the flight recorder exports where a QgsFeature per
+# GPS fix is too slow and uses too much memory.
+# Does not import qgis so it can be used from worker processes.
+
+import os
+import struct
+
+import numpy as np
+
+
+def _read_dbf_header_bytes(data):
+    """
+    Parses the fixed size dbf header and the field descriptors
+    :param data: bytes: start of the .dbf file, must include the whole header
+    :return: tuple(record_count, header_length, record_length, fields)
+        fields: list<(name, type, length, decimals)>
+    """
+    record_count, header_length, record_length = struct.unpack('<IHH', data[4:12])
+    fields = []
+    offset = 32
+    while offset + 32 <= header_length and data[offset:offset + 1] != b'\r':
+        descriptor = data[offset:offset + 32]
+        name = descriptor[:11].split(b'\x00')[0].decode('latin-1').strip()
+        field_type = descriptor[11:12].decode('latin-1').upper()
+        fields.append((name, field_type, descriptor[16], descriptor[17]))
+        offset += 32
+    return record_count, header_length, record_length, fields
+
+
+def _read_dbf_header_file(dbf_file):
+    """Reads just the header of an open .dbf file"""
+    data = dbf_file.read(32)
+    header_length = struct.unpack('<H', data[8:10])[0]
+    return _read_dbf_header_bytes(data + dbf_file.read(header_length - 32))
+
+
+def _dbf_path(shp_path):
+    return f"{os.path.splitext(shp_path)[0]}.dbf"
+
+
+def read_dbf_header(shp_path):
+    """
+    Reads only the fixed size header of the shapefile's .dbf, without
+    reading any records.
+    :param shp_path: str: path to the .shp (or .dbf) file
+    :return: tuple(record_count, header_length, record_length, fields)
+        fields: list<(name, type, length, decimals)>
+    """
+    with open(_dbf_path(shp_path), 'rb') as dbf_file:
+        return _read_dbf_header_file(dbf_file)
+
+
+def shapefile_record_count(shp_path):
+    """
+    Returns the record count from the .dbf header, 0 if the file is missing
+    or not a valid dbf.
+    :param shp_path: str
+    :return: int
+    """
+    try:
+        return read_dbf_header(shp_path)[0]
+    except (OSError, struct.error):
+        return 0
+
+
+def shapefile_field_names(shp_path):
+    """
+    Returns the field names from the .dbf header
+    :param shp_path: str
+    :return: list<str>
+    """
+    return [i[0] for i in read_dbf_header(shp_path)[3]]
+
+
+def _convert_dbf_column(raw, field_type, decimals):
+    """
+    Converts a column of fixed width dbf bytes into a typed array
+    Numeric fields are returned as float64, or int64 when they have no
+    decimals and no empty values (matching how OGR reads them).
+    Character and date fields are returned as stripped bytes.
+    :param raw: np.array<S>
+    :param field_type: str: dbf field type code
+    :param decimals: int
+    :return: np.array
+    """
+    values = np.char.strip(raw)
+    if field_type in ('N', 'F'):
+        empty = (values == b'') | (np.char.find(values, b'*') >= 0)
+        numbers = np.where(empty, b'nan', values).astype(np.float64)
+        if decimals == 0 and not empty.any():
+            return numbers.astype(np.int64)
+        return numbers
+    if field_type == 'L':
+        return np.isin(np.char.upper(values), [b'T', b'Y']).astype(np.int8)
+    return values
+
+
+def read_dbf_columns(shp_path, field_names=None):
+    """
+    Reads the attribute table of a shapefile into a dict of column arrays.
+    Deleted records are dropped.
+    :param shp_path: str: path to the .shp (or .dbf) file
+    :param field_names: list<str>: case insensitive names to read, None for all
+    :return: dict<lower case field name: np.array>
+    """
+    with open(_dbf_path(shp_path), 'rb') as dbf_file:
+        data = dbf_file.read()
+    record_count, header_length, record_length, fields = _read_dbf_header_bytes(data)
+    if field_names is not None:
+        field_names = [i.lower() for i in field_names]
+
+    dtype_fields = [('deleted', 'S1')]
+    conversions = {}
+    for i, (name, field_type, length, decimals) in enumerate(fields):
+        column = f"f{i}"
+        dtype_fields.append((column, f"S{length}"))
+        if field_names is None or name.lower() in field_names:
+            conversions[name.lower()] = (column, field_type, decimals)
+    dtype = np.dtype(dtype_fields)
+    if dtype.itemsize != record_length:
+        raise ValueError(f"{shp_path}: dbf record length {record_length} does not match field lengths")
+
+    # Truncated exports have fewer records than the header says
+    record_count = min(record_count, (len(data) - header_length) // record_length)
+    records = np.frombuffer(data, dtype=dtype, count=record_count, offset=header_length)
+    records = records[records['deleted'] != b'*']
+    return {name: _convert_dbf_column(records[column], field_type, decimals)
+            for name, (column, field_type, decimals) in conversions.items()}
+
+
+def read_shp_points(shp_path):
+    """
+    Reads the x and y coordinates of a Point/PointZ/PointM shapefile.
+    Uses the .shx index to find each record. Null shapes are returned as nan.
+    :param shp_path: str
+    :return: tuple(np.array<float64> x, np.array<float64> y)
+    """
+    with open(shp_path, 'rb') as shp_file:
+        data = np.frombuffer(shp_file.read(), dtype=np.uint8)
+    with open(f"{os.path.splitext(shp_path)[0]}.shx", 'rb') as shx_file:
+        index = np.frombuffer(shx_file.read(), dtype='>i4', offset=100).reshape(-1, 2)
+
+    # Offsets and lengths in the index are 16 bit words and exclude the 8 byte record header
+    offsets = index[:, 0].astype(np.int64) * 2 + 8
+    lengths = index[:, 1].astype(np.int64) * 2
+    valid = (lengths >= 20) & (offsets + 20 <= len(data))
+    offsets = np.where(valid, offsets, 0)
+
+    byte_range = np.arange(8)
+    x = data[(offsets + 4)[:, None] + byte_range].copy().view('<f8').ravel()
+    y = data[(offsets + 12)[:, None] + byte_range].copy().view('<f8').ravel()
+    x[~valid] = np.nan
+    y[~valid] = np.nan
+
+    keep = _dbf_active_records(shp_path, len(x))
+    return x[keep], y[keep]
+
+
+def read_shp_polylines(shp_path):
+    """
+    Reads the vertices of a PolyLine/PolyLineZ/PolyLineM shapefile.
+    Each record is returned as an (n, 2) array of x, y vertices and the
+    index of the first vertex of each part. Null shapes have no vertices.
+    :param shp_path: str
+    :return: list<tuple(np.array<float64> (n, 2), np.array<int64> part_starts)>
+    """
+    with open(shp_path, 'rb') as shp_file:
+        data = shp_file.read()
+
+    records = []
+    offset = 100
+    while offset + 12 <= len(data):
+        content_length = struct.unpack('>i', data[offset + 4:offset + 8])[0] * 2
+        content_start = offset + 8
+        shape_type = struct.unpack('<i', data[content_start:content_start + 4])[0]
+        if shape_type == 0:
+            records.append((np.empty((0, 2), dtype=np.float64), np.zeros(1, dtype=np.int64)))
+        else:
+            part_count, point_count = struct.unpack('<ii', data[content_start + 36:content_start + 44])
+            part_starts = np.frombuffer(data, dtype='<i4', count=part_count,
+                                        offset=content_start + 44).astype(np.int64)
+            vertices = np.frombuffer(data, dtype='<f8', count=point_count * 2,
+                                     offset=content_start + 44 + part_count * 4).reshape(-1, 2)
+            records.append((vertices, part_starts))
+        offset = content_start + content_length
+
+    keep = _dbf_active_records(shp_path, len(records))
+    return [record for record, active in zip(records, keep) if active]
+
+
+def _dbf_active_records(shp_path, record_count):
+    """
+    Deleted dbf records are dropped by read_dbf_columns, so the matching
+    shapes need to be dropped too.
+    :param shp_path: str
+    :param record_count: int: number of shapes read
+    :return: np.array<bool>
+    """
+    with open(_dbf_path(shp_path), 'rb') as dbf_file:
+        _, header_length, record_length, _ = _read_dbf_header_file(dbf_file)
+        flags = np.frombuffer(dbf_file.read(), dtype=np.uint8)[::record_length][:record_count]
+    keep = np.ones(record_count, dtype=bool)
+    keep[:len(flags)] = flags != ord('*')
+    return keep
@@ -0,0 +1,119 @@
+# Open Flightline Mini
+
+# Description:
+# Converts flight recorder time fields to and from epoch seconds in bulk.
+# Epoch seconds are the wall clock time since 1970-01-01, any utc offset is
+# dropped to match the date_time text stored in the gpkg.
+# Does not import qgis so it can be used from worker processes.
+
+from datetime import datetime
+
+import numpy as np
+
+
+# Epoch units, drone logs are kept to the millisecond
+UNIT_SCALES = {'s': 1, 'ms': 1000}
+
+# Positions of the digits and separators in 'YYYY-MM-DDTHH:MM:SS'
+ISO_DIGIT_POSITIONS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]
+ISO_SEPARATORS = {4: b'-', 7: b'-', 13: b':', 16: b':'}
+
+# Layouts tried for records that do not match the fixed ISO layout
+FALLBACK_FORMATS = ['%Y-%m-%dT%H:%M:%S%z', '%Y-%m-%dT%H:%M:%S.%f%z', '%Y-%m-%dT%H:%M:%S.%f',
+                    '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M:%S', '%d/%m/%Y %H:%M:%S',
+                    '%Y-%m-%dT%H:%M', '%Y%m%dT%H:%M:%S']
+
+
+def parse_timestamp(text, unit='s'):
+    """
+    Slow path for a single record that does not match the fixed ISO layout
+    :param text: str
+    :param unit: str: 's' or 'ms'
+    :return: int: epoch seconds (or milliseconds)
+    """
+    text = text.strip()
+    if text.endswith('Z'):
+        text = f"{text[:-1]}+00:00"
+    for date_format in FALLBACK_FORMATS:
+        try:
+            date_time = datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+        elapsed = date_time.replace(tzinfo=None) - datetime(1970, 1, 1)
+        if unit == 'ms':
+            return (elapsed.days * 86400 + elapsed.seconds) * 1000 + elapsed.microseconds // 1000
+        return elapsed.days * 86400 + elapsed.seconds
+    raise ValueError(f"Unrecognised timestamp: {text}")
+
+
+def parse_timestamps(values, unit='s'):
+    """
+    Parses a column of ISO 8601 timestamps ('2024-03-05T10:15:30+13:00',
+    '2024-03-05T10:15:30' or '2024-03-05 10:15:30') into epoch seconds.
+    Records in the fixed layout are converted in one array operation, any
+    odd records fall back to parse_timestamp.
+    :param values: np.array<S> or list<str>
+    :param unit: str: 's' or 'ms', fractions of a second are dropped for 's'
+    :return: np.array<int64>
+    """
+    values = np.char.strip(np.asarray(values, dtype=np.bytes_))
+    epochs = np.zeros(len(values), dtype=np.int64)
+    if not len(values):
+        return epochs
+
+    width = max(values.dtype.itemsize, 23)
+    chars = np.frombuffer(values.astype(f"S{width}").tobytes(), dtype=np.uint8).reshape(len(values), width)
+    digits = chars[:, ISO_DIGIT_POSITIONS]
+    fast = ((digits >= ord('0')) & (digits <= ord('9'))).all(axis=1)
+    for position, separator in ISO_SEPARATORS.items():
+        fast &= chars[:, position] == ord(separator)
+    fast &= np.isin(chars[:, 10], [ord('T'), ord(' ')])
+    # Anything after the seconds must be a fraction or utc offset, both are dropped
+    fast &= np.isin(chars[:, 19], [0, ord('.'), ord('+'), ord('-'), ord('Z')])
+
+    if fast.any():
+        wall_clock = chars[fast, :19].copy()
+        wall_clock[:, 10] = ord('T')
+        epochs[fast] = wall_clock.view('S19').ravel().astype('datetime64[s]').astype(np.int64)
+    if unit == 'ms':
+        epochs *= 1000
+        # Up to three digits after a '.', stopping at the first non digit
+        fraction = chars[:, 20:23].astype(np.int64) - ord('0')
+        is_digit = (fraction >= 0) & (fraction <= 9) & (chars[:, 19] == ord('.'))[:, None]
+        is_digit = np.logical_and.accumulate(is_digit, axis=1)
+        epochs[fast] += (np.where(is_digit, fraction, 0) * [100, 10, 1]).sum(axis=1)[fast]
+    for i in np.flatnonzero(~fast):
+        epochs[i] = parse_timestamp(values[i].decode('latin-1'), unit)
+    return epochs
+
+
+def combine_date_time(dates, times):
+    """
+    Joins separate date and time columns (Tabula and Tracmap points exports)
+    into ISO timestamps. Dates from a dbf date field are stored as YYYYMMDD.
+    :param dates: np.array<S>: '2024-03-05' or '20240305'
+    :param times: np.array<S>: '10:15:30'
+    :return: np.array<S>
+    """
+    dates = np.char.strip(np.asarray(dates, dtype=np.bytes_))
+    times = np.char.strip(np.asarray(times, dtype=np.bytes_))
+    if len(dates) and dates.dtype.itemsize == 8 and np.char.isdigit(dates).all():
+        chars = dates.view('S1').reshape(len(dates), 8)
+        dates = np.char.add(np.char.add(np.char.add(chars[:, :4].copy().view('S4').ravel(), b'-'),
+                                        np.char.add(chars[:, 4:6].copy().view('S2').ravel(), b'-')),
+                            chars[:, 6:].copy().view('S2').ravel())
+    return np.char.add(np.char.add(dates, b'T'), times)
+
+
+def format_timestamps(epochs, separator='T', unit='s'):
+    """
+    Formats epoch seconds as 'YYYY-MM-DDTHH:MM:SS' text in bulk
+    :param epochs: np.array<int64>
+    :param separator: str: between the date and the time
+    :param unit: str: 's' or 'ms', milliseconds are formatted as 'YYYY-MM-DDTHH:MM:SS.sss'
+    :return: list<str>
+    """
+    text = np.datetime_as_string(np.asarray(epochs, dtype=np.int64).astype(f"datetime64[{unit}]"), unit=unit)
+    if separator != 'T' and len(text):
+        text = np.char.replace(text, 'T', separator)
+    return text.tolist()
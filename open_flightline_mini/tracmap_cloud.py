@@ -0,0 +1,266 @@
+# Open Flightline Mini
+
+# Description:
+# Downloads flight data for a machine from the Tracmap cloud.
+# Uses an asyncio HTTP/1.1 client with a small pool of keep-alive connections
+# so the pages of each job are fetched concurrently over a few connections,
+# each page is decoded and handed on as soon as it arrives.
+# Only the python standard library is used as the QGIS python does not ship
+# with an async http package.
+# Does not import qgis so it can be used from worker processes.
+#
+# API used:
+#   GET <url>/machines/<machine_code>/jobs?updated_since=<iso timestamp>
+#       {"jobs": [{"id": "...", "updated": "2024-03-05T10:15:30", "point_pages": 3}, ...]}
+#   GET <url>/jobs/<job_id>/points?page=<n>
+#       {"columns": {"time": [...], "lon": [...], "lat": [...], "speed": [...], "heading": [...],
+#                    "altitude": [...], "width": [...], "boom_state": [...]}}
+
+import asyncio
+import json
+import ssl
+from urllib.parse import quote, urlencode, urlsplit
+
+import numpy as np
+
+from open_flightline_mini import flight_points, timestamp_codec
+
+
+# Number of keep-alive connections, also the number of pages fetched at once
+CLOUD_CONNECTIONS = 4
+# Seconds to wait for a single request
+CLOUD_TIMEOUT = 60
+
+POINT_COLUMNS = ['time', 'lon', 'lat', 'speed', 'heading', 'altitude', 'width', 'boom_state']
+
+
+class HttpConnectionPool:
+    """
+    Minimal asyncio HTTP/1.1 client for JSON GET requests.
+    Idle connections are kept open and reused, at most size requests are
+    in flight at once. Use as an async context manager.
+    """
+
+    def __init__(self, base_url, size=CLOUD_CONNECTIONS, headers=None, timeout=CLOUD_TIMEOUT):
+        url = urlsplit(base_url)
+        self.use_ssl = url.scheme == 'https'
+        self.host = url.hostname
+        self.port = url.port or (443 if self.use_ssl else 80)
+        self.base_path = url.path.rstrip('/')
+        self.size = size
+        self.headers = headers or {}
+        self.timeout = timeout
+        self._idle = []
+        self._slots = None
+
+    async def __aenter__(self):
+        self._slots = asyncio.Semaphore(self.size)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        while self._idle:
+            reader, writer = self._idle.pop()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def _acquire(self):
+        """
+        :return: tuple(reader, writer, reused)
+        """
+        if self._idle:
+            reader, writer = self._idle.pop()
+            return reader, writer, True
+        ssl_context = ssl.create_default_context() if self.use_ssl else None
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=ssl_context)
+        return reader, writer, False
+
+    async def _request(self, reader, writer, target):
+        """
+        Sends a GET request and reads the whole response
+        :return: tuple(status, headers, body, keep_alive)
+        """
+        request_lines = [f"GET {target} HTTP/1.1",
+                         f"Host: {self.host}:{self.port}",
+                         "Accept: application/json",
+                         "Accept-Encoding: identity",
+                         "Connection: keep-alive"]
+        request_lines += [f"{k}: {v}" for k, v in self.headers.items()]
+        writer.write(("\r\n".join(request_lines) + "\r\n\r\n").encode('latin-1'))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by the server")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        keep_alive = headers.get('connection', '').lower() != 'close'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                chunk_size = int((await reader.readline()).split(b';')[0], 16)
+                if chunk_size == 0:
+                    await reader.readline()
+                    break
+                body += await reader.readexactly(chunk_size)
+                await reader.readline()
+            body = bytes(body)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return status, headers, body, keep_alive
+
+    async def get_json(self, path, params=None):
+        """
+        :param path: str: path under the base url
+        :param params: dict: query parameters
+        :return: decoded json
+        """
+        target = f"{self.base_path}{path}"
+        if params:
+            target = f"{target}?{urlencode(params)}"
+        async with self._slots:
+            for attempt in range(2):
+                reader, writer, reused = await self._acquire()
+                try:
+                    status, headers, body, keep_alive = await asyncio.wait_for(
+                        self._request(reader, writer, target), self.timeout)
+                except (ConnectionError, asyncio.IncompleteReadError) as e:
+                    writer.close()
+                    # The server may have closed an idle connection, retry once on a new one
+                    if reused and attempt == 0:
+                        continue
+                    if isinstance(e, asyncio.IncompleteReadError):
+                        raise ConnectionError(f"Tracmap cloud request {target} was cut off after "
+                                              f"{len(e.partial)} bytes") from e
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                if keep_alive:
+                    self._idle.append((reader, writer))
+                else:
+                    writer.close()
+                if status != 200:
+                    raise ConnectionError(f"Tracmap cloud request {target} failed with HTTP {status}")
+                return json.loads(body)
+
+
+def decode_points_page(page):
+    """
+    Decodes a page of points into staging points. x and y are left for the
+    data batch to transform.
+    :param page: dict: decoded json page
+    :return: np.array<flight_points.STAGING_POINT_DTYPE>
+    """
+    columns = page.get('columns', {})
+    times = columns.get('time', [])
+    points = flight_points.empty_points(len(times))
+    if not len(points):
+        return points
+    points['epoch'] = timestamp_codec.parse_timestamps([i.encode() for i in times], unit='ms')
+    for source_name, field_name in [('lon', 'lon'), ('lat', 'lat'), ('speed', 'speed'), ('heading', 'heading'),
+                                    ('altitude', 'altitude'), ('width', 'width')]:
+        # json null becomes nan
+        points[field_name] = np.array(columns.get(source_name, [None] * len(points)), dtype=np.float64)
+    boom_states = np.array(columns.get('boom_state', [0] * len(points)), dtype=np.float64)
+    points['bucket_state'] = (np.nan_to_num(boom_states) > 0).astype(np.int8)
+    return points
+
+
+class TracmapCloudClient:
+    """
+    Fetches the jobs of a machine that have been updated since the last sync
+    """
+
+    def __init__(self, url, api_key=None, connections=CLOUD_CONNECTIONS):
+        self.url = url
+        self.api_key = api_key
+        self.connections = connections
+        # Newest job updated time, set once every page of the jobs has been read
+        self.last_sync = None
+
+    @property
+    def headers(self):
+        if not self.api_key:
+            return {}
+        return {'Authorization': f"Bearer {self.api_key}"}
+
+    async def iter_machine_pages(self, machine_code, last_sync=None):
+        """
+        Async generator, all the pages of the updated jobs are requested at
+        once over the pool and each page is decoded and yielded as soon as it
+        arrives, in the order they complete.
+        :param machine_code: str
+        :param last_sync: str: iso timestamp of the last job already downloaded
+        :return: yields np.array<flight_points.STAGING_POINT_DTYPE>
+        """
+        self.last_sync = None
+        async with HttpConnectionPool(self.url, self.connections, self.headers) as pool:
+            params = {'updated_since': last_sync} if last_sync else None
+            jobs = (await pool.get_json(f"/machines/{quote(machine_code)}/jobs", params)).get('jobs', [])
+            requests = [asyncio.ensure_future(pool.get_json(f"/jobs/{quote(str(job['id']))}/points", {'page': page}))
+                        for job in jobs for page in range(1, int(job.get('point_pages', 1)) + 1)]
+            try:
+                for request in asyncio.as_completed(requests):
+                    yield decode_points_page(await request)
+            finally:
+                for request in requests:
+                    request.cancel()
+                await asyncio.gather(*requests, return_exceptions=True)
+
+        self.last_sync = last_sync
+        if jobs:
+            newest = max(jobs, key=lambda job: timestamp_codec.parse_timestamp(job['updated']))
+            self.last_sync = newest['updated']
+
+    def iter_machine_points(self, machine_code, last_sync=None):
+        """
+        Generator for code outside an event loop, yields the decoded pages of
+        iter_machine_pages. The requests only run while the next page is
+        being waited on. self.last_sync is only set once every page has been
+        yielded, so a failed or abandoned download does not move the sync on.
+        :param machine_code: str
+        :param last_sync: str: iso timestamp of the last job already downloaded
+        :return: yields np.array<flight_points.STAGING_POINT_DTYPE>
+        """
+        loop = asyncio.new_event_loop()
+        pages = self.iter_machine_pages(machine_code, last_sync)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(pages.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(pages.aclose())
+            loop.close()
+
+
+def download_machine_points(url, api_key, machine_code, last_sync=None, connections=CLOUD_CONNECTIONS):
+    """
+    Downloads all the points for a machine from the Tracmap cloud
+    :param url: str: 'https://.../api/v1'
+    :param api_key: str
+    :param machine_code: str
+    :param last_sync: str: iso timestamp returned by the last download, None for everything
+    :param connections: int: pooled connections / pages fetched at once
+    :return: tuple(np.array<flight_points.STAGING_POINT_DTYPE>, str: new last sync)
+    """
+    client = TracmapCloudClient(url, api_key, connections)
+    points = flight_points.concatenate_points(list(client.iter_machine_points(machine_code, last_sync)))
+    return points, client.last_sync
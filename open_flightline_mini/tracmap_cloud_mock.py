@@ -0,0 +1,159 @@
+# Open Flightline Mini
+
+# Description:
+# Local stand in for the Tracmap cloud so the cloud download can be run and
+# tested without a network connection. Serves made up baiting jobs for each
+# machine using the same API as tracmap_cloud.
+# Run from the command line:
+#   python -m open_flightline_mini.tracmap_cloud_mock --port 8765 --machines PBX PBY
+# Then use http://127.0.0.1:8765/api/v1 as the Tracmap cloud url.
+
+import argparse
+import json
+import math
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+
+API_PATH = '/api/v1'
+
+
+def generate_job(machine_code, job_number, start, points_per_page=1000, pages=2):
+    """
+    Creates a job of points flying back and forth across a block
+    :param machine_code: str
+    :param job_number: int
+    :param start: datetime: time of the first point
+    :param points_per_page: int
+    :param pages: int
+    :return: dict: {'id', 'machine_code', 'updated', 'pages': list<dict<column: list>>}
+    """
+    point_count = points_per_page * pages
+    columns = {i: [] for i in ['time', 'lon', 'lat', 'speed', 'heading', 'altitude', 'width', 'boom_state']}
+    for i in range(point_count):
+        row, step = divmod(i, 200)
+        forward = row % 2 == 0
+        columns['time'].append((start + timedelta(seconds=i)).strftime('%Y-%m-%dT%H:%M:%S+13:00'))
+        columns['lon'].append(172.5 + job_number * 0.01 + (step if forward else 199 - step) * 0.0002)
+        columns['lat'].append(-43.5 - row * 0.0008)
+        columns['speed'].append(round(30 + 5 * math.sin(i / 50), 2))
+        columns['heading'].append(90.0 if forward else 270.0)
+        columns['altitude'].append(150.0)
+        columns['width'].append(60.0)
+        columns['boom_state'].append(1 if 10 <= step < 190 else 0)
+
+    return {'id': f"{machine_code}-{job_number}",
+            'machine_code': machine_code,
+            'updated': (start + timedelta(seconds=point_count)).strftime('%Y-%m-%dT%H:%M:%S'),
+            'pages': [{'columns': {k: v[page * points_per_page:(page + 1) * points_per_page]
+                                   for k, v in columns.items()}}
+                      for page in range(pages)]}
+
+
+class MockTracmapCloud:
+    """Jobs served by the mock server, keyed by job id"""
+
+    def __init__(self, machine_codes=('PBX',), jobs_per_machine=3, points_per_page=1000, pages=2,
+                 start=datetime(2024, 3, 5, 8, 0, 0)):
+        self.jobs = {}
+        for machine_code in machine_codes:
+            for job_number in range(jobs_per_machine):
+                job_start = start + timedelta(hours=job_number)
+                job = generate_job(machine_code, job_number, job_start, points_per_page, pages)
+                self.jobs[job['id']] = job
+        # Pages that fail, dict<(job id, page): HTTP status, or 'truncated' to drop the
+        # connection part way through the response>
+        self.failures = {}
+
+    def add_job(self, job):
+        self.jobs[job['id']] = job
+
+    def list_jobs(self, machine_code, updated_since=None):
+        jobs = [i for i in self.jobs.values() if i['machine_code'] == machine_code]
+        if updated_since:
+            jobs = [i for i in jobs if i['updated'] > updated_since[:19]]
+        return {'jobs': [{'id': i['id'], 'updated': i['updated'], 'point_pages': len(i['pages'])}
+                         for i in sorted(jobs, key=lambda job: job['updated'])]}
+
+    def job_points(self, job_id, page):
+        job = self.jobs.get(job_id)
+        if not job or not 1 <= page <= len(job['pages']):
+            return None
+        return job['pages'][page - 1]
+
+
+class MockTracmapCloudHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        return
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_truncated_json(self, content):
+        """Sends the headers and half the body then drops the connection"""
+        body = json.dumps(content).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body[:len(body) // 2])
+        self.close_connection = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        parts = [unquote(i) for i in url.path[len(API_PATH):].strip('/').split('/')] \
+            if url.path.startswith(API_PATH) else []
+        cloud = self.server.cloud
+
+        if len(parts) == 3 and parts[0] == 'machines' and parts[2] == 'jobs':
+            return self.send_json(200, cloud.list_jobs(parts[1], params.get('updated_since', [None])[0]))
+        if len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'points':
+            page_number = int(params.get('page', ['1'])[0])
+            page = cloud.job_points(parts[1], page_number)
+            failure = cloud.failures.get((parts[1], page_number))
+            if page is not None and failure == 'truncated':
+                return self.send_truncated_json(page)
+            if page is not None and failure:
+                return self.send_json(failure, {'error': 'Failure set on the mock'})
+            if page is not None:
+                return self.send_json(200, page)
+        return self.send_json(404, {'error': 'Not found'})
+
+
+def start_mock_server(cloud=None, host='127.0.0.1', port=0):
+    """
+    Starts the mock server on a background thread
+    :param cloud: MockTracmapCloud
+    :param host: str
+    :param port: int: 0 picks a free port
+    :return: tuple(ThreadingHTTPServer, str: api url), call server.shutdown() to stop
+    """
+    server = ThreadingHTTPServer((host, port), MockTracmapCloudHandler)
+    server.daemon_threads = True
+    server.cloud = cloud or MockTracmapCloud()
+    threading.Thread(target=server.serve_forever, name='mock_tracmap_cloud', daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}{API_PATH}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand in for the Tracmap cloud')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--machines', nargs='+', default=['PBX'])
+    parser.add_argument('--jobs', type=int, default=3)
+    args = parser.parse_args()
+
+    mock_server = ThreadingHTTPServer((args.host, args.port), MockTracmapCloudHandler)
+    mock_server.cloud = MockTracmapCloud(args.machines, args.jobs)
+    print(f"Mock Tracmap cloud running at http://{args.host}:{args.port}{API_PATH}")
+    mock_server.serve_forever()
@@ -0,0 +1,355 @@
+# Open Flightline Mini
+
+# Description:
+# Headless watcher that imports Tracmap USB exports as the sticks are plugged
+# in, without opening the "4. Copy Tracmap Data USB" dialog.
+# Uses inotify on Linux to see new mounts under the mount points, other
+# platforms fall back to polling. The machine is matched from the folder
+# names the same way as match_heli_rego_from_folder_names. Each stick waits
+# until the mount has been quiet for a few seconds, then the imports run one
+# at a time through qgis_process so only one import writes to the gpkg.
+# qgis_process is given the project file as the tools read the project
+# folder from the open QGIS project.
+# Run from the command line:
+#   python -m open_flightline_mini.usb_watcher --project-folder /path/to/project [--project-file project.qgz]
+#       [--full-copy]
+
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import queue
+import select
+import struct
+import subprocess
+import sys
+import threading
+import time
+from contextlib import closing
+
+from open_flightline_mini import data_reader, gpkg_sqlite
+
+
+# Where removable drives are mounted
+DEFAULT_MOUNT_POINTS = ['/media', '/run/media', '/mnt']
+
+# Seconds a new mount has to be quiet before it is scanned
+DEBOUNCE_SECONDS = 5.0
+
+# Seconds between scans when inotify is not available
+POLL_SECONDS = 5.0
+
+# Depth of folders under a mount point that are watched, e.g. /media/<user>/<stick>
+WATCH_DEPTH = 2
+
+# Name of the processing tool run for each stick
+COPY_TRACMAP_ALGORITHM = 'script:copy_tracmap_data_usb'
+
+# RESULTS values of the copy tool for an import that ran, anything else is a failure
+COPY_TRACMAP_RESULTS = ['Finished', 'No new jobs', 'No Folders with data']
+
+# QGIS project file extensions
+QGIS_PROJECT_EXTENSIONS = ('.qgz', '.qgs')
+
+# inotify event masks
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_MOVED_TO = 0x00000080
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+INOTIFY_EVENT_HEADER = struct.Struct('iIII')
+
+
+def read_project_settings(project_folder):
+    """
+    Reads the project_config.json without starting QGIS
+    :param project_folder: str
+    :return: dict
+    """
+    with open(os.path.join(project_folder, 'project_config.json'), 'r') as config_file:
+        return json.load(config_file)
+
+
+def find_project_file(project_folder):
+    """
+    :param project_folder: str
+    :return: str: the QGIS project file in the project folder
+    """
+    project_files = sorted([i for i in os.listdir(project_folder) if i.lower().endswith(QGIS_PROJECT_EXTENSIONS)])
+    if len(project_files) != 1:
+        raise FileNotFoundError(f"Expected one QGIS project file in {project_folder}, found {project_files}, "
+                                f"pass it with --project-file")
+    return os.path.join(project_folder, project_files[0])
+
+
+def project_machine_codes(project_gpkg):
+    """
+    :param project_gpkg: str
+    :return: list<str>: machine codes from the heli_info table, upper case
+    """
+    with closing(gpkg_sqlite.connect(project_gpkg)) as connection:
+        return sorted(set([i[0].upper() for i in connection.execute("SELECT machine_code FROM heli_info")
+                           if i[0]]))
+
+
+class Inotify:
+    """Minimal ctypes wrapper around the linux inotify api"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches = {}
+
+    def add_watch(self, path, mask=IN_CREATE | IN_MOVED_TO | IN_DELETE):
+        if path in self.watches.values():
+            return
+        watch = self._add_watch(self.fd, os.fsencode(path), mask)
+        if watch >= 0:
+            self.watches[watch] = path
+
+    def read_events(self, timeout):
+        """
+        :param timeout: float: seconds to wait for events
+        :return: list<tuple(path, mask)>
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + INOTIFY_EVENT_HEADER.size <= len(data):
+            watch, mask, cookie, name_length = INOTIFY_EVENT_HEADER.unpack_from(data, offset)
+            offset += INOTIFY_EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b'\x00').decode(errors='replace')
+            offset += name_length
+            if watch in self.watches:
+                events.append((os.path.join(self.watches[watch], name), mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class UsbImportWatcher:
+    """
+    Watches the mount points and queues an import for each new Tracmap export
+    """
+
+    def __init__(self, project_folder, mount_points=None, run_import=None, debounce_seconds=DEBOUNCE_SECONDS,
+                 log=print, project_file=None, incremental=True):
+        """
+        :param project_folder: str
+        :param mount_points: list<str>
+        :param run_import: function(data_source, machine_code): runs a single import,
+            defaults to running the copy tool with qgis_process
+        :param debounce_seconds: float
+        :param log: function(str)
+        :param project_file: str: QGIS project opened by qgis_process, defaults to
+            the one in the project folder
+        :param incremental: bool: only copy the jobs not already in the raw data
+            folder, False copies every job on the stick
+        """
+        self.project_folder = project_folder
+        self.project_file = project_file
+        self.incremental = incremental
+        self.mount_points = [i for i in (mount_points or DEFAULT_MOUNT_POINTS) if os.path.isdir(i)]
+        self.run_import = run_import or self.run_qgis_process_import
+        self.debounce_seconds = debounce_seconds
+        self.log = log
+        self.imports = queue.Queue()
+        self.queued = set()
+        self.pending = {}
+        self.known_sources = set()
+        self.stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def candidate_sources(self):
+        """
+        :return: set<str>: folders WATCH_DEPTH below the mount points, e.g. /media/<user>/<stick>
+        """
+        sources = set()
+        for mount_point in self.mount_points:
+            level = [mount_point]
+            for depth in range(WATCH_DEPTH):
+                level = [os.path.join(i, j) for i in level if os.path.isdir(i)
+                         for j in sorted(os.listdir(i)) if os.path.isdir(os.path.join(i, j))]
+                sources.update(level)
+        return sources
+
+    def source_for_path(self, path):
+        """Returns the folder under a mount point that a changed path belongs to"""
+        for mount_point in self.mount_points:
+            relative_path = os.path.relpath(path, mount_point)
+            if relative_path.startswith('..'):
+                continue
+            parts = relative_path.split(os.sep)
+            if len(parts) >= WATCH_DEPTH:
+                return os.path.join(mount_point, *parts[:WATCH_DEPTH])
+        return None
+
+    def notice(self, data_source):
+        """Restarts the debounce timer of a data source"""
+        with self._lock:
+            self.pending[data_source] = time.monotonic()
+
+    def queue_settled_sources(self):
+        """Queues the data sources that have been quiet for debounce_seconds"""
+        now = time.monotonic()
+        with self._lock:
+            settled = [k for k, v in self.pending.items() if now - v >= self.debounce_seconds]
+            for data_source in settled:
+                del self.pending[data_source]
+        for data_source in settled:
+            self.queue_import(data_source)
+
+    def queue_import(self, data_source):
+        """
+        Queues an import if the data source is a Tracmap export for one of the project machines
+        :param data_source: str
+        :return: bool: queued
+        """
+        if not os.path.isdir(data_source) or data_source in self.queued:
+            return False
+        manifest = data_reader.get_data_source_manifest(data_source, refresh=True)
+        if not manifest.log_file_count:
+            return False
+        settings = read_project_settings(self.project_folder)
+        machine_code = manifest.match_machine_code(project_machine_codes(settings['project_gpkg']))
+        if machine_code == 'UNK':
+            self.log(f"{data_source}: No machine code in the folder names, use the Copy Tracmap Data USB tool")
+            return False
+        self.log(f"{data_source}: Queued import for {machine_code}")
+        self.queued.add(data_source)
+        self.imports.put((data_source, machine_code))
+        return True
+
+    def run_qgis_process_import(self, data_source, machine_code):
+        """
+        Runs the copy tool headless. When incremental a stick that has
+        already been imported only copies its new jobs. The tool returns
+        without doing anything when no project is open, so an empty result
+        is a failure.
+        :return: str: the RESULTS of the tool
+        """
+        settings = read_project_settings(self.project_folder)
+        project_file = self.project_file or find_project_file(self.project_folder)
+        command = ['qgis_process', '--json', 'run', COPY_TRACMAP_ALGORITHM,
+                   f"--PROJECT_PATH={project_file}", '--',
+                   f"PROJECT_FOLDER={self.project_folder}",
+                   f"PROJECT_GPKG={settings['project_gpkg']}",
+                   f"TRACMAP_DATA_SOURCE={data_source}",
+                   f"MACHINE_CODE={machine_code}",
+                   f"DAY_NUMBER={settings.get('op_day') or 1}",
+                   f"DOWNLOAD_TIME={data_reader.current_download_time()}",
+                   f"INCREMENTAL={'true' if self.incremental else 'false'}"]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode:
+            raise RuntimeError(result.stderr or result.stdout)
+        try:
+            tool_result = (json.loads(result.stdout).get('results') or {}).get('RESULTS')
+        except (ValueError, AttributeError):
+            tool_result = None
+        if tool_result not in COPY_TRACMAP_RESULTS:
+            raise RuntimeError(f"{COPY_TRACMAP_ALGORITHM} returned {tool_result!r} with project {project_file}: "
+                               f"{result.stderr or result.stdout}")
+        return tool_result
+
+    def import_worker(self):
+        """Runs the queued imports one at a time"""
+        while not self.stopped.is_set():
+            try:
+                data_source, machine_code = self.imports.get(timeout=1)
+            except queue.Empty:
+                continue
+            self.log(f"{data_source}: Importing {machine_code}")
+            try:
+                tool_result = self.run_import(data_source, machine_code)
+                self.log(f"{data_source}: Import finished: {tool_result}")
+            except Exception as e:
+                self.log(f"{data_source}: Import failed: {e}")
+            finally:
+                self.queued.discard(data_source)
+                self.imports.task_done()
+
+    def add_inotify_watches(self, inotify):
+        """Watches the mount points and each folder level down to the stick folders"""
+        for mount_point in self.mount_points:
+            inotify.add_watch(mount_point)
+        for data_source in self.candidate_sources():
+            inotify.add_watch(os.path.dirname(data_source))
+            inotify.add_watch(data_source)
+
+    def watch_inotify(self):
+        inotify = Inotify()
+        try:
+            self.add_inotify_watches(inotify)
+            while not self.stopped.is_set():
+                for path, mask in inotify.read_events(timeout=1.0):
+                    data_source = self.source_for_path(path)
+                    if mask & IN_DELETE:
+                        with self._lock:
+                            self.pending.pop(data_source, None)
+                        continue
+                    if data_source:
+                        self.notice(data_source)
+                    if mask & IN_ISDIR:
+                        self.add_inotify_watches(inotify)
+                self.queue_settled_sources()
+        finally:
+            inotify.close()
+
+    def notice_new_sources(self):
+        sources = self.candidate_sources()
+        for data_source in sources - self.known_sources:
+            self.notice(data_source)
+        self.known_sources = sources
+
+    def watch_polling(self):
+        while not self.stopped.is_set():
+            self.notice_new_sources()
+            self.queue_settled_sources()
+            self.stopped.wait(POLL_SECONDS)
+
+    def run(self):
+        """Watches until stop() is called"""
+        # Sticks already plugged in when the watcher starts are not imported
+        self.known_sources = self.candidate_sources()
+        worker = threading.Thread(target=self.import_worker, name='usb_import_worker', daemon=True)
+        worker.start()
+        self.log(f"Watching {self.mount_points} for Tracmap exports")
+        if sys.platform.startswith('linux'):
+            self.watch_inotify()
+        else:
+            self.watch_polling()
+        worker.join()
+
+    def stop(self):
+        self.stopped.set()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Imports Tracmap USB exports as the sticks are plugged in')
+    parser.add_argument('--project-folder', required=True)
+    parser.add_argument('--project-file', help='QGIS project, defaults to the .qgz or .qgs in the project folder')
+    parser.add_argument('--mount-points', nargs='+', default=DEFAULT_MOUNT_POINTS)
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE_SECONDS)
+    parser.add_argument('--full-copy', action='store_true',
+                        help='Copy every job on the stick, not only the jobs not already imported')
+    args = parser.parse_args()
+
+    watcher = UsbImportWatcher(args.project_folder, args.mount_points, debounce_seconds=args.debounce,
+                               project_file=args.project_file or find_project_file(args.project_folder),
+                               incremental=not args.full_copy)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        watcher.stop()
@@ -0,0 +1,153 @@
+# Open Flightline Mini
+
+# Description:
+# Shared fixtures for the checks of the modules that do not import qgis.
+# The gpkg fixture is a minimal geopackage with a heli_points layer and the
+# rtree and feature count triggers GDAL puts on a layer, point_layer_sql adds
+# more layers with the same triggers. write_shapefile writes a small
+# shapefile set like the flight recorder exports.
+
+import struct
+
+import pytest
+
+from open_flightline_mini import gpkg_sqlite
+
+
+SRS_ID = 2193
+
+HELI_POINTS_SQL = """CREATE TABLE heli_points (fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, geom POINT,
+                         src_id TEXT, date_time DATETIME, speed REAL, heading REAL, altitude REAL, width REAL,
+                         machine_code TEXT, bucket_size INTEGER, load_number INTEGER, batch_id TEXT,
+                         bucket_state INTEGER)"""
+
+DRONE_POINTS_COLUMNS_SQL = """fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, geom POINT, id INTEGER, src_id INTEGER,
+                              date_time DATETIME, speed REAL, heading REAL, altitude REAL, width REAL, machine TEXT,
+                              batch_id TEXT, bucket_state INTEGER, bucket_shutoff INTEGER, hdop INTEGER, vbat REAL"""
+
+
+def point_layer_sql(table_name, create_sql):
+    """
+    The gpkg metadata, rtree index and triggers GDAL creates with a point layer
+    :param table_name: str
+    :param create_sql: str: CREATE TABLE statement with a geom column
+    :return: str
+    """
+    return f"""
+{create_sql};
+INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) VALUES ('{table_name}', 'features',
+                                                                              '{table_name}', {SRS_ID});
+INSERT INTO gpkg_geometry_columns VALUES ('{table_name}', 'geom', 'POINT', {SRS_ID}, 0, 0);
+INSERT INTO gpkg_ogr_contents VALUES ('{table_name}', 0);
+CREATE VIRTUAL TABLE rtree_{table_name}_geom USING rtree(id, minx, maxx, miny, maxy);
+CREATE TRIGGER trigger_insert_feature_count_{table_name} AFTER INSERT ON {table_name} BEGIN
+    UPDATE gpkg_ogr_contents SET feature_count = feature_count + 1 WHERE lower(table_name) = lower('{table_name}');
+END;
+CREATE TRIGGER trigger_delete_feature_count_{table_name} AFTER DELETE ON {table_name} BEGIN
+    UPDATE gpkg_ogr_contents SET feature_count = feature_count - 1 WHERE lower(table_name) = lower('{table_name}');
+END;
+CREATE TRIGGER rtree_{table_name}_geom_insert AFTER INSERT ON {table_name}
+WHEN (new.geom NOT NULL AND NOT ST_IsEmpty(NEW.geom)) BEGIN
+    INSERT OR REPLACE INTO rtree_{table_name}_geom VALUES (NEW.fid, ST_MinX(NEW.geom), ST_MaxX(NEW.geom),
+                                                          ST_MinY(NEW.geom), ST_MaxY(NEW.geom));
+END;
+CREATE TRIGGER rtree_{table_name}_geom_delete AFTER DELETE ON {table_name} WHEN old.geom NOT NULL BEGIN
+    DELETE FROM rtree_{table_name}_geom WHERE id = OLD.fid;
+END;
+"""
+
+
+GPKG_SQL = f"""
+PRAGMA application_id = 1196444487;
+CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT, srs_id INTEGER PRIMARY KEY, organization TEXT,
+                                   organization_coordsys_id INTEGER, definition TEXT, description TEXT);
+CREATE TABLE gpkg_contents (table_name TEXT PRIMARY KEY, data_type TEXT, identifier TEXT, description TEXT,
+                            last_change DATETIME, min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE,
+                            srs_id INTEGER);
+CREATE TABLE gpkg_geometry_columns (table_name TEXT, column_name TEXT, geometry_type_name TEXT, srs_id INTEGER,
+                                    z TINYINT, m TINYINT);
+CREATE TABLE gpkg_ogr_contents (table_name TEXT PRIMARY KEY, feature_count INTEGER);
+INSERT INTO gpkg_spatial_ref_sys VALUES ('NZGD2000 / New Zealand Transverse Mercator 2000', {SRS_ID}, 'EPSG',
+                                         {SRS_ID}, '', '');
+{point_layer_sql('heli_points', HELI_POINTS_SQL)}"""
+
+
+def create_gpkg(path, layers_sql=''):
+    """
+    :param path: str
+    :param layers_sql: str: more layers, see point_layer_sql
+    :return: str: path
+    """
+    connection = gpkg_sqlite.connect(path)
+    connection.executescript(GPKG_SQL + layers_sql)
+    connection.close()
+    return path
+
+
+@pytest.fixture
+def gpkg_path(tmp_path):
+    return create_gpkg(str(tmp_path / 'project.gpkg'))
+
+
+@pytest.fixture
+def gpkg_connection(gpkg_path):
+    connection = gpkg_sqlite.connect(gpkg_path)
+    yield connection
+    connection.close()
+
+
+def write_dbf(dbf_path, fields, records):
+    """
+    :param dbf_path: str
+    :param fields: list<(name, type, length, decimals)>
+    :param records: list<tuple>: one value for each field
+    """
+    header_length = 32 + 32 * len(fields) + 1
+    record_length = 1 + sum([i[2] for i in fields])
+    header = struct.pack('<BBBBIHH20x', 3, 124, 1, 1, len(records), header_length, record_length)
+    descriptors = b''.join([struct.pack('<11sc4xBB14x', name.encode(), field_type.encode(), length, decimals)
+                            for name, field_type, length, decimals in fields])
+    body = b''.join([b' ' + b''.join([str(value).encode('latin-1')[:field[2]].ljust(field[2])
+                                      for value, field in zip(record, fields)])
+                     for record in records])
+    with open(dbf_path, 'wb') as dbf_file:
+        dbf_file.write(header + descriptors + b'\r' + body + b'\x1a')
+
+
+def write_shapefile(shp_path, shapes, fields, records):
+    """
+    Writes a Point shapefile when the shapes are (x, y) tuples, or a PolyLine
+    shapefile when each shape is a list of parts of (x, y) vertices.
+    :param shp_path: str
+    :param shapes: list
+    :param fields: list<(name, type, length, decimals)>
+    :param records: list<tuple>
+    """
+    polyline = bool(shapes) and isinstance(shapes[0][0], (list, tuple))
+    contents = []
+    for shape in shapes:
+        if not polyline:
+            contents.append(struct.pack('<i2d', 1, *shape))
+            continue
+        vertices = [vertex for part in shape for vertex in part]
+        part_starts = [sum([len(i) for i in shape[:n]]) for n in range(len(shape))]
+        xs, ys = [i[0] for i in vertices], [i[1] for i in vertices]
+        contents.append(struct.pack('<i4d2i', 3, min(xs), min(ys), max(xs), max(ys), len(shape), len(vertices))
+                        + struct.pack(f'<{len(shape)}i', *part_starts)
+                        + struct.pack(f'<{len(vertices) * 2}d', *[c for vertex in vertices for c in vertex]))
+
+    def header(file_length):
+        return struct.pack('>7i', 9994, 0, 0, 0, 0, 0, file_length // 2) + struct.pack('<2i', 1000, 3 if polyline else 1) \
+            + struct.pack('<8d', *[0.0] * 8)
+
+    shp_records, shx_records, offset = [], [], 100
+    for number, content in enumerate(contents, 1):
+        shp_records.append(struct.pack('>2i', number, len(content) // 2) + content)
+        shx_records.append(struct.pack('>2i', offset // 2, len(content) // 2))
+        offset += 8 + len(content)
+    base_path = shp_path[:-4]
+    with open(shp_path, 'wb') as shp_file:
+        shp_file.write(header(offset) + b''.join(shp_records))
+    with open(f"{base_path}.shx", 'wb') as shx_file:
+        shx_file.write(header(100 + 8 * len(contents)) + b''.join(shx_records))
+    write_dbf(f"{base_path}.dbf", fields, records)
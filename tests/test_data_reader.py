@@ -0,0 +1,356 @@
+# Open Flightline Mini
+
+# Description:
+# Checks the Tracmap and Tabula export readers against small shapefile sets.
+
+import os
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+pytest.importorskip('osgeo')
+
+from open_flightline_mini import data_reader, tracmap_cloud_mock
+
+from conftest import write_shapefile
+
+
+POINTS_FIELDS = [('Date', 'D', 8, 0), ('Time', 'C', 12, 0), ('Speed', 'N', 8, 2), ('Heading', 'N', 6, 1),
+                 ('GPS Alt', 'N', 8, 1), ('Width', 'N', 6, 1), ('Boom State', 'C', 3, 0)]
+
+
+def read_folder(src_type, dir_path):
+    data_batch = data_reader.TracmapDataBatch([dir_path], src_type, 'EPSG:2193', 'EPSG:2193', 'pbx', 'PBX_1_1000')
+    data_batch.__read_features__()
+    return data_batch.layers[f"{os.path.basename(dir_path)}_secondary"]
+
+
+def test_points_export_keeps_every_10hz_fix(tmp_path):
+    job = tmp_path / 'JOB1'
+    job.mkdir()
+    # Written out of order with the same speed in every fix of the second
+    tenths = [3, 0, 9, 1, 2, 4, 5, 6, 7, 8]
+    write_shapefile(str(job / 'secondary.shp'), [(1570000.0 + i, 5180000.0) for i in tenths], POINTS_FIELDS,
+                    [('20240305', f"10:15:30.{i}", 80.5, 90, 150, 40, 'On') for i in tenths])
+    assert data_reader.data_source_type(str(job)) == 'tracmap_shapefile_baiting_points'
+
+    points = read_folder('tracmap_shapefile_baiting_points', str(job))
+    assert points['x'].tolist() == [1570000.0 + i for i in range(10)]
+    assert points['epoch'].tolist() == [1709633730000 + i * 100 for i in range(10)]
+    assert points['bucket_state'].tolist() == [1] * 10
+
+
+def test_broken_secondary_dbf_is_unrecognised(tmp_path):
+    usb = tmp_path / 'usb'
+    for job_name in ['GOOD', 'NO_DBF', 'TRUNCATED']:
+        (usb / job_name).mkdir(parents=True)
+        write_shapefile(str(usb / job_name / 'secondary.shp'), [(1570000.0, 5180000.0)], POINTS_FIELDS,
+                        [('20240305', '10:15:30', 80.5, 90, 150, 40, 'On')])
+    os.remove(usb / 'NO_DBF' / 'secondary.dbf')
+    with open(usb / 'TRUNCATED' / 'secondary.dbf', 'r+b') as dbf_file:
+        dbf_file.truncate(10)
+
+    assert data_reader.data_source_type(str(usb / 'NO_DBF')) == 'Unrecognised Data Source'
+    assert data_reader.data_source_type(str(usb / 'TRUNCATED')) == 'Unrecognised Data Source'
+    manifest = data_reader.DataSourceManifest(str(usb)).scan()
+    assert {k: v['source_type'] for k, v in manifest.folders.items()} == {
+        'GOOD': 'tracmap_shapefile_baiting_points', 'NO_DBF': 'Unrecognised Data Source',
+        'TRUNCATED': 'Unrecognised Data Source'}
+
+
+def test_parse_tracmap_summary_units():
+    summary = {'Nominal Area': '1,234.5 ha', 'Real Area': '25000 m2', 'Distance Travelled': '12.5 mi.',
+               'Distance Spreading': '4 furlongs', 'Job Name': 'Block 4'}
+    warnings = []
+    figures = data_reader.parse_tracmap_summary(summary, warnings)
+    assert figures == pytest.approx({'tm_nominal_area': 1234.5, 'tm_real_area': 2.5,
+                                     'tm_distance_travelled': 12.5 * 1.609344})
+    assert len(warnings) == 1
+    assert 'furlongs' in warnings[0]
+    # A unit with digits is read whole rather than as part of the number
+    assert data_reader.parse_tracmap_summary({'Real Area': '3 m²'}) == pytest.approx({'tm_real_area': 0.0003})
+
+
+def write_lines_job(folder):
+    os.makedirs(folder)
+    for shp_name in ['log.shp', 'secondary.shp']:
+        write_shapefile(os.path.join(folder, shp_name), [(1570000.0, 5180000.0)], [('Time', 'C', 19, 0)],
+                        [('2024-03-05T10:15:30',)])
+
+
+def test_manifest_is_rescanned_after_a_stick_swap(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_reader, 'data_source_manifests', {})
+    usb = str(tmp_path / 'usb')
+    write_lines_job(os.path.join(usb, 'PBX_JOB1'))
+    assert list(data_reader.get_data_source_manifest(usb).folders) == ['PBX_JOB1']
+    assert data_reader.match_heli_rego_from_folder_names(['PBX', 'PBY'], usb) == 'PBX'
+
+    # Another machine's stick mounted at the same path
+    os.rename(usb, str(tmp_path / 'ejected'))
+    write_lines_job(os.path.join(usb, 'PBY_JOB1'))
+    assert list(data_reader.get_data_source_manifest(usb).folders) == ['PBY_JOB1']
+    assert data_reader.match_heli_rego_from_folder_names(['PBX', 'PBY'], usb) == 'PBY'
+    assert data_reader.list_valid_tracmap_folders(usb) == [os.path.join(usb, 'PBY_JOB1')]
+
+
+def test_manifest_is_reused_while_the_stick_is_unchanged(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_reader, 'data_source_manifests', {})
+    usb = str(tmp_path / 'usb')
+    write_lines_job(os.path.join(usb, 'PBX_JOB1'))
+    manifest = data_reader.get_data_source_manifest(usb)
+    assert data_reader.get_data_source_manifest(usb) is manifest
+    assert data_reader.get_data_source_manifest(usb, refresh=True) is not manifest
+
+
+def test_cloud_batch_resumes_from_the_last_sync():
+    cloud = tracmap_cloud_mock.MockTracmapCloud(jobs_per_machine=2, points_per_page=50, pages=2)
+    server, url = tracmap_cloud_mock.start_mock_server(cloud)
+    try:
+        data_batch = data_reader.TracmapDataBatch([url], 'tracmap_cloud', 'EPSG:4326', 'EPSG:4326', 'PBX',
+                                                  'PBX_1_1000')
+        assert sum(len(i) for i in data_batch.iter_point_chunks(chunk_size=30)) == 200
+        assert data_batch.cloud_last_sync == cloud.jobs['PBX-1']['updated']
+
+        data_batch = data_reader.TracmapDataBatch([url], 'tracmap_cloud', 'EPSG:4326', 'EPSG:4326', 'PBX',
+                                                  'PBX_1_1100', cloud_last_sync=data_batch.cloud_last_sync)
+        assert list(data_batch.iter_point_chunks(chunk_size=30)) == []
+        assert data_batch.cloud_last_sync == cloud.jobs['PBX-1']['updated']
+
+        # A page that fails part way through leaves the sync where it was
+        cloud.add_job(tracmap_cloud_mock.generate_job('PBX', 2, datetime(2024, 3, 5, 13, 0, 0), 50, 2))
+        cloud.failures[('PBX-2', 2)] = 'truncated'
+        with pytest.raises(ConnectionError):
+            list(data_batch.iter_point_chunks(chunk_size=30))
+        assert data_batch.cloud_last_sync == cloud.jobs['PBX-1']['updated']
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+TABULA_FIELDS = [('Date', 'D', 8, 0), ('Time', 'C', 8, 0), ('Lat', 'N', 12, 7), ('Lon', 'N', 12, 7),
+                 ('Speed', 'N', 8, 2), ('Heading', 'N', 6, 1), ('GPS Alt', 'N', 8, 1), ('BoomState', 'N', 1, 0),
+                 ('TargetRate', 'N', 6, 2), ('ActualRate', 'N', 6, 2), ('Width', 'N', 6, 1)]
+
+
+def test_tabula_export_columns(tmp_path):
+    job = tmp_path / 'TABULA1'
+    job.mkdir()
+    write_shapefile(str(job / 'secondary.shp'), [(1570000.0, 5180000.0), (1570010.0, 5180000.0),
+                                                  (1570020.0, 5180000.0)], TABULA_FIELDS,
+                    [('20240305', '10:15:31', -43.5, 172.5, 81, 92.5, 151, 0, 2, 0, 40),
+                     ('20240305', '10:15:30', -43.5, 172.5, 80.5, 90, 150, 1, 2, 2.1, 40),
+                     ('20240305', '10:15:32', -43.5, 172.5, '', '', 152, 1, 2, 2.1, 60)])
+    assert data_reader.data_source_type(str(job)) == 'tabula_shapefile_baiting_points'
+
+    data_batch = data_reader.TracmapDataBatch([str(job)], 'tabula_shapefile_baiting_points', 'EPSG:2193',
+                                              'EPSG:2193', 'pbx', 'PBX_1_1000', swath_translation={'40.0': '45'})
+    data_batch.__read_features__()
+    points = data_batch.layers['TABULA1_secondary']
+    # Ordered by time
+    assert points['epoch'].tolist() == [1709633730000, 1709633731000, 1709633732000]
+    assert points['x'].tolist() == [1570010.0, 1570000.0, 1570020.0]
+    assert points['bucket_state'].tolist() == [1, 0, 1]
+    assert points['altitude'].tolist() == [150, 151, 152]
+    assert points['width'].tolist() == [45, 45, 60]
+    # Blank numbers are missing rather than 0
+    assert np.isnan(points['speed'][2]) and np.isnan(points['heading'][2])
+
+
+def test_points_export_without_optional_columns(tmp_path):
+    job = tmp_path / 'JOB1'
+    job.mkdir()
+    fields = [i for i in POINTS_FIELDS if i[0] != 'Width']
+    write_shapefile(str(job / 'secondary.shp'), [(1570000.0, 5180000.0)], fields,
+                    [('20240305', '10:15:30', 80.5, 90, 150, 'Off')])
+    assert data_reader.data_source_type(str(job)) == 'tracmap_shapefile_baiting_points'
+
+    points = read_folder('tracmap_shapefile_baiting_points', str(job))
+    assert len(points) == 1
+    assert np.isnan(points['width'][0])
+    assert points['bucket_state'].tolist() == [0]
+    assert points['lon'].tolist() == [1570000.0]
+
+
+def test_interpolate_line_points():
+    # 1 m/s, the second part starts 98.8 m from the end of the first
+    vertices = np.array([[0.0, 0.0], [0.5, 0.0], [1.2, 0.0], [100.0, 0.0], [101.5, 0.0]])
+    keep, epochs = data_reader.interpolate_line_points(vertices, np.array([0, 3]), 1.94384, 1709633730000)
+    assert keep.tolist() == [True, False, True, False, True]
+    assert epochs.tolist() == [1709633730000, 1709633730000, 1709633731000, 1709633731000, 1709633732000]
+
+
+LINES_LOG_FIELDS = [('Time', 'C', 19, 0), ('Speed', 'N', 8, 3), ('GPS Alt', 'N', 8, 1), ('Width', 'N', 6, 1)]
+LINES_SECONDARY_FIELDS = [('Time', 'C', 19, 0), ('Speed', 'N', 8, 2), ('Heading', 'N', 6, 1),
+                          ('GPS Alt', 'N', 8, 1), ('Width', 'N', 6, 1)]
+
+
+def test_lines_export_interpolates_the_log_lines(tmp_path):
+    job = tmp_path / 'JOB1'
+    job.mkdir()
+    # 50 m/s along the first line, a vertex every 30 m, the second line has no speed
+    write_shapefile(str(job / 'log.shp'),
+                    [[[(1570000.0 + i * 30, 5180000.0) for i in range(5)]], [[(1571000.0, 5180000.0),
+                                                                              (1571100.0, 5180000.0)]]],
+                    LINES_LOG_FIELDS, [('2024-03-05T10:15:30', 97.192, 150, 40), ('2024-03-05T10:20:00', 0, 150, 40)])
+    write_shapefile(str(job / 'secondary.shp'), [(1569900.0, 5180000.0), (1570200.0, 5180000.0)],
+                    LINES_SECONDARY_FIELDS, [('2024-03-05T10:15:29', 60, 90, 140, 40),
+                                             ('2024-03-05T10:15:33', 60, 90, 155, 40)])
+    assert data_reader.data_source_type(str(job)) == 'tracmap_shapefile_baiting_lines'
+
+    points = read_folder('tracmap_shapefile_baiting_lines', str(job))
+    assert points['epoch'].tolist() == [1709633729000 + i * 1000 for i in range(5)]
+    assert points['x'].tolist() == [1569900.0, 1570000.0, 1570060.0, 1570120.0, 1570200.0]
+    assert points['bucket_state'].tolist() == [0, 1, 1, 1, 0]
+    assert points['altitude'].tolist() == [140, 150, 150, 150, 155]
+
+
+class FakeOsr:
+    """Stands in for osgeo.osr, counting the transformations created and the batches transformed"""
+    OAMS_TRADITIONAL_GIS_ORDER = 0
+
+    def __init__(self):
+        self.transformations = []
+        self.batches = []
+
+    class SpatialReference:
+        def SetFromUserInput(self, srid):
+            self.srid = srid
+
+        def SetAxisMappingStrategy(self, strategy):
+            pass
+
+    def CoordinateTransformation(self, source, store):
+        fake_osr = self
+        self.transformations.append((source.srid, store.srid))
+
+        class Transformation:
+            def TransformPoints(self, points):
+                fake_osr.batches.append(np.array(points))
+                return [(x + 1000, y + 2000, 0) for x, y in points]
+
+        return Transformation()
+
+
+@pytest.fixture
+def fake_osr(monkeypatch):
+    fake_osr = FakeOsr()
+    monkeypatch.setattr(data_reader, 'osr', fake_osr)
+    monkeypatch.setattr(data_reader, 'coordinate_transformers', {})
+    return fake_osr
+
+
+def test_coordinate_transformers_are_cached(fake_osr):
+    transformer = data_reader.get_coordinate_transformer('EPSG:4326', 'EPSG:2193')
+    assert data_reader.get_coordinate_transformer('EPSG:4326', 'EPSG:2193') is transformer
+    data_reader.get_coordinate_transformer('EPSG:4326', 'EPSG:2135')
+    assert fake_osr.transformations == [('EPSG:4326', 'EPSG:2193'), ('EPSG:4326', 'EPSG:2135')]
+
+
+def test_transform_coordinates_in_one_batch(fake_osr):
+    x = np.array([172.5, np.nan, 172.6, 172.7])
+    y = np.array([-43.5, -43.5, np.nan, -43.7])
+    tx, ty = data_reader.transform_coordinates(x, y, 'EPSG:4326', 'EPSG:2193')
+    # Only the points with both coordinates are sent, in a single call
+    assert len(fake_osr.batches) == 1
+    assert fake_osr.batches[0].tolist() == [[172.5, -43.5], [172.7, -43.7]]
+    assert tx.tolist()[0::3] == [1172.5, 1172.7]
+    assert ty.tolist()[0::3] == [1956.5, 1956.3]
+    assert np.isnan(tx[1]) and np.isnan(ty[1]) and np.isnan(tx[2]) and np.isnan(ty[2])
+    # The input arrays are left as they were
+    assert x[0] == 172.5
+
+    # Nothing to transform
+    data_reader.transform_coordinates(x, y, 'EPSG:2193', 'EPSG:2193')
+    data_reader.transform_coordinates(np.array([np.nan]), np.array([np.nan]), 'EPSG:4326', 'EPSG:2193')
+    assert len(fake_osr.batches) == 1
+    assert fake_osr.transformations == [('EPSG:4326', 'EPSG:2193')]
+
+
+def test_folder_is_transformed_in_one_batch(fake_osr, tmp_path):
+    job = tmp_path / 'JOB1'
+    job.mkdir()
+    write_shapefile(str(job / 'secondary.shp'), [(172.5 + i * 0.001, -43.5) for i in range(10)], POINTS_FIELDS,
+                    [('20240305', f"10:15:{30 + i}", 80.5, 90, 150, 40, 'On') for i in range(10)])
+    data_batch = data_reader.TracmapDataBatch([str(job)], 'tracmap_shapefile_baiting_points', 'EPSG:4326',
+                                              'EPSG:2193', 'pbx', 'PBX_1_1000')
+    data_batch.__read_features__()
+    points = data_batch.layers['JOB1_secondary']
+    assert len(fake_osr.batches) == 1
+    assert len(fake_osr.batches[0]) == 10
+    assert points['lon'][0] == 172.5
+    assert points['x'][0] == 1172.5
+
+
+def write_points_jobs(tmp_path, job_count):
+    """Points export jobs flown in the reverse order of their folder names"""
+    dir_paths = []
+    for job_number in range(job_count):
+        job = tmp_path / f"JOB{job_number}"
+        job.mkdir()
+        minute = 59 - job_number
+        write_shapefile(str(job / 'secondary.shp'), [(1570000.0 + job_number, 5180000.0 + i) for i in range(3)],
+                        POINTS_FIELDS, [('20240305', f"10:{minute}:{i:02d}", 80.5, 90, 150, 40, 'On')
+                                        for i in range(3)])
+        (job / 'summary.txt').write_text(f"Job Name: JOB{job_number}\nReal Area: {job_number} ha\n")
+        dir_paths.append(str(job))
+    return dir_paths
+
+
+def read_batch(dir_paths, processes):
+    data_batch = data_reader.TracmapDataBatch(dir_paths, 'tracmap_shapefile_baiting_points', 'EPSG:2193',
+                                              'EPSG:2193', 'pbx', 'PBX_1_1000')
+    data_batch.read_datasource(processes)
+    return data_batch
+
+
+def test_parallel_read_matches_serial_read(tmp_path):
+    dir_paths = write_points_jobs(tmp_path, 3)
+    serial = read_batch(dir_paths, None)
+    parallel = read_batch(dir_paths, 2)
+    assert parallel.parallel_read_error is None
+    # Layers in src_paths order, so the summaries are loaded in the same order
+    assert list(parallel.layers) == list(serial.layers)
+    assert list(parallel.summary_layers) == ['JOB0_summary', 'JOB1_summary', 'JOB2_summary']
+    assert parallel.points.tobytes() == serial.points.tobytes()
+    # Merged in time order across the folders
+    assert parallel.points['x'].tolist() == [1570002.0] * 3 + [1570001.0] * 3 + [1570000.0] * 3
+
+
+def test_parallel_read_falls_back_to_a_serial_read(tmp_path, monkeypatch):
+    dir_paths = write_points_jobs(tmp_path, 2)
+    monkeypatch.setattr(data_reader, 'start_folder_process_pool',
+                        lambda processes: (None, 'Unable to start the worker processes, reading serially'))
+    data_batch = read_batch(dir_paths, 2)
+    assert data_batch.parallel_read_error == 'Unable to start the worker processes, reading serially'
+    assert data_batch.points.tobytes() == read_batch(dir_paths, None).points.tobytes()
+
+
+def test_process_pool_that_cannot_start(monkeypatch):
+    def folder_process_pool(processes):
+        raise OSError('python3 not found next to QGIS')
+
+    monkeypatch.setattr(data_reader, 'folder_process_pool', folder_process_pool)
+    executor, error = data_reader.start_folder_process_pool(2)
+    assert executor is None
+    assert 'python3 not found' in error
+
+
+@pytest.mark.parametrize('processes', [None, 2])
+def test_points_are_streamed_in_chunks(tmp_path, processes):
+    dir_paths = write_points_jobs(tmp_path, 3)
+    data_batch = data_reader.TracmapDataBatch(dir_paths, 'tracmap_shapefile_baiting_points', 'EPSG:2193',
+                                              'EPSG:2193', 'pbx', 'PBX_1_1000')
+    events = []
+    chunks = []
+    for points in data_batch.iter_point_chunks(4, processes, folder_written=lambda i: events.append(f"folder {i}")):
+        events.append(f"chunk {len(points)}")
+        chunks.append(points)
+
+    # Each folder is confirmed once the chunk holding its last point has been written
+    assert events == ['chunk 4', 'folder 0', 'chunk 4', 'folder 1', 'chunk 1', 'folder 2']
+    # Points are in folder order, each folder in time order
+    assert np.concatenate(chunks)['x'].tolist() == [1570000.0] * 3 + [1570001.0] * 3 + [1570002.0] * 3
+    # Only the summaries are kept
+    assert list(data_batch.layers) == ['JOB0_summary', 'JOB1_summary', 'JOB2_summary']
+    assert data_batch.secondary_layers == {}
@@ -0,0 +1,38 @@
+# Open Flightline Mini
+
+# Description:
+# Checks the parsing of drone log times.
+
+import numpy as np
+
+from open_flightline_mini import drone_log
+
+
+# 2024-03-05T10:15:30 as wall clock epoch milliseconds
+EPOCH_MS = 1709633730000
+
+
+def test_parse_log_times_numbers():
+    assert drone_log.parse_log_times(['1709633730', '1709633730.5']).tolist() == [EPOCH_MS, EPOCH_MS + 500]
+    assert drone_log.parse_log_times(['1709633730250']).tolist() == [EPOCH_MS + 250]
+
+
+def test_parse_log_times_blank_and_bad_values_are_nat():
+    values = ['2024-03-05T10:15:30.250Z', '', 'no fix', '2024-03-05 10:15:31']
+    assert drone_log.parse_log_times(values).tolist() == [EPOCH_MS + 250, drone_log.NAT, drone_log.NAT,
+                                                          EPOCH_MS + 1000]
+    assert drone_log.parse_log_times(['1709633730', ' ', 'nan']).tolist() == [EPOCH_MS, drone_log.NAT,
+                                                                               drone_log.NAT]
+    assert drone_log.parse_log_times(['', '']).tolist() == [drone_log.NAT] * 2
+
+
+def test_drone_log_rows_without_a_time(tmp_path):
+    log_path = tmp_path / 'flight.csv'
+    log_path.write_text('time,lat,lon,hdop\n'
+                        '2024-03-05T10:15:30,-41.1,175.1,0.8\n'
+                        ',-41.2,175.2,0.8\n'
+                        'GPS lost,-41.3,175.3,0.8\n')
+    points = np.concatenate(list(drone_log.iter_drone_log_chunks(str(log_path))))
+    timed = drone_log.timed_fixes(points)
+    assert timed.tolist() == [True, False, False]
+    assert points['epoch'][timed].tolist() == [EPOCH_MS]
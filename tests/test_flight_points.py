@@ -0,0 +1,133 @@
+# Open Flightline Mini
+
+# Description:
+# Checks the src_ids of staged points and the migration of src_ids stored
+# by older versions.
+
+import numpy as np
+
+from open_flightline_mini import flight_points, gpkg_sqlite
+
+
+INSERT_SQL = "INSERT INTO heli_points (geom, src_id, date_time, speed, machine_code, batch_id) VALUES (?, ?, ?, ?, ?, ?)"
+
+
+def staged_points():
+    points = flight_points.empty_points(2)
+    points['epoch'] = [1709633730000, 1709633731000]
+    points['speed'] = [80.5, 81.0]
+    return points
+
+
+def test_point_src_ids():
+    assert flight_points.point_src_ids(staged_points()) == ['2024-03-05 10:15:30|80.5', '2024-03-05 10:15:31|81.0']
+    assert flight_points.point_src_ids(flight_points.empty_points()) == []
+
+
+def test_sub_second_fixes_are_kept():
+    # 10 Hz fixes at the same speed, the last one repeated
+    points = flight_points.empty_points(4)
+    points['epoch'] = [1709633730200, 1709633730000, 1709633730100, 1709633730200]
+    points['speed'] = 80.5
+    points['x'] = [3, 1, 2, 4]
+    points = flight_points.unique_points(points)
+    assert points['x'].tolist() == [1, 2, 3]
+    assert flight_points.point_src_ids(points) == ['2024-03-05 10:15:30|80.5', '2024-03-05 10:15:30.100|80.5',
+                                                   '2024-03-05 10:15:30.200|80.5']
+    rows = flight_points.heli_points_rows(points, 'PBX', 'PBX_1', 0, 2193)
+    assert [i[2] for i in rows] == ['2024-03-05T10:15:30', '2024-03-05T10:15:30.100', '2024-03-05T10:15:30.200']
+
+
+def test_sub_second_src_ids_are_current(gpkg_connection):
+    points = flight_points.empty_points(2)
+    points['epoch'] = [1709633730000, 1709633730100]
+    with gpkg_connection:
+        gpkg_connection.executemany(INSERT_SQL, [(None, *i[1:4], 'PBX', 'PBX_1') for i in
+                                                 flight_points.heli_points_rows(points, 'PBX', 'PBX_1', 0, 2193)])
+    assert not flight_points.has_old_src_ids(gpkg_connection)
+    with gpkg_sqlite.transaction(gpkg_connection):
+        assert flight_points.migrate_src_ids(gpkg_connection) == (0, [])
+
+
+def test_migrate_src_ids(gpkg_connection):
+    points = staged_points()
+    blob = gpkg_sqlite.point_blobs(np.array([1570000.0]), np.array([5180000.0]), 2193)[0]
+    old_rows = [(blob, '2024-03-05 10:15:30+13:00_80.5', '2024-03-05T10:15:30+13:00', 80.5, 'PBX', 'PBX_1'),
+                (blob, 'PyQt5.QtCore.QDateTime(2024, 3, 5, 10, 15, 31)|81.0', '2024-03-05T10:15:31Z', 81.0,
+                 'PBX', 'PBX_1'),
+                (blob, 'PyQt5.QtCore.QDateTime(2024, 3, 5, 10, 15, 31)|81.0', '2024-03-05T10:15:31Z', 81.0,
+                 'pby', 'PBY_1')]
+    # The same fixes loaded again in the new format
+    new_rows = [(blob, src_id, date_time, speed, 'PBX', 'PBX_2')
+                for src_id, date_time, speed in zip(flight_points.point_src_ids(points), ['2024-03-05T10:15:30',
+                                                                                          '2024-03-05T10:15:31'],
+                                                    points['speed'].tolist())]
+    with gpkg_connection:
+        gpkg_connection.executemany(INSERT_SQL, old_rows + new_rows)
+
+    assert flight_points.has_old_src_ids(gpkg_connection)
+    with gpkg_sqlite.transaction(gpkg_connection):
+        rewritten, removed = flight_points.migrate_src_ids(gpkg_connection)
+
+    assert rewritten == 3
+    assert [(i[0], i[2]) for i in removed] == [(4, 'PBX_2'), (5, 'PBX_2')]
+    rows = gpkg_connection.execute("SELECT fid, machine_code, src_id FROM heli_points ORDER BY fid").fetchall()
+    assert rows == [(1, 'PBX', '2024-03-05 10:15:30|80.5'), (2, 'PBX', '2024-03-05 10:15:31|81.0'),
+                    (3, 'PBY', '2024-03-05 10:15:31|81.0')]
+    assert gpkg_connection.execute("SELECT count(*) FROM rtree_heli_points_geom").fetchone()[0] == 3
+    assert not flight_points.has_old_src_ids(gpkg_connection)
+
+    # Running it again changes nothing
+    with gpkg_sqlite.transaction(gpkg_connection):
+        assert flight_points.migrate_src_ids(gpkg_connection) == (0, [])
+
+
+def test_point_arrays():
+    assert flight_points.empty_points(3).dtype == flight_points.STAGING_POINT_DTYPE
+    assert len(flight_points.concatenate_points([])) == 0
+    assert flight_points.concatenate_points([]).dtype == flight_points.STAGING_POINT_DTYPE
+    assert len(flight_points.concatenate_points([staged_points(), staged_points()])) == 4
+    # A fix per row is stored in 73 bytes rather than a dict of python objects
+    assert flight_points.STAGING_POINT_DTYPE.itemsize == 73
+
+
+def test_unique_points_keeps_the_first_of_each_fix():
+    points = flight_points.empty_points(4)
+    points['epoch'] = [1709633731000, 1709633730000, 1709633730000, 1709633730000]
+    points['speed'] = [80.5, 81.0, 80.5, 81.0]
+    points['x'] = [1, 2, 3, 4]
+    # Ordered by time then speed, the repeated fix keeps its first row
+    assert flight_points.unique_points(points)['x'].tolist() == [3, 2, 1]
+
+
+def test_heli_points_rows():
+    points = staged_points()
+    points['x'] = [1570000.0, 1570010.0]
+    points['y'] = 5180000.0
+    points['heading'] = [90.0, np.nan]
+    points['altitude'] = 150.0
+    points['width'] = [40.0, np.nan]
+    points['bucket_state'] = [1, 0]
+    rows = flight_points.heli_points_rows(points, 'PBX', 'PBX_1', 20, 2193)
+    blobs = gpkg_sqlite.point_blobs(points['x'], points['y'], 2193)
+    assert rows == [(blobs[0], '2024-03-05 10:15:30|80.5', '2024-03-05T10:15:30', 80.5, 90.0, 150.0, 40.0, 'PBX',
+                     20, 'PBX_1', 1),
+                    (blobs[1], '2024-03-05 10:15:31|81.0', '2024-03-05T10:15:31', 81.0, None, 150.0, None, 'PBX',
+                     20, 'PBX_1', 0)]
+    assert len(rows[0]) == 1 + len(flight_points.HELI_POINTS_COLUMNS)
+
+
+def test_drone_points_rows():
+    points = flight_points.empty_drone_points(2)
+    points['src_id'] = [7, 8]
+    points['epoch'] = [1709633730000, 1709633730100]
+    points['speed'] = [5.0, np.nan]
+    points['hdop'] = [0.84, np.nan]
+    points['vbat'] = [24.1, np.nan]
+    points['bucket_state'] = [1, 0]
+    points['bucket_shutoff'] = [0, 1]
+    rows = flight_points.drone_points_rows(points, 'DRONE1', 'DRONE1_1', 2193)
+    assert [i[1:] for i in rows] == [
+        (7, '2024-03-05T10:15:30.000', 5.0, 0.0, 0.0, 0.0, 'DRONE1', 'DRONE1_1', 1, 0, 84, 24.1),
+        (8, '2024-03-05T10:15:30.100', None, 0.0, 0.0, 0.0, 'DRONE1', 'DRONE1_1', 0, 1, None, None)]
+    assert len(rows[0]) == 1 + len(flight_points.DRONE_POINTS_COLUMNS)
@@ -0,0 +1,310 @@
+# Open Flightline Mini
+
+# Description:
+# Checks the FlightlineProject methods that work on the gpkg through the
+# sqlite connection rather than through QGIS layers.
+
+import os
+import sqlite3
+from datetime import datetime
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip('qgis')
+pytest.importorskip('osgeo')
+
+from open_flightline_mini import data_reader, flight_points, flightline_project, gpkg_snapshot, gpkg_sqlite
+
+from conftest import DRONE_POINTS_COLUMNS_SQL, SRS_ID, create_gpkg, point_layer_sql
+
+
+HELI_INFO_SQL = "CREATE TABLE heli_info (fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, machine_code TEXT)"
+
+# As created by older projects, with bacth_id and without job_name
+TRACMAP_SUMMARY_SQL = """CREATE TABLE tracmap_summary (fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, id INTEGER,
+                             machine_code TEXT, cumulative_tm_nominal_area REAL, cumulative_tm_real_area REAL,
+                             cumulative_tm_distance_travelled REAL, cumulative_tm_distance_spreading REAL,
+                             tm_nominal_area REAL, tm_real_area REAL, tm_distance_travelled REAL,
+                             tm_distance_spreading REAL, bacth_id TEXT)"""
+
+
+def project(gpkg_path):
+    fl_project = flightline_project.FlightlineProject()
+    fl_project.__set_gpkg_path__(gpkg_path)
+    return fl_project
+
+
+def test_machine_code_list_without_a_gpkg(tmp_path):
+    assert flightline_project.FlightlineProject().machine_code_list == []
+    missing_gpkg = str(tmp_path / 'missing.gpkg')
+    assert project(missing_gpkg).machine_code_list == []
+    assert not os.path.exists(missing_gpkg)
+    assert flightline_project.get_helicopter_list_from_project_folder(str(tmp_path)) == []
+
+
+def test_machine_code_list_only_reads_the_gpkg(gpkg_path):
+    connection = gpkg_sqlite.connect(gpkg_path)
+    with connection:
+        connection.execute(HELI_INFO_SQL)
+        connection.executemany("INSERT INTO heli_info (machine_code) VALUES (?)", [('pby',), ('PBX',), ('pbx',),
+                                                                                 (None,)])
+    connection.close()
+    modified = os.stat(gpkg_path).st_mtime_ns
+
+    assert project(gpkg_path).machine_code_list == ['PBX', 'PBY']
+    assert os.stat(gpkg_path).st_mtime_ns == modified
+    connection = gpkg_sqlite.connect(gpkg_path)
+    assert not connection.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                  "AND name LIKE 'idx_%'").fetchall()
+    connection.close()
+
+
+def test_machine_code_list_without_heli_info(gpkg_path):
+    assert project(gpkg_path).machine_code_list == []
+
+
+def test_gpkg_connection_does_not_create_a_missing_gpkg(tmp_path):
+    missing_gpkg = str(tmp_path / 'missing.gpkg')
+    with pytest.raises(FileNotFoundError):
+        project(missing_gpkg).gpkg_connection
+    assert not os.path.exists(missing_gpkg)
+
+
+def summary_batch(batch_id, summaries):
+    """
+    :param summaries: dict<job folder name: real area ha>
+    :return: data_reader.TracmapDataBatch
+    """
+    data_batch = data_reader.TracmapDataBatch([], None, 'EPSG:2193', 'EPSG:2193', 'PBX', batch_id)
+    data_batch.layers = {f"{job_name}_summary": {'Real Area': f"{area} ha", 'Distance Spreading': '2.5 km'}
+                         for job_name, area in summaries.items()}
+    return data_batch
+
+
+def summary_rows(fl_project):
+    return fl_project.gpkg_connection.execute("SELECT job_name, tm_real_area, cumulative_tm_real_area, "
+                                              "cumulative_tm_distance_spreading, bacth_id FROM tracmap_summary "
+                                              "ORDER BY fid").fetchall()
+
+
+def test_tracmap_summary_running_totals(gpkg_path, tmp_path):
+    connection = gpkg_sqlite.connect(gpkg_path)
+    connection.execute(TRACMAP_SUMMARY_SQL)
+    connection.close()
+    fl_project = project(gpkg_path)
+    fl_project.__set_raw_data_folder__(str(tmp_path / 'raw_data'))
+
+    # Two jobs flown the same on one day are both kept
+    assert fl_project.load_data_batch_into_tracmap_summary(summary_batch('PBX_1_1000', {'JOB1': 10, 'JOB2': 10})) == 2
+    # A job already loaded is skipped when the USB is downloaded again
+    assert fl_project.load_data_batch_into_tracmap_summary(summary_batch('PBX_1_1100', {'JOB2': 10, 'JOB3': 5})) == 1
+    assert summary_rows(fl_project) == [('JOB1', 10.0, 10.0, 2.5, 'PBX_1_1000'),
+                                        ('JOB2', 10.0, 20.0, 5.0, 'PBX_1_1000'),
+                                        ('JOB3', 5.0, 25.0, 7.5, 'PBX_1_1100')]
+
+    deleted, message = fl_project.delete_data_batch('PBX_1_1000')
+    assert deleted['tracmap_summary'] == 2
+    assert summary_rows(fl_project) == [('JOB3', 5.0, 5.0, 2.5, 'PBX_1_1100')]
+    # The next load carries on from the recalculated total
+    assert fl_project.load_data_batch_into_tracmap_summary(summary_batch('PBX_2_0900', {'JOB4': 1})) == 1
+    assert summary_rows(fl_project)[-1] == ('JOB4', 1.0, 6.0, 5.0, 'PBX_2_0900')
+
+
+DRONE_LAYERS_SQL = (point_layer_sql('drone_points', f"CREATE TABLE drone_points ({DRONE_POINTS_COLUMNS_SQL})")
+                    + point_layer_sql('staging_drone_points',
+                                      f"CREATE TABLE staging_drone_points ({DRONE_POINTS_COLUMNS_SQL}, action TEXT)"))
+
+
+def drone_batch(batch_id, epoch_chunks):
+    """A stand in for data_reader.DroneDataBatch yielding a chunk of fixes for each list of epochs"""
+    chunks = []
+    for epochs in epoch_chunks:
+        points = flight_points.empty_drone_points(len(epochs))
+        points['epoch'] = epochs
+        points['x'] = 1570000.0 + (np.array(epochs) - 1709633730000) / 100
+        points['y'] = 5180000.0
+        points['hdop'] = 0.8
+        chunks.append(points)
+    return SimpleNamespace(machine_code='DRONE1', batch_id=batch_id, iter_point_chunks=lambda chunk_size: chunks)
+
+
+def spatial_index(connection, table_name):
+    return (connection.execute(f"SELECT id, minx, maxx, miny, maxy FROM rtree_{table_name}_geom ORDER BY id").fetchall(),
+            connection.execute("SELECT feature_count FROM gpkg_ogr_contents WHERE table_name = ?",
+                               (table_name,)).fetchone()[0])
+
+
+def test_drone_load_keeps_the_spatial_index(tmp_path):
+    gpkg_path = create_gpkg(str(tmp_path / 'project.gpkg'), DRONE_LAYERS_SQL)
+    fl_project = project(gpkg_path)
+
+    counts = fl_project.load_drone_batch_into_drone_points(
+        drone_batch('DRONE1_1_1000', [[1709633730000, 1709633730100], [1709633730200]]))
+    assert counts == {'staged': 3, 'inserted': 3, 'updated': 0}
+    # The second flight repeats the last fix of the first
+    counts = fl_project.load_drone_batch_into_drone_points(
+        drone_batch('DRONE1_1_1100', [[1709633730200, 1709633730300]]))
+    assert counts == {'staged': 2, 'inserted': 1, 'updated': 1}
+
+    connection = fl_project.gpkg_connection
+    assert spatial_index(connection, 'staging_drone_points') == ([], 0)
+    rows = connection.execute("SELECT fid, geom FROM drone_points ORDER BY fid").fetchall()
+    assert len(rows) == 4
+    # The same rows inserted one at a time through the GDAL triggers
+    row_by_row = gpkg_sqlite.connect(create_gpkg(str(tmp_path / 'row_by_row.gpkg'), DRONE_LAYERS_SQL))
+    for row in rows:
+        with row_by_row:
+            row_by_row.execute("INSERT INTO drone_points (fid, geom) VALUES (?, ?)", row)
+    assert spatial_index(connection, 'drone_points') == spatial_index(row_by_row, 'drone_points')
+    row_by_row.close()
+
+
+LOAD_TABLES_SQL = """CREATE TABLE flight_path (fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, machine_code TEXT,
+                         load_number INTEGER, batch_id TEXT);
+                     CREATE TABLE load_summary (fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, machine_code TEXT,
+                         load_number INTEGER, batch_id TEXT);"""
+
+
+def load_project(gpkg_path, loads):
+    """
+    A project with heli_points, flight_path and load_summary rows for each load
+    :param loads: list<(machine_code, load_number, batch_id, point count)>
+    """
+    connection = gpkg_sqlite.connect(gpkg_path)
+    connection.executescript(LOAD_TABLES_SQL)
+    with connection:
+        for machine_code, load_number, batch_id, count in loads:
+            x = 1570000.0 + np.arange(count) + 100 * load_number
+            blobs = gpkg_sqlite.point_blobs(x, np.full(count, 5180000.0), SRS_ID)
+            connection.executemany("INSERT INTO heli_points (geom, src_id, machine_code, load_number, batch_id, "
+                                   "bucket_size) VALUES (?, ?, ?, ?, ?, 20)",
+                                   [(blob, f"{batch_id}_{load_number}_{i}", machine_code, load_number, batch_id)
+                                    for i, blob in enumerate(blobs)])
+            for table_name in ['flight_path', 'load_summary']:
+                connection.execute(f"INSERT INTO {table_name} (machine_code, load_number, batch_id) VALUES (?, ?, ?)",
+                                   (machine_code, load_number, batch_id))
+    connection.close()
+    return project(gpkg_path)
+
+
+def heli_points_index_matches(fl_project):
+    """The rtree ids and feature count should always match the heli_points rows"""
+    # Taken again each time as the connection is reopened after the triggers are put back
+    connection = fl_project.gpkg_connection
+    fids = [i[0] for i in connection.execute("SELECT fid FROM heli_points ORDER BY fid")]
+    rtree_ids = [i[0] for i in connection.execute("SELECT id FROM rtree_heli_points_geom ORDER BY id")]
+    feature_count = connection.execute("SELECT feature_count FROM gpkg_ogr_contents "
+                                       "WHERE table_name = 'heli_points'").fetchone()[0]
+    return fids == rtree_ids and feature_count == len(fids)
+
+
+def loads_in(fl_project, table_name):
+    return fl_project.gpkg_connection.execute(f"SELECT machine_code, load_number, batch_id, count(*) FROM {table_name} "
+                              f"GROUP BY machine_code, load_number, batch_id ORDER BY 1, 2, 3").fetchall()
+
+
+def test_set_based_deletes(gpkg_path):
+    fl_project = load_project(gpkg_path, [('PBX', 1, 'PBX_1_1000', 3), ('PBX', 2, 'PBX_1_1000', 2),
+                                          ('PBX', 3, 'PBX_1_1100', 4), ('PBY', 1, 'PBY_1_1000', 2)])
+    assert fl_project.delete_machine_load_data('PBX', 2, 'heli_points') == 2
+    assert fl_project.delete_batch_id_data('PBX_1_1100', 'heli_points') == 4
+    assert fl_project.delete_batch_id_data('PBX_1_1100', 'missing_table') == 0
+    assert loads_in(fl_project, 'heli_points') == [('PBX', 1, 'PBX_1_1000', 3), ('PBY', 1, 'PBY_1_1000', 2)]
+    assert heli_points_index_matches(fl_project)
+
+    assert fl_project.delete_machine_data('PBX', 'heli_points') == 3
+    assert fl_project.delete_machine_data('PBX', 'flight_path') == 3
+    assert loads_in(fl_project, 'heli_points') == [('PBY', 1, 'PBY_1_1000', 2)]
+    assert loads_in(fl_project, 'flight_path') == [('PBY', 1, 'PBY_1_1000', 1)]
+    assert heli_points_index_matches(fl_project)
+    # Nothing left open for QGIS to wait on
+    assert not fl_project.gpkg_connection.in_transaction
+
+
+def test_delete_data_batch_from_every_table(gpkg_path, tmp_path):
+    fl_project = load_project(gpkg_path, [('PBX', 1, 'PBX_1_1000', 3), ('PBX', 2, 'PBX_1_1000', 2),
+                                          ('PBX', 3, 'PBX_1_1100', 4)])
+    fl_project.__set_raw_data_folder__(str(tmp_path / 'raw_data'))
+    os.makedirs(tmp_path / 'raw_data' / 'PBX' / '1_1000' / 'JOB1')
+
+    deleted, message = fl_project.delete_data_batch('PBX_1_1000')
+    assert deleted == {'heli_bait_lines': 0, 'heli_bait_lines_detailed': 0, 'heli_bait_lines_buffered': 0,
+                       'heli_points': 5, 'load_summary': 2, 'flight_path': 2, 'tracmap_summary': 0}
+    for table_name in ['heli_points', 'flight_path', 'load_summary']:
+        assert [i[2] for i in loads_in(fl_project, table_name)] == ['PBX_1_1100']
+    assert heli_points_index_matches(fl_project)
+    assert os.path.isdir(tmp_path / 'raw_data' / 'PBX' / 'deleted_1_1000' / 'JOB1')
+
+
+def test_failed_delete_data_batch_removes_nothing(gpkg_path, tmp_path):
+    fl_project = load_project(gpkg_path, [('PBX', 1, 'PBX_1_1000', 3)])
+    fl_project.__set_raw_data_folder__(str(tmp_path / 'raw_data'))
+    os.makedirs(tmp_path / 'raw_data' / 'PBX' / '1_1000')
+    # heli_points is deleted from before load_summary fails
+    with fl_project.gpkg_connection as connection:
+        connection.execute("CREATE TRIGGER load_summary_locked BEFORE DELETE ON load_summary "
+                           "BEGIN SELECT RAISE(ABORT, 'load_summary is read only'); END")
+
+    with pytest.raises(sqlite3.DatabaseError):
+        fl_project.delete_data_batch('PBX_1_1000')
+    for table_name in ['heli_points', 'flight_path', 'load_summary']:
+        assert [i[2] for i in loads_in(fl_project, table_name)] == ['PBX_1_1000']
+    assert heli_points_index_matches(fl_project)
+    # The raw data is only archived once the delete has been committed
+    assert os.path.isdir(tmp_path / 'raw_data' / 'PBX' / '1_1000')
+
+
+def test_combine_machine_loads(gpkg_path):
+    fl_project = load_project(gpkg_path, [('PBX', 1, 'PBX_1_1000', 3), ('PBX', 2, 'PBX_1_1000', 2),
+                                          ('PBX', 3, 'PBX_1_1100', 4), ('PBY', 2, 'PBY_1_1000', 2)])
+
+    counts = fl_project.combine_machine_loads('PBX', [3, 2], 30, ['load_summary', 'flight_path'])
+    assert counts == {'heli_points': 6, 'flight_path': 2, 'load_summary': 2}
+    # Combined into the lowest load with the batch of its first point
+    assert fl_project.gpkg_connection.execute(
+        "SELECT machine_code, load_number, batch_id, bucket_size, count(*) FROM heli_points "
+        "GROUP BY 1, 2, 3, 4 ORDER BY 1, 2").fetchall() == [('PBX', 1, 'PBX_1_1000', 20, 3),
+                                                            ('PBX', 2, 'PBX_1_1000', 30, 6),
+                                                            ('PBY', 2, 'PBY_1_1000', 20, 2)]
+    assert loads_in(fl_project, 'load_summary') == [('PBX', 1, 'PBX_1_1000', 1), ('PBY', 2, 'PBY_1_1000', 1)]
+    assert heli_points_index_matches(fl_project)
+
+    # Without a bucket size the bucket sizes are kept
+    assert fl_project.combine_loads_for_heli_points('PBX', [1, 2], 0) == 9
+    assert loads_in(fl_project, 'heli_points') == [('PBX', 1, 'PBX_1_1000', 9), ('PBY', 2, 'PBY_1_1000', 2)]
+    assert fl_project.gpkg_connection.execute("SELECT DISTINCT bucket_size FROM heli_points WHERE load_number = 1 "
+                                              "ORDER BY 1").fetchall() == [(20,), (30,)]
+
+
+def test_clear_machine_load_numbers(gpkg_path):
+    fl_project = load_project(gpkg_path, [('PBX', 1, 'PBX_1_1000', 3), ('PBX', 2, 'PBX_1_1100', 2),
+                                          ('PBY', 1, 'PBY_1_1000', 2)])
+    assert fl_project.clear_machine_load_numbers('PBX') == 5
+    assert loads_in(fl_project, 'heli_points') == [('PBX', None, 'PBX_1_1000', 3), ('PBX', None, 'PBX_1_1100', 2),
+                                                   ('PBY', 1, 'PBY_1_1000', 2)]
+    assert not fl_project.gpkg_connection.in_transaction
+
+
+def test_restore_rotates_the_snapshots(gpkg_path, tmp_path, monkeypatch):
+    class FixedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls(2024, 3, 5, 10, 15, 30)
+
+    monkeypatch.setattr(gpkg_snapshot, 'datetime', FixedDatetime)
+    fl_project = project(gpkg_path)
+    fl_project.__set_project_folder__(str(tmp_path))
+    fl_project.snapshot_retention = 2
+
+    snapshots = [fl_project.snapshot_backup()[0] for i in range(3)]
+    assert fl_project.snapshot_list == snapshots[:0:-1]
+    # The snapshot restored from is kept even though it is past the retention
+    pre_restore = fl_project.restore_snapshot_backup(snapshots[1])
+    assert os.path.basename(pre_restore) == 'project_20240305_101530_4_pre_restore.gpkg'
+    assert fl_project.snapshot_list == [pre_restore, snapshots[2], snapshots[1]]
+
+    # The pre_restore snapshot is removed once it is past the retention
+    later_snapshots = [fl_project.snapshot_backup()[0] for i in range(2)]
+    assert fl_project.snapshot_list == later_snapshots[::-1]
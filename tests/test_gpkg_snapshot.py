@@ -0,0 +1,116 @@
+# Open Flightline Mini
+
+# Description:
+# Checks the gpkg snapshots: naming, retention and restore.
+
+import os
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from open_flightline_mini import gpkg_snapshot, gpkg_sqlite
+
+
+def point_count(gpkg_path):
+    connection = gpkg_sqlite.connect(gpkg_path)
+    try:
+        return connection.execute("SELECT count(*) FROM heli_points").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def add_point(gpkg_path, src_id):
+    connection = gpkg_sqlite.connect(gpkg_path)
+    with connection:
+        connection.execute("INSERT INTO heli_points (src_id, machine_code) VALUES (?, 'PBX')", (src_id,))
+    connection.close()
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_snapshot_and_restore(gpkg_path, tmp_path, compress):
+    backup_folder = str(tmp_path / gpkg_snapshot.BACKUP_FOLDER)
+    add_point(gpkg_path, 'a')
+    snapshot_path = gpkg_snapshot.snapshot_gpkg(gpkg_path, backup_folder, compress=compress)
+
+    assert snapshot_path.endswith('.gpkg.gz' if compress else '.gpkg')
+    assert gpkg_snapshot.list_snapshots(gpkg_path, backup_folder) == [snapshot_path]
+    assert not [i for i in os.listdir(backup_folder) if i.endswith('.tmp') or i.endswith('.tmp.gz')]
+
+    add_point(gpkg_path, 'b')
+    assert point_count(gpkg_path) == 2
+    gpkg_snapshot.restore_snapshot(snapshot_path, gpkg_path)
+    assert point_count(gpkg_path) == 1
+    # The decompressed copy is removed after the restore
+    assert os.listdir(backup_folder) == [os.path.basename(snapshot_path)]
+
+
+def test_restore_rejects_an_invalid_snapshot(gpkg_path, tmp_path):
+    add_point(gpkg_path, 'a')
+    snapshot_path = str(tmp_path / 'project_20240305_101530.gpkg')
+    with open(snapshot_path, 'wb') as snapshot_file:
+        snapshot_file.write(b'not a gpkg' * 100)
+
+    with pytest.raises(sqlite3.DatabaseError):
+        gpkg_snapshot.restore_snapshot(snapshot_path, gpkg_path)
+    assert point_count(gpkg_path) == 1
+
+
+def test_list_and_rotate_snapshots(gpkg_path, tmp_path):
+    backup_folder = str(tmp_path / gpkg_snapshot.BACKUP_FOLDER)
+    os.makedirs(backup_folder)
+    names = ['project_20240305_101530.gpkg', 'project_20240306_090000_pre_restore.gpkg',
+             'project_20240305_101530_2.gpkg.gz', 'project_20240304_235959.gpkg.gz',
+             'project_20240301_080000_pre_restore.gpkg', 'other_20240307_000000.gpkg', 'project_notes.txt']
+    for name in names:
+        open(os.path.join(backup_folder, name), 'w').close()
+
+    snapshots = [os.path.basename(i) for i in gpkg_snapshot.list_snapshots(gpkg_path, backup_folder)]
+    assert snapshots == ['project_20240306_090000_pre_restore.gpkg', 'project_20240305_101530_2.gpkg.gz',
+                         'project_20240305_101530.gpkg', 'project_20240304_235959.gpkg.gz',
+                         'project_20240301_080000_pre_restore.gpkg']
+
+    assert gpkg_snapshot.rotate_snapshots(gpkg_path, backup_folder, retention=0) == []
+    # Labelled snapshots are removed with the others once they are past the retention
+    removed = gpkg_snapshot.rotate_snapshots(gpkg_path, backup_folder, retention=3,
+                                             keep=[os.path.join(backup_folder, 'project_20240304_235959.gpkg.gz')])
+    assert [os.path.basename(i) for i in removed] == ['project_20240301_080000_pre_restore.gpkg']
+    removed = gpkg_snapshot.rotate_snapshots(gpkg_path, backup_folder, retention=2)
+    assert [os.path.basename(i) for i in removed] == ['project_20240305_101530.gpkg',
+                                                      'project_20240304_235959.gpkg.gz']
+    assert sorted(os.listdir(backup_folder)) == sorted(names[1:3] + names[5:])
+
+
+class FixedDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return cls(2024, 3, 5, 10, 15, 30)
+
+
+def test_snapshots_in_the_same_second(gpkg_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(gpkg_snapshot, 'datetime', FixedDatetime)
+    backup_folder = str(tmp_path / gpkg_snapshot.BACKUP_FOLDER)
+    snapshot_paths = []
+    for i, (compress, label) in enumerate([(False, None), (True, None), (False, 'pre_restore'), (False, None)]):
+        add_point(gpkg_path, str(i))
+        snapshot_paths.append(gpkg_snapshot.snapshot_gpkg(gpkg_path, backup_folder, compress, label))
+
+    assert [os.path.basename(i) for i in snapshot_paths] == [
+        'project_20240305_101530.gpkg', 'project_20240305_101530_2.gpkg.gz',
+        'project_20240305_101530_3_pre_restore.gpkg', 'project_20240305_101530_4.gpkg']
+    assert not [i for i in os.listdir(backup_folder) if '.tmp' in i]
+    assert gpkg_snapshot.list_snapshots(gpkg_path, backup_folder) == snapshot_paths[::-1]
+    gpkg_snapshot.restore_snapshot(snapshot_paths[0], gpkg_path)
+    assert point_count(gpkg_path) == 1
+
+
+def test_failed_snapshot_leaves_no_files(gpkg_path, tmp_path, monkeypatch):
+    backup_folder = str(tmp_path / gpkg_snapshot.BACKUP_FOLDER)
+
+    def disk_full(*args, **kwargs):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(gpkg_snapshot.gzip, 'open', disk_full)
+    with pytest.raises(OSError):
+        gpkg_snapshot.snapshot_gpkg(gpkg_path, backup_folder, compress=True)
+    assert os.listdir(backup_folder) == []
@@ -0,0 +1,214 @@
+# Open Flightline Mini
+
+# Description:
+# Checks that the bulk writes in gpkg_sqlite keep the rtree index, the
+# feature count and the layer triggers the same as a row by row write.
+
+import os
+
+import numpy as np
+import pytest
+
+from open_flightline_mini import gpkg_sqlite
+
+from conftest import HELI_POINTS_SQL, SRS_ID, create_gpkg, point_layer_sql
+
+
+INSERT_SQL = "INSERT INTO heli_points (geom, src_id, machine_code, batch_id) VALUES (?, ?, ?, ?)"
+
+
+def heli_points_rows(x, y, batch_id='PBX_1'):
+    blobs = gpkg_sqlite.point_blobs(np.array(x, dtype=float), np.array(y, dtype=float), SRS_ID)
+    return [(blob, str(i), 'PBX', batch_id) for i, blob in enumerate(blobs)]
+
+
+def triggers(connection):
+    return dict(connection.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall())
+
+
+def feature_count(connection):
+    return connection.execute("SELECT feature_count FROM gpkg_ogr_contents "
+                              "WHERE table_name = 'heli_points'").fetchone()[0]
+
+
+def rtree(connection):
+    return connection.execute("SELECT id, minx, maxx, miny, maxy FROM rtree_heli_points_geom ORDER BY id").fetchall()
+
+
+def row_by_row_rtree(gpkg_path, rows):
+    """The rtree the GDAL triggers build when the rows are inserted one at a time"""
+    connection = gpkg_sqlite.connect(create_gpkg(gpkg_path))
+    with connection:
+        connection.executemany(INSERT_SQL, rows)
+    return rtree(connection), feature_count(connection)
+
+
+def test_point_blobs_envelope():
+    blobs = gpkg_sqlite.point_blobs(np.array([1570000.5, np.nan]), np.array([5180000.25, 1.0]), SRS_ID)
+    assert blobs[1] is None
+    assert gpkg_sqlite.point_blob_coordinates(blobs[0]) == (1570000.5, 5180000.25)
+    assert gpkg_sqlite.gpkg_envelope(blobs[0]) == (1570000.5, 1570000.5, 5180000.25, 5180000.25)
+
+
+def test_bulk_load_matches_row_by_row_insert(gpkg_connection, tmp_path):
+    rows = heli_points_rows([1570000, 1570010, np.nan], [5180000, 5180020, 5180040])
+    existing = heli_points_rows([1560000], [5170000], batch_id='PBX_0')
+    with gpkg_connection:
+        gpkg_connection.executemany(INSERT_SQL, existing)
+    before = triggers(gpkg_connection)
+
+    with gpkg_sqlite.bulk_load(gpkg_connection, 'heli_points'):
+        assert not any(i.startswith('rtree_heli_points_geom_insert') for i in triggers(gpkg_connection))
+        gpkg_connection.executemany(INSERT_SQL, rows)
+
+    assert (rtree(gpkg_connection), feature_count(gpkg_connection)) == row_by_row_rtree(
+        str(tmp_path / 'reference.gpkg'), existing + rows)
+    assert triggers(gpkg_connection) == before
+    extent = gpkg_connection.execute("SELECT min_x, max_x, min_y, max_y FROM gpkg_contents").fetchone()
+    assert extent == (1570000, 1570010, 5180000, 5180020)
+
+
+def test_bulk_load_rolls_back_on_error(gpkg_connection):
+    before = triggers(gpkg_connection)
+    synchronous = gpkg_connection.execute("PRAGMA synchronous").fetchone()[0]
+    with pytest.raises(RuntimeError):
+        with gpkg_sqlite.bulk_load(gpkg_connection, 'heli_points'):
+            gpkg_connection.executemany(INSERT_SQL, heli_points_rows([1570000], [5180000]))
+            raise RuntimeError('read failed')
+
+    assert gpkg_connection.execute("SELECT count(*) FROM heli_points").fetchone()[0] == 0
+    assert feature_count(gpkg_connection) == 0
+    assert rtree(gpkg_connection) == []
+    assert triggers(gpkg_connection) == before
+    assert gpkg_connection.execute("PRAGMA synchronous").fetchone()[0] == synchronous
+
+
+def test_delete_rows_keeps_rtree_and_count(gpkg_connection):
+    with gpkg_connection:
+        gpkg_connection.executemany(INSERT_SQL, heli_points_rows([1570000, 1570010], [5180000, 5180010], 'PBX_1'))
+        gpkg_connection.executemany(INSERT_SQL, heli_points_rows([1570020], [5180020], 'PBX_2'))
+    before = triggers(gpkg_connection)
+
+    assert gpkg_sqlite.delete_rows(gpkg_connection, 'heli_points', 'batch_id = ?', ('PBX_1',)) == 2
+
+    assert feature_count(gpkg_connection) == 1
+    assert [i[0] for i in rtree(gpkg_connection)] == [3]
+    assert triggers(gpkg_connection) == before
+    assert not gpkg_connection.in_transaction
+
+
+def test_delete_rows_in_a_transaction_rolls_back(gpkg_connection):
+    with gpkg_connection:
+        gpkg_connection.executemany(INSERT_SQL, heli_points_rows([1570000], [5180000]))
+    with pytest.raises(RuntimeError):
+        with gpkg_sqlite.transaction(gpkg_connection):
+            gpkg_sqlite.delete_rows(gpkg_connection, 'heli_points', 'batch_id = ?', ('PBX_1',))
+            raise RuntimeError('second table failed')
+
+    assert feature_count(gpkg_connection) == 1
+    assert len(rtree(gpkg_connection)) == 1
+
+
+def test_delete_rows_missing_table(gpkg_connection):
+    assert gpkg_sqlite.delete_rows(gpkg_connection, 'missing_table', 'batch_id = ?', ('PBX_1',)) == 0
+
+
+def test_create_gpkg_indexes_keeps_duplicate_rows(gpkg_connection):
+    with gpkg_connection:
+        gpkg_connection.executemany(INSERT_SQL, heli_points_rows([1570000, 1570010], [5180000, 5180010]))
+        gpkg_connection.executemany(INSERT_SQL, heli_points_rows([1570000], [5180000], 'PBX_2'))
+
+    created = gpkg_sqlite.create_gpkg_indexes(gpkg_connection)
+
+    assert gpkg_sqlite.HELI_POINTS_SRC_ID_INDEX not in created
+    assert 'idx_heli_points_batch_id' in created
+    assert gpkg_connection.execute("SELECT count(*) FROM heli_points").fetchone()[0] == 3
+    assert gpkg_sqlite.duplicate_rows(gpkg_connection, 'heli_points', ['machine_code', 'src_id']) == [3]
+
+    gpkg_sqlite.delete_rows(gpkg_connection, 'heli_points', 'fid = ?', (3,))
+    assert gpkg_sqlite.create_gpkg_indexes(gpkg_connection) == [gpkg_sqlite.HELI_POINTS_SRC_ID_INDEX]
+    assert gpkg_sqlite.index_exists(gpkg_connection, gpkg_sqlite.HELI_POINTS_SRC_ID_INDEX)
+
+
+def query_plan(connection, sql, parameters=()):
+    return ' '.join([i[-1] for i in connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters)])
+
+
+def test_gpkg_indexes_are_used_by_the_processing_queries(gpkg_connection):
+    with gpkg_connection:
+        gpkg_connection.executemany(INSERT_SQL, heli_points_rows([1570000, 1570010], [5180000, 5180010]))
+    created = gpkg_sqlite.create_gpkg_indexes(gpkg_connection)
+    # Only the layers in the gpkg are indexed
+    assert created == [index_name for index_name, unique, columns in gpkg_sqlite.GPKG_INDEXES['heli_points']]
+    assert gpkg_sqlite.create_gpkg_indexes(gpkg_connection) == []
+
+    assert 'idx_heli_points_machine_code_load_number' in query_plan(
+        gpkg_connection, "SELECT fid FROM heli_points WHERE machine_code = ? AND load_number = ? ORDER BY date_time",
+        ('PBX', 1))
+    assert 'idx_heli_points_batch_id' in query_plan(gpkg_connection, "DELETE FROM heli_points WHERE batch_id = ?",
+                                                    ('PBX_1',))
+
+    # A fix already loaded for the machine is skipped
+    with gpkg_connection:
+        gpkg_connection.executemany(INSERT_SQL.replace('INSERT', 'INSERT OR IGNORE'),
+                                    heli_points_rows([1570000, 1570020], [5180000, 5180020], 'PBX_2'))
+    assert gpkg_connection.execute("SELECT count(*) FROM heli_points").fetchone()[0] == 2
+
+
+def test_gpkg_indexes_skip_missing_columns(gpkg_connection):
+    indexes = {'heli_points': [('idx_heli_points_missing', False, ['machine_code', 'missing_column'])],
+               'missing_table': [('idx_missing_table_batch_id', False, ['batch_id'])]}
+    assert gpkg_sqlite.create_gpkg_indexes(gpkg_connection, indexes) == []
+    assert not gpkg_sqlite.index_exists(gpkg_connection, 'idx_heli_points_missing')
+
+
+def backup_layer_sql(table_name):
+    return point_layer_sql(table_name, HELI_POINTS_SQL.replace('heli_points', table_name, 1))
+
+
+def gpkg_tables(connection):
+    tables = [i[0] for i in connection.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger') "
+                                               "AND name LIKE '%heli_points%' ORDER BY name")]
+    for metadata_table in ['gpkg_contents', 'gpkg_geometry_columns', 'gpkg_ogr_contents']:
+        tables += [f"{metadata_table}:{i[0]}" for i in connection.execute(f"SELECT table_name FROM {metadata_table} "
+                                                                          f"ORDER BY table_name")]
+    return tables
+
+
+def fill_backup_layer(connection, table_name, count):
+    x = 1570000.0 + np.arange(count)
+    with connection:
+        connection.executemany(INSERT_SQL.replace('heli_points', table_name),
+                               [(blob, 'x' * 200, 'PBX', 'PBX_1') for blob in
+                                gpkg_sqlite.point_blobs(x, np.full(count, 5180000.0), SRS_ID)])
+
+
+def test_drop_tables_and_reclaim_space(tmp_path):
+    gpkg_path = create_gpkg(str(tmp_path / 'project.gpkg'),
+                            backup_layer_sql('heli_points_1') + backup_layer_sql('heli_points_2'))
+    connection = gpkg_sqlite.connect(gpkg_path)
+    tables = gpkg_tables(connection)
+    with connection:
+        connection.executemany(INSERT_SQL, heli_points_rows([1570000], [5180000]))
+    fill_backup_layer(connection, 'heli_points_1', 2000)
+    fill_backup_layer(connection, 'heli_points_2', 2000)
+
+    assert gpkg_sqlite.drop_tables(connection, ['heli_points_1', 'missing_table']) == ['heli_points_1']
+    # The rtree, triggers and metadata rows go with the table, the other layers are untouched
+    assert gpkg_tables(connection) == [i for i in tables if 'heli_points_1' not in i]
+    assert connection.execute("SELECT count(*) FROM heli_points").fetchone()[0] == 1
+
+    # GDAL creates gpkgs without auto vacuum, the first cleanup runs a full VACUUM
+    assert connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+    size = os.path.getsize(gpkg_path)
+    assert gpkg_sqlite.reclaim_space(connection) > 0
+    assert os.path.getsize(gpkg_path) < size
+    assert connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+    # Later cleanups use an incremental vacuum
+    gpkg_sqlite.drop_tables(connection, ['heli_points_2'])
+    size = os.path.getsize(gpkg_path)
+    assert gpkg_sqlite.reclaim_space(connection) > 0
+    assert os.path.getsize(gpkg_path) < size
+    assert connection.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    connection.close()
@@ -0,0 +1,56 @@
+# Open Flightline Mini
+
+# Description:
+# Checks the header only reads of the .dbf and the column reads against
+# a valid shapefile set and the broken sets found on USB sticks.
+
+import os
+import struct
+
+import pytest
+
+from open_flightline_mini import shapefile_reader
+
+from conftest import write_shapefile
+
+
+FIELDS = [('Time', 'C', 19, 0), ('Speed', 'N', 8, 2), ('GPS Alt', 'N', 8, 1)]
+
+
+@pytest.fixture
+def shp_path(tmp_path):
+    path = str(tmp_path / 'secondary.shp')
+    write_shapefile(path, [(1570000.0, 5180000.0), (1570010.0, 5180020.0)], FIELDS,
+                    [('2024-03-05T10:15:30', 80.5, 150), ('2024-03-05T10:15:31', '', 151)])
+    return path
+
+
+def test_valid_shapefile(shp_path):
+    assert shapefile_reader.shapefile_record_count(shp_path) == 2
+    assert shapefile_reader.shapefile_field_names(shp_path) == ['Time', 'Speed', 'GPS Alt']
+    columns = shapefile_reader.read_dbf_columns(shp_path, ['time', 'speed'])
+    assert list(columns) == ['time', 'speed']
+    assert columns['time'].tolist() == [b'2024-03-05T10:15:30', b'2024-03-05T10:15:31']
+    assert columns['speed'][0] == 80.5
+    assert columns['speed'][1] != columns['speed'][1]  # An empty number is nan
+    x, y = shapefile_reader.read_shp_points(shp_path)
+    assert x.tolist() == [1570000.0, 1570010.0]
+    assert y.tolist() == [5180000.0, 5180020.0]
+
+
+def test_missing_dbf(shp_path):
+    os.remove(f"{shp_path[:-4]}.dbf")
+    assert shapefile_reader.shapefile_record_count(shp_path) == 0
+    with pytest.raises(FileNotFoundError):
+        shapefile_reader.shapefile_field_names(shp_path)
+
+
+def test_truncated_dbf_header(shp_path):
+    dbf_path = f"{shp_path[:-4]}.dbf"
+    with open(dbf_path, 'rb') as dbf_file:
+        data = dbf_file.read()
+    with open(dbf_path, 'wb') as dbf_file:
+        dbf_file.write(data[:10])
+    assert shapefile_reader.shapefile_record_count(shp_path) == 0
+    with pytest.raises(struct.error):
+        shapefile_reader.shapefile_field_names(shp_path)
@@ -0,0 +1,74 @@
+# Open Flightline Mini
+
+# Description:
+# Checks the bulk timestamp parsing and formatting in timestamp_codec.
+
+import numpy as np
+import pytest
+
+from open_flightline_mini import timestamp_codec
+
+
+# 2024-03-05T10:15:30 as wall clock epoch seconds
+EPOCH = 1709633730
+
+
+def test_parse_timestamps_drops_the_utc_offset():
+    values = ['2024-03-05T10:15:30+13:00', '2024-03-05T10:15:30-05:00', '2024-03-05T10:15:30Z',
+              '2024-03-05T10:15:30', '2024-03-05 10:15:30', '2024-03-05T10:15:30.250+13:00']
+    assert timestamp_codec.parse_timestamps(values).tolist() == [EPOCH] * len(values)
+
+
+def test_parse_timestamps_fast_path_matches_slow_path():
+    values = ['2024-03-05T10:15:30+13:00', '2023-12-31T23:59:59', '2024-02-29 00:00:00']
+    expected = [timestamp_codec.parse_timestamp(i) for i in values]
+    assert timestamp_codec.parse_timestamps(values).tolist() == expected
+
+
+def test_parse_timestamps_falls_back_for_other_layouts():
+    values = ['05/03/2024 10:15:30', '2024/03/05 10:15:30', '2024-03-05T10:15:30+13:00']
+    assert timestamp_codec.parse_timestamps(values).tolist() == [EPOCH] * 3
+
+
+def test_parse_timestamps_milliseconds():
+    values = ['2024-03-05T10:15:30.25', '2024-03-05T10:15:30.250+13:00', '2024-03-05T10:15:30+13:00',
+              '2024-03-05T10:15:30.5Z']
+    expected = [EPOCH * 1000 + 250, EPOCH * 1000 + 250, EPOCH * 1000, EPOCH * 1000 + 500]
+    assert timestamp_codec.parse_timestamps(values, unit='ms').tolist() == expected
+
+
+def test_parse_timestamps_empty():
+    assert timestamp_codec.parse_timestamps([]).tolist() == []
+
+
+def test_parse_timestamps_rejects_unknown_text():
+    with pytest.raises(ValueError):
+        timestamp_codec.parse_timestamps(['2024-03-05T10:15:30', 'not a time'])
+
+
+def test_combine_date_time_dbf_dates():
+    dates = np.array([b'20240305', b'20240306'])
+    times = np.array([b'10:15:30', b'01:02:03'])
+    assert timestamp_codec.combine_date_time(dates, times).tolist() == [b'2024-03-05T10:15:30',
+                                                                         b'2024-03-06T01:02:03']
+
+
+def test_combine_date_time_iso_dates():
+    combined = timestamp_codec.combine_date_time(np.array([b'2024-03-05']), np.array([b'10:15:30']))
+    assert timestamp_codec.parse_timestamps(combined).tolist() == [EPOCH]
+
+
+def test_format_timestamps_round_trip():
+    epochs = np.array([EPOCH, EPOCH + 86400], dtype=np.int64)
+    text = timestamp_codec.format_timestamps(epochs)
+    assert text == ['2024-03-05T10:15:30', '2024-03-06T10:15:30']
+    assert timestamp_codec.parse_timestamps(text).tolist() == epochs.tolist()
+    assert timestamp_codec.format_timestamps(epochs, separator=' ')[0] == '2024-03-05 10:15:30'
+
+
+def test_format_timestamps_milliseconds():
+    assert timestamp_codec.format_timestamps([EPOCH * 1000 + 250], unit='ms') == ['2024-03-05T10:15:30.250']
+
+
+def test_format_timestamps_empty():
+    assert timestamp_codec.format_timestamps(np.array([], dtype=np.int64), separator=' ') == []
@@ -0,0 +1,66 @@
+# Open Flightline Mini
+
+# Description:
+# Runs the Tracmap cloud download against the local mock server, checking
+# the paging, the resume from the last sync and that a failed page does not
+# move the sync on.
+
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from open_flightline_mini import tracmap_cloud, tracmap_cloud_mock
+
+
+@pytest.fixture
+def cloud():
+    return tracmap_cloud_mock.MockTracmapCloud(jobs_per_machine=2, points_per_page=50, pages=3)
+
+
+@pytest.fixture
+def cloud_url(cloud):
+    server, url = tracmap_cloud_mock.start_mock_server(cloud)
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+def test_paged_download_resumes_from_the_last_sync(cloud, cloud_url):
+    points, last_sync = tracmap_cloud.download_machine_points(cloud_url, None, 'PBX', connections=2)
+    # 2 jobs of 3 pages, fetched over fewer connections than pages
+    assert len(points) == 300
+    assert len(np.unique(points['epoch'])) == 300
+    assert points['epoch'].min() == 1709625600000  # 2024-03-05T08:00:00 local time
+    assert last_sync == cloud.jobs['PBX-1']['updated']
+
+    points, resumed = tracmap_cloud.download_machine_points(cloud_url, None, 'PBX', last_sync)
+    assert len(points) == 0
+    assert resumed == last_sync
+
+    cloud.add_job(tracmap_cloud_mock.generate_job('PBX', 2, datetime(2024, 3, 5, 13, 0, 0), 50, 2))
+    points, resumed = tracmap_cloud.download_machine_points(cloud_url, None, 'PBX', last_sync)
+    assert len(points) == 100
+    assert points['epoch'].min() == 1709643600000  # 2024-03-05T13:00:00 local time
+    assert resumed == cloud.jobs['PBX-2']['updated']
+
+
+def test_unknown_machine_has_no_points(cloud_url):
+    points, last_sync = tracmap_cloud.download_machine_points(cloud_url, None, 'PBZ', '2024-03-05T08:02:30')
+    assert len(points) == 0
+    assert last_sync == '2024-03-05T08:02:30'
+
+
+@pytest.mark.parametrize('failure', [500, 404, 'truncated'])
+def test_failed_page_keeps_the_last_sync(cloud, cloud_url, failure):
+    cloud.failures[('PBX-1', 2)] = failure
+    client = tracmap_cloud.TracmapCloudClient(cloud_url, connections=1)
+    with pytest.raises(ConnectionError):
+        list(client.iter_machine_points('PBX', '2024-03-05T07:00:00'))
+    assert client.last_sync is None
+
+    # The next download picks up every page once the cloud is back
+    del cloud.failures[('PBX-1', 2)]
+    points, last_sync = tracmap_cloud.download_machine_points(cloud_url, None, 'PBX', '2024-03-05T07:00:00')
+    assert len(points) == 300
+    assert last_sync == cloud.jobs['PBX-1']['updated']
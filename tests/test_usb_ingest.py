@@ -0,0 +1,133 @@
+# Open Flightline Mini
+
+# Description:
+# Checks that the pipelined USB download only marks a job folder as stored
+# once its points have been written, so a failed job is imported again.
+
+import os
+
+import pytest
+
+pytest.importorskip('osgeo')
+
+from open_flightline_mini import data_reader
+
+from conftest import write_shapefile
+
+
+LOG_FIELDS = [('Time', 'C', 19, 0), ('Speed', 'N', 8, 2), ('GPS Alt', 'N', 8, 1), ('Width', 'N', 6, 1)]
+SECONDARY_FIELDS = [('Time', 'C', 19, 0), ('Speed', 'N', 8, 2), ('Heading', 'N', 6, 1), ('GPS Alt', 'N', 8, 1),
+                    ('Width', 'N', 6, 1)]
+
+
+def write_job(folder, start_second):
+    """A Tracmap lines export job with one baiting line and three secondary points"""
+    os.makedirs(folder)
+    start = f"2024-03-05T10:15:{start_second:02d}"
+    write_shapefile(os.path.join(folder, 'log.shp'), [[[(1570000.0, 5180000.0), (1570100.0, 5180000.0)]]],
+                    LOG_FIELDS, [(start, 97.2, 150, 40)])
+    write_shapefile(os.path.join(folder, 'secondary.shp'),
+                    [(1570200.0 + i, 5180000.0) for i in range(3)], SECONDARY_FIELDS,
+                    [(f"2024-03-05T10:16:{start_second + i:02d}", 60, 90, 150, 40) for i in range(3)])
+
+
+def write_usb(tmp_path, job_names):
+    usb = tmp_path / 'usb'
+    for i, job_name in enumerate(job_names):
+        write_job(str(usb / job_name), i * 10)
+    return str(usb)
+
+
+def download(usb, machine_folder, folder_name, chunk_size=data_reader.POINT_CHUNK_SIZE, fail_on_chunk=None):
+    """
+    Runs the pipeline with a stand in for the gpkg writer
+    :return: tuple(TracmapDataBatch, list<int>: size of each chunk written)
+    """
+    data_batch = data_reader.TracmapDataBatch([], None, 'EPSG:2193', 'EPSG:2193', 'PBX', f"PBX_{folder_name}")
+    ingest = data_reader.UsbIngest(data_batch, usb, os.path.join(machine_folder, folder_name), machine_folder)
+    written = []
+    try:
+        for points in data_batch.iter_point_chunks(chunk_size, folder_layers_source=ingest,
+                                                   folder_written=ingest.folder_written):
+            if len(written) == fail_on_chunk:
+                raise IOError('database is locked')
+            written.append(len(points))
+    finally:
+        ingest.close()
+    return data_batch, written
+
+
+def test_download_skips_written_jobs(tmp_path):
+    usb = write_usb(tmp_path, ['JOB1', 'JOB2'])
+    machine_folder = str(tmp_path / 'raw' / 'PBX')
+
+    data_batch, written = download(usb, machine_folder, '1_1000')
+    assert len(data_batch.src_paths) == 2
+    assert sum(written) > 6
+
+    data_batch, written = download(usb, machine_folder, '1_1001')
+    assert data_batch.src_paths == []
+    assert written == []
+
+
+def test_failed_parse_is_imported_by_the_next_download(tmp_path, monkeypatch):
+    usb = write_usb(tmp_path, ['JOB1'])
+    machine_folder = str(tmp_path / 'raw' / 'PBX')
+    read_datasource_folder = data_reader.read_datasource_folder
+
+    def corrupt_folder(*args):
+        raise ValueError('secondary.shp: dbf record length does not match field lengths')
+
+    monkeypatch.setattr(data_reader, 'read_datasource_folder', corrupt_folder)
+    with pytest.raises(ValueError):
+        download(usb, machine_folder, '1_1000')
+    assert data_reader.RawDataManifest(machine_folder).load().refresh().job_fingerprints() == {}
+
+    monkeypatch.setattr(data_reader, 'read_datasource_folder', read_datasource_folder)
+    data_batch, written = download(usb, machine_folder, '1_1001')
+    assert data_batch.src_paths == [os.path.join(machine_folder, '1_1001', 'JOB1')]
+    assert sum(written) > 3
+
+    data_batch, written = download(usb, machine_folder, '1_1002')
+    assert data_batch.src_paths == []
+
+
+def test_failed_chunk_write_keeps_only_the_written_jobs(tmp_path):
+    usb = write_usb(tmp_path, ['JOB1', 'JOB2'])
+    machine_folder = str(tmp_path / 'raw' / 'PBX')
+
+    # Each job has 5 points, the first job copied is written by the first two chunks
+    # and the second job fails in the third
+    with pytest.raises(IOError):
+        download(usb, machine_folder, '1_1000', chunk_size=3, fail_on_chunk=2)
+    stored = list(data_reader.RawDataManifest(machine_folder).load().refresh().job_fingerprints().values())
+    assert len(stored) == 1
+
+    data_batch, written = download(usb, machine_folder, '1_1001', chunk_size=3)
+    assert len(data_batch.src_paths) == 1
+    assert os.path.basename(data_batch.src_paths[0]) != os.path.basename(stored[0])
+    assert sum(written) == 5
+
+
+def test_worker_error_keeps_the_unwritten_jobs_pending(tmp_path, monkeypatch):
+    usb = write_usb(tmp_path, ['JOB1', 'JOB2'])
+    machine_folder = str(tmp_path / 'raw' / 'PBX')
+    read_datasource_folder = data_reader.read_datasource_folder
+
+    def read_folder(*args):
+        if args[-1].endswith('JOB2'):
+            raise ValueError('secondary.shp is truncated')
+        return read_datasource_folder(*args)
+
+    monkeypatch.setattr(data_reader, 'read_datasource_folder', read_folder)
+    # Any job parsed before JOB2 was still waiting for a full chunk when JOB2 failed
+    with pytest.raises(ValueError):
+        download(usb, machine_folder, '1_1000')
+    manifest = data_reader.RawDataManifest(machine_folder).load().refresh()
+    assert manifest.job_fingerprints() == {}
+    assert sorted(manifest.pending_jobs.values()) == [os.path.join('1_1000', 'JOB1'), os.path.join('1_1000', 'JOB2')]
+
+    monkeypatch.setattr(data_reader, 'read_datasource_folder', read_datasource_folder)
+    data_batch, written = download(usb, machine_folder, '1_1001')
+    assert len(data_batch.src_paths) == 2
+    assert sum(written) == 10
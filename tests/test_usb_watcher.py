@@ -0,0 +1,132 @@
+# Open Flightline Mini
+
+# Description:
+# Checks how the USB watcher finds the stick folders under the mount points,
+# which sticks it queues and the qgis_process command it runs, with
+# qgis_process replaced by a stand in.
+
+import json
+import os
+import subprocess
+
+import pytest
+
+pytest.importorskip('osgeo')
+
+from open_flightline_mini import gpkg_sqlite, usb_watcher
+
+from conftest import create_gpkg, write_shapefile
+
+
+@pytest.fixture
+def project_folder(tmp_path):
+    folder = tmp_path / 'project'
+    folder.mkdir()
+    gpkg_path = create_gpkg(str(folder / 'project.gpkg'))
+    connection = gpkg_sqlite.connect(gpkg_path)
+    with connection:
+        connection.execute("CREATE TABLE heli_info (fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, machine_code TEXT)")
+        connection.executemany("INSERT INTO heli_info (machine_code) VALUES (?)", [('pbx',), ('PBY',)])
+    connection.close()
+    with open(folder / 'project_config.json', 'w') as config_file:
+        json.dump({'project_gpkg': gpkg_path, 'op_day': 3}, config_file)
+    (folder / 'project.qgz').touch()
+    return str(folder)
+
+
+@pytest.fixture
+def media(tmp_path):
+    media = tmp_path / 'media'
+    media.mkdir()
+    return str(media)
+
+
+def write_stick(media, user, stick, job_names):
+    for job_name in job_names:
+        folder = os.path.join(media, user, stick, job_name)
+        os.makedirs(folder)
+        for shp_name in ['log.shp', 'secondary.shp']:
+            write_shapefile(os.path.join(folder, shp_name), [(1570000.0, 5180000.0)], [('Time', 'C', 19, 0)],
+                            [('2024-03-05T10:15:30',)])
+    return os.path.join(media, user, stick)
+
+
+def test_mount_detection(project_folder, media, tmp_path):
+    watcher = usb_watcher.UsbImportWatcher(project_folder, [media, str(tmp_path / 'not_mounted')])
+    assert watcher.mount_points == [media]
+    assert watcher.candidate_sources() == set()
+
+    stick = write_stick(media, 'pilot', 'TRACMAP', ['PBX_JOB1'])
+    os.makedirs(os.path.join(media, 'pilot', 'OTHER'))
+    assert watcher.candidate_sources() == {os.path.join(media, 'pilot'), stick,
+                                           os.path.join(media, 'pilot', 'OTHER')}
+    # Changes inside a stick belong to the stick, a new user folder is not a stick yet
+    assert watcher.source_for_path(os.path.join(stick, 'PBX_JOB1', 'log.shp')) == stick
+    assert watcher.source_for_path(stick) == stick
+    assert watcher.source_for_path(os.path.join(media, 'pilot')) is None
+    assert watcher.source_for_path(str(tmp_path / 'elsewhere' / 'a' / 'b')) is None
+
+
+def test_settled_sticks_are_queued_once(project_folder, media):
+    log = []
+    watcher = usb_watcher.UsbImportWatcher(project_folder, [media], debounce_seconds=60, log=log.append)
+    # The user folder is there before the watcher starts, as with run()
+    os.makedirs(os.path.join(media, 'pilot'))
+    watcher.known_sources = watcher.candidate_sources()
+    stick = write_stick(media, 'pilot', 'TRACMAP', ['PBX_JOB1'])
+    unknown = write_stick(media, 'pilot', 'OTHER', ['JOB1'])
+    empty = os.path.join(media, 'pilot', 'EMPTY')
+    os.makedirs(empty)
+
+    watcher.notice_new_sources()
+    # Still within the debounce time
+    watcher.queue_settled_sources()
+    assert watcher.imports.empty()
+
+    watcher.debounce_seconds = 0
+    watcher.queue_settled_sources()
+    assert watcher.imports.get_nowait() == (stick, 'PBX')
+    assert watcher.imports.empty()
+    assert any(i.startswith(f"{unknown}: No machine code") for i in log)
+    assert not watcher.pending
+
+    # A stick waiting for its import is not queued again
+    assert not watcher.queue_import(stick)
+    assert not watcher.queue_import(empty)
+
+
+def completed_process(returncode=0, tool_result='Finished', stderr=''):
+    stdout = json.dumps({'results': {'RESULTS': tool_result}})
+    return lambda command, **kwargs: subprocess.CompletedProcess(command, returncode, stdout, stderr)
+
+
+@pytest.mark.parametrize('incremental', [True, False])
+def test_qgis_process_command(project_folder, media, monkeypatch, incremental):
+    commands = []
+
+    def run(command, **kwargs):
+        commands.append(command)
+        return completed_process()(command, **kwargs)
+
+    monkeypatch.setattr(subprocess, 'run', run)
+    monkeypatch.setattr(usb_watcher.data_reader, 'current_download_time', lambda: '1015')
+    watcher = usb_watcher.UsbImportWatcher(project_folder, [media], incremental=incremental)
+    assert watcher.run_qgis_process_import('/media/pilot/TRACMAP', 'PBX') == 'Finished'
+    assert commands == [['qgis_process', '--json', 'run', usb_watcher.COPY_TRACMAP_ALGORITHM,
+                         f"--PROJECT_PATH={os.path.join(project_folder, 'project.qgz')}", '--',
+                         f"PROJECT_FOLDER={project_folder}",
+                         f"PROJECT_GPKG={os.path.join(project_folder, 'project.gpkg')}",
+                         'TRACMAP_DATA_SOURCE=/media/pilot/TRACMAP',
+                         'MACHINE_CODE=PBX',
+                         'DAY_NUMBER=3',
+                         'DOWNLOAD_TIME=1015',
+                         f"INCREMENTAL={'true' if incremental else 'false'}"]]
+
+
+@pytest.mark.parametrize('process', [completed_process(returncode=1, stderr='Algorithm not found'),
+                                     completed_process(tool_result=None)])
+def test_failed_qgis_process_import(project_folder, media, monkeypatch, process):
+    monkeypatch.setattr(subprocess, 'run', process)
+    watcher = usb_watcher.UsbImportWatcher(project_folder, [media])
+    with pytest.raises(RuntimeError):
+        watcher.run_qgis_process_import('/media/pilot/TRACMAP', 'PBX')